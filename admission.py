@@ -0,0 +1,406 @@
+"""Admission control for recognition work.
+
+Work is measured in seconds of audio rather than in requests. Each tenant
+draws from a token bucket of audio-seconds, shared across workers through
+Redis. Each worker runs at most max_active recognitions at a time. The rest
+wait in weighted fair order, so a tenant's hour-long uploads queue behind
+that tenant's own work rather than everyone else's. A request whose
+estimated wait exceeds max_wait is refused with a Retry-After hint instead
+of queueing until the gunicorn timeout.
+
+A separate per-worker ledger of upload and decoded-audio bytes keeps
+concurrent large uploads from running a worker out of memory.
+"""
+import asyncio
+import hashlib
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Refill, then take the cost if the bucket holds min(cost, burst) tokens.
+# The balance may go negative, so uploads longer than the burst are still
+# admitted once the bucket is full and are paid off afterwards.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+local updated = tonumber(redis.call('HGET', KEYS[1], 'updated'))
+if tokens == nil or updated == nil then
+    tokens = burst
+    updated = now
+end
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= math.min(cost, burst) then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+return {allowed, tostring(tokens)}
+"""
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is refused; retry_after is in seconds"""
+
+    def __init__(self, message, retry_after, reason):
+        super().__init__(message)
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        self.reason = reason
+
+
+class TokenBuckets:
+    """Per-tenant token buckets of audio-seconds, in Redis when available"""
+
+    def __init__(self, redis_client=None, rate=60.0, burst=7200.0, overrides=None, prefix="stt:quota"):
+        self.redis = redis_client
+        self.rate = rate
+        self.burst = burst
+        self.overrides = overrides or {}
+        self.prefix = prefix
+        self._local = {}
+        self._lock = threading.Lock()
+        if redis_client is not None:
+            self._script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def limits(self, tenant):
+        """(rate, burst) for a tenant; a rate of 0 means unlimited"""
+        rate, burst = self.overrides.get(tenant, (self.rate, self.burst))
+        return float(rate), float(burst)
+
+    def take(self, tenant, cost):
+        """Take cost audio-seconds; returns 0 if taken, else seconds until it would be.
+
+        A negative cost returns tokens, e.g. for work that was never run.
+        """
+        rate, burst = self.limits(tenant)
+        if rate <= 0:
+            return 0.0
+        now = time.time()
+        if self.redis is not None:
+            # Tenant ids may be API keys, so only a digest goes into Redis
+            key = f"{self.prefix}:{hashlib.blake2b(tenant.encode(), digest_size=16).hexdigest()}"
+            try:
+                allowed, tokens = self._script(keys=[key], args=[rate, burst, now, cost])
+                return 0.0 if int(allowed) else (min(cost, burst) - float(tokens)) / rate
+            except Exception as e:
+                logger.warning(f"Quota store unavailable, using per-worker buckets: {e}")
+
+        with self._lock:
+            tokens, updated = self._local.get(tenant, (burst, now))
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            if tokens >= min(cost, burst):
+                self._local[tenant] = (tokens - cost, now)
+                return 0.0
+            self._local[tenant] = (tokens, now)
+            return (min(cost, burst) - tokens) / rate
+
+
+class _Waiter:
+    __slots__ = ("tenant", "cost", "tag", "event", "granted")
+
+    def __init__(self, tenant, cost, tag, event):
+        self.tenant = tenant
+        self.cost = cost
+        self.tag = tag
+        self.event = event
+        self.granted = False
+
+
+class _FutureEvent:
+    """Event-like wake-up for a waiter on an asyncio loop; set() may come from any thread"""
+
+    def __init__(self, loop, future):
+        self.loop = loop
+        self.future = future
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+    def set(self):
+        self.loop.call_soon_threadsafe(self._resolve)
+
+
+class AdmissionController:
+    """Quota checks, a bounded number of running recognitions and a fair wait queue.
+
+    Waiters are ordered by virtual finish time: a tenant's previous finish
+    tag plus the audio-seconds it asks for. Short requests from a quiet
+    tenant go ahead of a busy tenant's backlog. Wait estimates use an
+    average of observed wall seconds per audio-second.
+    """
+
+    def __init__(self, buckets, max_active=4, max_wait=60.0, initial_ratio=0.1):
+        self.buckets = buckets
+        self.max_active = max_active
+        self.max_wait = max_wait
+        self.ratio = initial_ratio
+        self._lock = threading.Lock()
+        self._heap = []
+        self._seq = itertools.count()
+        self._finish = {}
+        self._virtual = 0.0
+        self._active = 0
+        self._active_audio = 0.0
+        self._queued_audio = 0.0
+        self.admitted = 0
+        self.rejected = 0
+
+    def _reject(self, reason, retry_after, message):
+        self.rejected += 1
+        metrics.ADMISSION_REJECTED.labels(reason=reason).inc()
+        raise AdmissionRejected(message, retry_after, reason)
+
+    def _estimate_wait(self, tag):
+        """Seconds until a request with this finish tag would start; call with the lock held"""
+        if self._active < self.max_active and not self._heap:
+            return 0.0
+        ahead = sum(waiter.cost for _, _, waiter in self._heap if waiter.tag <= tag)
+        return (ahead + self._active_audio / 2.0) * self.ratio / self.max_active
+
+    def _tag(self, tenant, cost):
+        return max(self._virtual, self._finish.get(tenant, 0.0)) + cost
+
+    def check(self, tenant):
+        """Cheap refusal before any decoding: tenant in quota debt, or the queue already too long"""
+        retry = self.buckets.take(tenant, 0)
+        if retry > 0:
+            self._reject("quota", retry, "Audio quota exceeded")
+        with self._lock:
+            wait = self._estimate_wait(self._tag(tenant, 0.0))
+        if wait > self.max_wait:
+            self._reject("overloaded", wait - self.max_wait, "Server is overloaded")
+
+    def charge(self, tenant, audio_seconds):
+        """Take quota for audio recognized by another request, e.g. a coalesced duplicate"""
+        retry = self.buckets.take(tenant, audio_seconds)
+        if retry > 0:
+            self._reject("quota", retry, f"Audio quota exceeded; {audio_seconds:.0f}s of audio requested")
+
+    def _begin(self, tenant, audio_seconds, event):
+        """Reject or queue a request; event is set once it holds a slot"""
+        with self._lock:
+            wait = self._estimate_wait(self._tag(tenant, audio_seconds))
+        if wait > self.max_wait:
+            self._reject("overloaded", wait - self.max_wait,
+                         f"Estimated wait of {wait:.0f}s exceeds {self.max_wait:.0f}s")
+        retry = self.buckets.take(tenant, audio_seconds)
+        if retry > 0:
+            self._reject("quota", retry, f"Audio quota exceeded; {audio_seconds:.0f}s of audio requested")
+        return self._enqueue(tenant, audio_seconds, event)
+
+    def _abandon(self, waiter):
+        """Take a waiter out of the queue; returns False if it was granted a slot meanwhile"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._heap = [entry for entry in self._heap if entry[2] is not waiter]
+            heapq.heapify(self._heap)
+            self._queued_audio -= waiter.cost
+            metrics.ADMISSION_QUEUED_AUDIO.dec(waiter.cost)
+        self.buckets.take(waiter.tenant, -waiter.cost)
+        return True
+
+    def _timed_out(self, waiter):
+        if self._abandon(waiter):
+            self._reject("timeout", self.max_wait, "Timed out waiting for a recognition slot")
+
+    @contextmanager
+    def admit(self, tenant, audio_seconds):
+        """Hold a recognition slot for audio_seconds of work, waiting in fair order"""
+        waiter = self._begin(tenant, audio_seconds, threading.Event())
+        if not waiter.event.wait(self.max_wait):
+            self._timed_out(waiter)
+
+        self.admitted += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(waiter, time.perf_counter() - start)
+
+    @asynccontextmanager
+    async def admit_async(self, tenant, audio_seconds):
+        """admit() for coroutines: waiting for a slot does not block the event loop"""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+        # Quota checks talk to Redis, so they run off the loop
+        waiter = await asyncio.to_thread(self._begin, tenant, audio_seconds, _FutureEvent(loop, granted))
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), self.max_wait)
+        except asyncio.TimeoutError:
+            self._timed_out(waiter)
+        except asyncio.CancelledError:
+            if not self._abandon(waiter):
+                self._release(waiter, None)
+            raise
+
+        self.admitted += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(waiter, time.perf_counter() - start)
+
+    def _enqueue(self, tenant, cost, event):
+        with self._lock:
+            waiter = _Waiter(tenant, cost, self._tag(tenant, cost), event)
+            self._finish[tenant] = waiter.tag
+            if self._active < self.max_active and not self._heap:
+                self._grant(waiter)
+            else:
+                heapq.heappush(self._heap, (waiter.tag, next(self._seq), waiter))
+                self._queued_audio += cost
+                metrics.ADMISSION_QUEUED_AUDIO.inc(cost)
+        return waiter
+
+    def _grant(self, waiter):
+        """Start a waiter; call with the lock held"""
+        self._active += 1
+        self._active_audio += waiter.cost
+        self._virtual = max(self._virtual, waiter.tag - waiter.cost)
+        waiter.granted = True
+        metrics.ADMISSION_ACTIVE.inc()
+        waiter.event.set()
+
+    def _release(self, waiter, elapsed):
+        with self._lock:
+            self._active -= 1
+            self._active_audio -= waiter.cost
+            metrics.ADMISSION_ACTIVE.dec()
+            if elapsed is not None and waiter.cost > 0:
+                self.ratio = 0.8 * self.ratio + 0.2 * (elapsed / waiter.cost)
+            while self._heap and self._active < self.max_active:
+                _, _, next_waiter = heapq.heappop(self._heap)
+                self._queued_audio -= next_waiter.cost
+                metrics.ADMISSION_QUEUED_AUDIO.dec(next_waiter.cost)
+                self._grant(next_waiter)
+            # Tags at or behind the virtual clock no longer affect ordering
+            if len(self._finish) > 1024:
+                self._finish = {t: tag for t, tag in self._finish.items() if tag > self._virtual}
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": self._active,
+                "queued": len(self._heap),
+                "queued_audio_seconds": round(self._queued_audio, 1),
+                "seconds_per_audio_second": round(self.ratio, 4),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
+
+
+class MemoryLedger:
+    """Bytes of uploads and decoded audio held by requests in this worker.
+
+    A reservation that would take the total past limit waits up to
+    max_wait for others to finish, then is refused. One request is always
+    let through on its own, however large, so nothing waits forever.
+    """
+
+    def __init__(self, limit, max_wait=10.0):
+        self.limit = limit
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.peak = 0
+        self.deferred = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+        self._async_waiters = set()
+
+    def _fits(self, nbytes):
+        return not self.in_flight or self.in_flight + nbytes <= self.limit
+
+    def _take(self, nbytes):
+        """Reserve nbytes if they fit; call with the condition held"""
+        if not self._fits(nbytes):
+            return False
+        self.in_flight += nbytes
+        self.peak = max(self.peak, self.in_flight)
+        metrics.MEMORY_IN_FLIGHT.inc(nbytes)
+        return True
+
+    def _give_back(self, nbytes):
+        with self._cond:
+            self.in_flight -= nbytes
+            metrics.MEMORY_IN_FLIGHT.dec(nbytes)
+            self._cond.notify_all()
+            waiters, self._async_waiters = self._async_waiters, set()
+        for waiter in waiters:
+            waiter.set()
+
+    def _refuse(self, nbytes):
+        self.rejected += 1
+        metrics.ADMISSION_REJECTED.labels(reason="memory").inc()
+        raise AdmissionRejected(f"Not enough memory for {nbytes / 2 ** 20:.0f} MB of audio", self.max_wait, "memory")
+
+    @contextmanager
+    def reserve(self, nbytes):
+        """Hold nbytes of the worker's budget, waiting for room if needed"""
+        nbytes = int(nbytes)
+        if not self.limit:
+            yield
+            return
+        with self._cond:
+            if not self._take(nbytes):
+                self.deferred += 1
+                if not self._cond.wait_for(lambda: self._take(nbytes), self.max_wait):
+                    self._refuse(nbytes)
+        try:
+            yield
+        finally:
+            self._give_back(nbytes)
+
+    @asynccontextmanager
+    async def reserve_async(self, nbytes):
+        """reserve() for coroutines"""
+        nbytes = int(nbytes)
+        if not self.limit:
+            yield
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        counted = False
+        while True:
+            with self._cond:
+                if self._take(nbytes):
+                    break
+                future = loop.create_future()
+                self._async_waiters.add(_FutureEvent(loop, future))
+            if not counted:
+                self.deferred += 1
+                counted = True
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                self._refuse(nbytes)
+            try:
+                await asyncio.wait_for(future, remaining)
+            except asyncio.TimeoutError:
+                pass
+        try:
+            yield
+        finally:
+            self._give_back(nbytes)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "in_flight_bytes": self.in_flight,
+                "peak_bytes": self.peak,
+                "limit_bytes": self.limit,
+                "deferred": self.deferred,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,468 @@
+"""Async-native serving mode for /transcribe.
+
+The upload is decoded by an ffmpeg subprocess the event loop waits on and
+recognized with SpeechAsyncClient, so an idle request costs a coroutine
+rather than a thread. One worker process can then hold hundreds of
+transcriptions in flight while they wait on the network:
+
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker \
+        gunicorn --config gunicorn_config.py async_server:app
+
+Configuration, the result cache, quotas and metrics are shared with
+server.py. Jobs, batch and live streaming stay on the threaded server.
+"""
+import asyncio
+import io
+import os
+import time
+from contextlib import ExitStack, asynccontextmanager
+
+from quart import Quart, Response, jsonify, request
+from werkzeug.utils import secure_filename
+from google.api_core.exceptions import DeadlineExceeded
+from google.cloud import speech_v1p1beta1 as speech
+
+import metrics
+from admission import AdmissionController, AdmissionRejected
+from audio import (AudioDecodeError, AudioTooLong, decode_to_pcm_async, decode_with_soundfile, encode_for_upstream,
+                   read_pcm16)
+from cache import file_digest, make_cache_key
+from chunking import shift_results, merge_channels, merge_results, results_end, split_channels
+from results import TEXT_CONTENT_TYPES, render_results, response_to_dicts
+from server import (Config, admission, allowed_file, build_recognition_config, cache_options, cached_chunk,
+                    channel_options, check_duration, chunk_cache_key, debug_denied, init_worker, long_audio_chunks,
+                    long_audio_parallelism, memory, memory_estimate, memory_profiler, metric_labels,
+                    parse_output_format, parse_transcription_options, passthrough_encoding, pcm_spool, probe_upload,
+                    profile_response_headers, profile_seconds, prune_pcm, record_upstream, separate_channel_count,
+                    transcription_cache, upstream_policy)
+from profiler import SamplingProfiler, end_profile, try_start_profile
+from speech_pool import AsyncSpeechClientPool
+from upstream import LatencyTracker, deadline
+from vad import remap_results
+
+app = Quart(__name__)
+app.config["MAX_CONTENT_LENGTH"] = Config.MAX_CONTENT_LENGTH
+app.config["BODY_TIMEOUT"] = Config.REQUEST_TIMEOUT
+
+# Concurrent recognitions per worker; the threaded server's limit is THREAD_POOL_SIZE
+ASYNC_MAX_IN_FLIGHT = int(os.getenv('ASYNC_MAX_IN_FLIGHT', '256'))
+
+# Same quotas and fair queueing as server.py, sized for coroutines instead of threads
+async_admission = AdmissionController(
+    admission.buckets,
+    max_active=ASYNC_MAX_IN_FLIGHT,
+    max_wait=Config.ADMISSION_MAX_WAIT
+)
+
+speech_clients = AsyncSpeechClientPool(
+    size=Config.SPEECH_CLIENT_POOL_SIZE,
+    credentials_path=Config.CREDENTIALS_PATH,
+    endpoint=Config.SPEECH_ENDPOINT
+)
+
+# Identical uploads in flight in this worker share one task
+_in_flight = {}
+
+
+@app.before_serving
+async def warmup():
+    # Speech clients belong to this worker's event loop, so init_worker leaves them to us
+    await asyncio.to_thread(init_worker, False)
+    if Config.WORKER_WARMUP:
+        await speech_clients.warmup()
+
+
+@app.after_serving
+async def shutdown():
+    await speech_clients.close()
+
+
+@app.after_request
+async def add_cors_headers(response):
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    response.headers["Access-Control-Allow-Headers"] = "Content-Type, X-API-Key"
+    return response
+
+
+async def recognize(content, language_code, config_options, encoding=None):
+    """Async counterpart of server.transcribe_with_google_client"""
+    pcm_size = None
+    if encoding is None:
+        pcm_size = len(content)
+        with metrics.stage("encode"):
+            content, encoding = await asyncio.to_thread(
+                encode_for_upstream, content, Config.SAMPLE_RATE, Config.CHANNELS, Config.UPSTREAM_ENCODING)
+
+    config = build_recognition_config(language_code, config_options, encoding)
+    audio = speech.RecognitionAudio(content=content)
+    start = time.time()
+    with metrics.stage("recognize"):
+        # Same deadline, retries and hedging as the threaded server; the policy retries, not the client
+        response = await upstream_policy.call_async(
+            lambda timeout: speech_clients.recognize(config=config, audio=audio, timeout=timeout, retry=None),
+            LatencyTracker.key(encoding, len(content)))
+    record_upstream(content, encoding, pcm_size, language_code, config.model, time.time() - start)
+
+    with metrics.stage("build_results"):
+        results = response_to_dicts(response)
+    memory_profiler.checkpoint()
+    return results
+
+
+async def recognize_long(pcm, language_code, config_options):
+    """Split long PCM at quiet points and recognize the chunks concurrently
+
+    pcm is a file object; a chunk is read from it only once a slot is free.
+    In incremental mode chunks already in the chunk cache are not sent again.
+    """
+    chunks = long_audio_chunks(pcm)
+    slots = asyncio.Semaphore(long_audio_parallelism())
+    reused = []
+
+    async def run_chunk(offset, content):
+        try:
+            key = await asyncio.to_thread(chunk_cache_key, content, language_code, config_options)
+            results = await asyncio.to_thread(cached_chunk, key, content) if key else None
+            if results is not None:
+                reused.append(offset)
+            else:
+                results = await recognize(content, language_code, config_options)
+                if key:
+                    await asyncio.to_thread(transcription_cache.set, key, results)
+            return shift_results(results, offset)
+        finally:
+            slots.release()
+
+    tasks = []
+    try:
+        while True:
+            await slots.acquire()
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                slots.release()
+                break
+            tasks.append(asyncio.ensure_future(run_chunk(*chunk)))
+        results = merge_results(await asyncio.gather(*tasks))
+        app.logger.info(f"Long audio split into {len(tasks)} chunks, {len(reused)} from the chunk cache")
+        return results
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+@asynccontextmanager
+async def admitted(tenant, audio_seconds):
+    """Hold an admission slot for audio_seconds of recognition, timing the wait"""
+    if not Config.ADMISSION_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    async with async_admission.admit_async(tenant, audio_seconds):
+        timer = metrics.current_request()
+        if timer:
+            timer.add("admission", time.perf_counter() - start)
+        yield
+
+
+async def recognize_channel(pcm, speech_map, language_code, config_options, channel_tag):
+    """Async counterpart of server.transcribe_channel"""
+    size = pcm.seek(0, io.SEEK_END)
+    pcm.seek(0)
+    if speech_map is not None and not speech_map.kept_seconds:
+        results = []
+    elif Config.LONG_AUDIO_ENABLED and size / float(2 * Config.SAMPLE_RATE) > Config.LONG_AUDIO_CHUNK_SECONDS:
+        results = await recognize_long(pcm, language_code, config_options)
+    else:
+        results = await recognize(await asyncio.to_thread(pcm.read), language_code, config_options)
+    if speech_map is not None:
+        remap_results(results, speech_map)
+    for result in results:
+        result["channel_tag"] = channel_tag
+    return results
+
+
+async def recognize_channels(stream, info, extension, channels, language_code, config_options, tenant):
+    """Async counterpart of server.transcribe_channels"""
+    with ExitStack() as stack:
+        pcms = [stack.enter_context(pcm_spool(2 * channels)) for _ in range(channels)]
+        with pcm_spool(2) as interleaved:
+            with metrics.stage("decode"):
+                if info["format"] in ("WAV", "FLAC"):
+                    await asyncio.to_thread(decode_with_soundfile, stream, Config.SAMPLE_RATE, channels, interleaved)
+                else:
+                    await decode_to_pcm_async(stream, Config.SAMPLE_RATE, channels, format=extension,
+                                              ffmpeg=Config.FFMPEG_BINARY, output=interleaved)
+            check_duration(interleaved.tell() / float(2 * Config.SAMPLE_RATE * channels))
+            interleaved.seek(0)
+            with metrics.stage("split_channels"):
+                await asyncio.to_thread(split_channels, interleaved, channels, pcms)
+
+        speech_maps = [await asyncio.to_thread(prune_pcm, pcm) for pcm in pcms]
+        duration = sum(speech_map.kept_seconds if speech_map is not None
+                       else pcm.tell() / float(2 * Config.SAMPLE_RATE) for pcm, speech_map in zip(pcms, speech_maps))
+        options = channel_options(config_options)
+        async with admitted(tenant, duration):
+            results = merge_channels(await asyncio.gather(*(
+                recognize_channel(pcm, speech_map, language_code, options, tag)
+                for tag, (pcm, speech_map) in enumerate(zip(pcms, speech_maps), start=1))))
+    app.logger.info(f"Recognized {channels} channels separately")
+    return results
+
+
+async def transcribe(stream, filename, language, config_options, tenant):
+    """Decode and recognize one upload; the caller has already missed the cache and admission checks"""
+    extension = filename.rsplit('.', 1)[-1].lower()
+    with metrics.stage("probe"):
+        info = await asyncio.to_thread(probe_upload, stream, extension)
+    passthrough = passthrough_encoding(info)
+    channels = separate_channel_count(info, config_options)
+
+    async with memory.reserve_async(memory_estimate(stream, info, channels)):
+        if channels:
+            # One party per channel: recognized side by side instead of diarized from a mix
+            return await recognize_channels(stream, info, extension, channels, language, config_options, tenant)
+
+        if passthrough in ("OGG_OPUS", "FLAC"):
+            # Already in a recognizer-native encoding at the right rate; send it as is
+            options = dict(config_options, sample_rate_hertz=info["sample_rate"])
+            data = await asyncio.to_thread(stream.read)
+            async with admitted(tenant, info["duration"]):
+                return await recognize(data, language, options, passthrough)
+
+        with pcm_spool() as pcm:
+            with metrics.stage("decode"):
+                if passthrough == "LINEAR16":
+                    await asyncio.to_thread(read_pcm16, stream, pcm)
+                elif passthrough == "RESAMPLE":
+                    await asyncio.to_thread(decode_with_soundfile, stream, Config.SAMPLE_RATE, Config.CHANNELS, pcm)
+                else:
+                    await decode_to_pcm_async(stream, Config.SAMPLE_RATE, Config.CHANNELS, format=extension,
+                                              ffmpeg=Config.FFMPEG_BINARY, output=pcm)
+
+            duration = pcm.tell() / float(2 * Config.SAMPLE_RATE * Config.CHANNELS)
+            check_duration(duration)
+            speech_map = await asyncio.to_thread(prune_pcm, pcm)
+            if speech_map is not None:
+                duration = speech_map.kept_seconds
+            pcm.seek(0)
+            async with admitted(tenant, duration):
+                if speech_map is not None and not duration:
+                    # Nothing but silence or music; no need to ask the recognizer
+                    results = []
+                elif Config.LONG_AUDIO_ENABLED and duration > Config.LONG_AUDIO_CHUNK_SECONDS:
+                    results = await recognize_long(pcm, language, config_options)
+                else:
+                    results = await recognize(await asyncio.to_thread(pcm.read), language, config_options)
+            if speech_map is not None:
+                remap_results(results, speech_map)
+            return results
+
+
+async def transcribe_upload(stream, filename, language, config_options, tenant):
+    """Async counterpart of server.transcribe_upload; returns (results, cached)"""
+    with metrics.stage("hash"):
+        audio_digest = await asyncio.to_thread(file_digest, stream)
+    stream.seek(0)
+    cache_key = make_cache_key(audio_digest, language, cache_options(config_options))
+
+    with metrics.stage("cache_lookup"):
+        cached_result = await asyncio.to_thread(transcription_cache.get, cache_key)
+    timer = metrics.current_request()
+    if cached_result is not None:
+        app.logger.info(f"Cache hit for file: {filename}")
+        if timer:
+            timer.cache = "hit"
+        return cached_result, True
+
+    # Refuse before decoding, or joining another request, if the tenant is out
+    # of quota or the queue is already too long
+    if Config.ADMISSION_ENABLED:
+        await asyncio.to_thread(async_admission.check, tenant)
+
+    task = _in_flight.get(cache_key) if Config.SINGLEFLIGHT_ENABLED else None
+    while task is not None:
+        try:
+            results = await asyncio.shield(task)
+        except AdmissionRejected:
+            # Refused for the leader's tenant or this worker's memory; lead, or follow whoever leads next
+            failed, task = task, _in_flight.get(cache_key)
+            if task is failed:
+                task = None
+            continue
+        app.logger.info(f"Coalesced with in-flight request for file: {filename}")
+        if timer:
+            timer.cache = "coalesced"
+        if Config.ADMISSION_ENABLED:
+            # Charged to this request's own tenant for the audio the shared transcript covers
+            await asyncio.to_thread(async_admission.charge, tenant, results_end(results))
+        return results, True
+
+    async def run():
+        # Every recognize call made for this upload, chunks included, shares one deadline
+        with deadline(Config.REQUEST_TIMEOUT):
+            results = await transcribe(stream, filename, language, config_options, tenant)
+        await asyncio.to_thread(transcription_cache.set, cache_key, results)
+        return results
+
+    task = asyncio.ensure_future(run())
+    _in_flight[cache_key] = task
+    task.add_done_callback(lambda _: _in_flight.pop(cache_key, None))
+    # Shielded so a disconnecting client does not cancel work others are waiting on
+    return await asyncio.shield(task), False
+
+
+@app.route("/health", methods=["GET"])
+async def health_check():
+    return jsonify({
+        "status": "healthy",
+        "timestamp": int(time.time()),
+        "mode": "async",
+        "in_flight": len(_in_flight),
+        "cache": transcription_cache.stats(),
+        "admission": async_admission.stats(),
+        "memory": memory.stats(),
+        "speech_clients": speech_clients.stats()
+    })
+
+
+@app.route("/metrics", methods=["GET"])
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
+@app.route("/transcribe", methods=["POST"])
+async def handle_transcribe():
+    """Same contract as /transcribe on the threaded server"""
+    timer = metrics.start_request("transcribe_async")
+    tracked = memory_profiler.start_request("transcribe_async", request.content_length)
+    status = "error"
+    start = time.time()
+    try:
+        with metrics.stage("upload"):
+            files = await request.files
+            form = await request.form
+        file = files.get("file")
+        if file is None:
+            status = "rejected"
+            return jsonify({"error": "No file provided"}), 400
+        if file.filename == "":
+            status = "rejected"
+            return jsonify({"error": "No file selected"}), 400
+        if not allowed_file(file.filename):
+            status = "rejected"
+            return jsonify({
+                "error": f"File type not allowed. Allowed types: {list(Config.ALLOWED_EXTENSIONS)}"
+            }), 400
+
+        filename = secure_filename(file.filename)
+        language, config_options = parse_transcription_options(form)
+        timer.language, timer.model = metric_labels(language, config_options["model"])
+        tenant = request.headers.get("X-API-Key") or request.remote_addr or "anonymous"
+
+        # The upload stays in the temp file the form parser spooled it to
+        results, cached = await transcribe_upload(file.stream, filename, language, config_options, tenant)
+        status = "ok"
+        with metrics.stage("serialize"):
+            output_format, binary_timings = parse_output_format(form)
+            output = await asyncio.to_thread(render_results, results, output_format, binary_timings)
+        if output_format in TEXT_CONTENT_TYPES:
+            return Response(output, content_type=TEXT_CONTENT_TYPES[output_format])
+
+        body = {
+            "success": True,
+            "results": output,
+            "language": language,
+            "cached": cached
+        }
+        if output_format == "compact":
+            body["format"] = "compact"
+        if not cached:
+            body["processing_time"] = time.time()
+        return jsonify(body)
+
+    except AudioTooLong as e:
+        status = "rejected"
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "timestamp": int(time.time())
+        }), 413
+    except AudioDecodeError as e:
+        status = "rejected"
+        return jsonify({
+            "success": False,
+            "error": f"Could not decode audio: {e}",
+            "timestamp": int(time.time())
+        }), 400
+    except AdmissionRejected as e:
+        status = "throttled"
+        response = jsonify({
+            "success": False,
+            "error": str(e),
+            "retry_after": e.retry_after,
+            "timestamp": int(time.time())
+        })
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+    except DeadlineExceeded as e:
+        status = "timeout"
+        app.logger.error(f"Request deadline exceeded: {e}")
+        return jsonify({
+            "success": False,
+            "error": "Recognition did not finish within the request timeout",
+            "timestamp": int(time.time())
+        }), 504
+    except Exception as e:
+        app.logger.error(f"Error processing request: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "timestamp": int(time.time())
+        }), 500
+    finally:
+        timer.finish(status)
+        memory_profiler.finish_request(tracked)
+        app.logger.info(f"handle_transcribe took {time.time() - start:.2f} seconds")
+
+
+@app.route("/debug/profile", methods=["GET"])
+async def debug_profile():
+    """Same contract as /debug/profile on the threaded server; the event loop keeps serving meanwhile"""
+    denied = debug_denied(request.headers)
+    if denied:
+        return jsonify({"error": denied[0]}), denied[1]
+    try:
+        seconds = profile_seconds(request.args)
+    except ValueError:
+        return jsonify({"error": "seconds must be a number"}), 400
+    if not try_start_profile():
+        return jsonify({"error": "A profile is already running in this worker"}), 409
+    try:
+        sampler = await SamplingProfiler(Config.PROFILE_INTERVAL).profile_async(seconds)
+    finally:
+        end_profile()
+    idle = request.args.get("idle", "false").lower() == "true"
+    return Response(sampler.collapsed(idle), content_type="text/plain; charset=utf-8",
+                    headers=profile_response_headers(sampler))
+
+
+@app.route("/debug/memory", methods=["GET", "POST"])
+async def debug_memory():
+    """Same contract as /debug/memory on the threaded server"""
+    denied = debug_denied(request.headers)
+    if denied:
+        return jsonify({"error": denied[0]}), denied[1]
+    if request.method == "POST":
+        action = request.args.get("action")
+        if action == "start":
+            frames = request.args.get("frames", "10")
+            if not frames.isdigit() or int(frames) < 1:
+                return jsonify({"error": "frames must be a positive integer"}), 400
+            await asyncio.to_thread(memory_profiler.start, int(frames))
+        elif action == "stop":
+            memory_profiler.stop()
+        else:
+            return jsonify({"error": "action must be start or stop"}), 400
+    return jsonify(dict(await asyncio.to_thread(memory_profiler.stats), pid=os.getpid()))
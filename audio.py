@@ -0,0 +1,362 @@
+import asyncio
+import io
+import logging
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+
+import numpy as np
+import soundfile as sf
+
+from resample import Resampler
+
+logger = logging.getLogger(__name__)
+
+# Size of the blocks streamed into ffmpeg's stdin
+PIPE_CHUNK_SIZE = 64 * 1024
+
+# Frames per block when soundfile decodes and numpy resamples
+BLOCK_FRAMES = 64 * 1024
+
+# Containers whose index may sit at the end of the file, which ffmpeg
+# cannot reach through a non-seekable pipe
+SEEKABLE_FORMATS = {"m4a", "mp4", "mov", "3gp", "aac"}
+
+# Upstream encoding policies: what transcribe_with_google_client sends
+UPSTREAM_LINEAR16 = "linear16"  # raw PCM, largest payload
+UPSTREAM_FLAC = "flac"          # lossless, roughly half the bytes
+UPSTREAM_AUTO = "auto"          # pass OGG_OPUS uploads through, FLAC otherwise
+UPSTREAM_POLICIES = {UPSTREAM_LINEAR16, UPSTREAM_FLAC, UPSTREAM_AUTO}
+
+# Formats whose header soundfile must be able to parse; anything else it
+# cannot read is left to ffmpeg
+STRICT_HEADER_FORMATS = {"wav", "flac"}
+
+# Opus always decodes at 48 kHz; Ogg granule positions count 48 kHz samples
+OPUS_SAMPLE_RATE = 48000
+
+
+class AudioDecodeError(Exception):
+    """Raised when an upload cannot be decoded to PCM"""
+
+
+class AudioTooLong(AudioDecodeError):
+    """Raised when an upload is longer than the configured limit"""
+
+    def __init__(self, duration, limit):
+        super().__init__(f"Audio is {duration:.0f}s long; the limit is {limit:.0f}s")
+        self.duration = duration
+        self.limit = limit
+
+
+def ffmpeg_available(ffmpeg="ffmpeg"):
+    return shutil.which(ffmpeg) is not None
+
+
+def _feed(stream, pipe, chunk_size):
+    try:
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            pipe.write(chunk)
+    except (BrokenPipeError, ValueError):
+        # ffmpeg exited early; its exit status carries the real error
+        pass
+    finally:
+        try:
+            pipe.close()
+        except BrokenPipeError:
+            pass
+
+
+def _drain(pipe, sink):
+    sink.append(pipe.read())
+
+
+def ffmpeg_command(source, sample_rate=16000, channels=1, ffmpeg="ffmpeg"):
+    """ffmpeg arguments that decode source (a path or "pipe:0") to raw 16-bit PCM on stdout"""
+    return [
+        ffmpeg, "-hide_banner", "-loglevel", "error",
+        "-i", str(source),
+        "-vn", "-f", "s16le", "-acodec", "pcm_s16le",
+        "-ac", str(channels), "-ar", str(sample_rate),
+        "pipe:1",
+    ]
+
+
+def decode_with_ffmpeg(source, sample_rate=16000, channels=1, ffmpeg="ffmpeg", chunk_size=PIPE_CHUNK_SIZE,
+                       output=None):
+    """Decode a file object (streamed over stdin) or a path with ffmpeg into raw 16-bit PCM.
+
+    Returns the PCM bytes, or with output, copies them into that file
+    object block by block and returns it.
+    """
+    piped = hasattr(source, "read")
+    command = ffmpeg_command("pipe:0" if piped else source, sample_rate, channels, ffmpeg)
+    process = subprocess.Popen(command,
+                               stdin=subprocess.PIPE if piped else subprocess.DEVNULL,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+
+    # Write stdin and drain stderr on helper threads so no pipe can fill up and stall
+    threads = []
+    if piped:
+        threads.append(threading.Thread(target=_feed, args=(source, process.stdin, chunk_size), daemon=True))
+    errors = []
+    threads.append(threading.Thread(target=_drain, args=(process.stderr, errors), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    if output is None:
+        # One growing buffer; this bytes object is what RecognitionAudio receives
+        pcm = process.stdout.read()
+    else:
+        shutil.copyfileobj(process.stdout, output, chunk_size)
+        pcm = output
+    process.stdout.close()
+    returncode = process.wait()
+    for thread in threads:
+        thread.join()
+
+    if returncode != 0:
+        message = (errors[0] if errors else b"").decode("utf-8", "replace").strip()
+        raise AudioDecodeError(message or f"ffmpeg exited with status {returncode}")
+    return pcm
+
+
+def decode_with_pydub(stream, sample_rate=16000, channels=1, format=None):
+    """Decode in memory with pydub; used when no ffmpeg binary is installed"""
+    from pydub import AudioSegment
+
+    try:
+        audio = AudioSegment.from_file(stream, format=format)
+    except Exception as e:
+        raise AudioDecodeError(str(e)) from e
+    # Only the container decode is pydub's; its audioop resampling is slow and unfiltered
+    audio = audio.set_sample_width(2)
+    samples = np.frombuffer(audio.raw_data, dtype="<i2").reshape(-1, audio.channels) / np.float32(32768.0)
+    resampler = Resampler(audio.frame_rate, sample_rate, audio.channels, channels)
+    return resampler.process(samples) + resampler.flush()
+
+
+def decode_to_pcm(stream, sample_rate=16000, channels=1, format=None, ffmpeg="ffmpeg", output=None):
+    """Decode an uploaded file object to raw LINEAR16 PCM without touching disk.
+
+    With output, the PCM is written to that file object instead of being
+    returned as bytes, so a spooled temp file can bound the memory it takes.
+    """
+    if isinstance(stream, (bytes, bytearray)):
+        stream = io.BytesIO(stream)
+    if not ffmpeg_available(ffmpeg):
+        logger.warning("ffmpeg not found, decoding with pydub")
+        pcm = decode_with_pydub(stream, sample_rate, channels, format)
+        if output is None:
+            return pcm
+        output.write(pcm)
+        return output
+
+    try:
+        return decode_with_ffmpeg(stream, sample_rate, channels, ffmpeg, output=output)
+    except AudioDecodeError:
+        if format not in SEEKABLE_FORMATS or not stream.seekable():
+            raise
+    if output is not None:
+        output.seek(0)
+        output.truncate()
+
+    # The container needs random access; spill to a temp file and retry
+    logger.info(f"Retrying {format} decode from a seekable file")
+    stream.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=f".{format}") as spill:
+        shutil.copyfileobj(stream, spill, PIPE_CHUNK_SIZE)
+        spill.flush()
+        return decode_with_ffmpeg(spill.name, sample_rate, channels, ffmpeg, output=output)
+
+
+async def decode_to_pcm_async(source, sample_rate=16000, channels=1, format=None, ffmpeg="ffmpeg", output=None):
+    """decode_to_pcm for asyncio: the event loop waits on the ffmpeg subprocess instead of a thread.
+
+    source is bytes or a file object; output works as in decode_to_pcm.
+    """
+    stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    if not ffmpeg_available(ffmpeg) or format in SEEKABLE_FORMATS:
+        # pydub and the temp-file retry block; keep them off the event loop
+        return await asyncio.to_thread(decode_to_pcm, stream, sample_rate, channels, format, ffmpeg, output)
+
+    process = await asyncio.create_subprocess_exec(
+        *ffmpeg_command("pipe:0", sample_rate, channels, ffmpeg),
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+    async def feed():
+        try:
+            while True:
+                chunk = await asyncio.to_thread(stream.read, PIPE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg exited early; its exit status carries the real error
+            pass
+        finally:
+            process.stdin.close()
+
+    feeder = asyncio.ensure_future(feed())
+    errors = asyncio.ensure_future(process.stderr.read())
+    try:
+        if output is None:
+            pcm = await process.stdout.read()
+        else:
+            while True:
+                block = await process.stdout.read(PIPE_CHUNK_SIZE)
+                if not block:
+                    break
+                output.write(block)
+            pcm = output
+        await feeder
+        returncode = await process.wait()
+        stderr = await errors
+    except asyncio.CancelledError:
+        process.kill()
+        feeder.cancel()
+        errors.cancel()
+        raise
+    if returncode != 0:
+        message = stderr.decode("utf-8", "replace").strip()
+        raise AudioDecodeError(message or f"ffmpeg exited with status {returncode}")
+    return pcm
+
+
+def encode_flac(pcm, sample_rate, channels=1):
+    """Losslessly compress 16-bit PCM to an in-memory FLAC stream"""
+    samples = np.frombuffer(pcm, dtype="<i2")
+    samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels)
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, sample_rate, format="FLAC", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def encode_for_upstream(pcm, sample_rate, channels=1, policy=UPSTREAM_AUTO):
+    """Return (content, encoding name) for raw PCM according to the upstream policy"""
+    if policy in (UPSTREAM_FLAC, UPSTREAM_AUTO):
+        return encode_flac(pcm, sample_rate, channels), "FLAC"
+    return pcm, "LINEAR16"
+
+
+def probe_ogg_opus(stream, tail_size=64 * 1024):
+    """Read an Ogg Opus header and last page; returns {"channels", "duration"} or None.
+
+    Only the first and last few kilobytes are read, and the stream is left
+    rewound to the start.
+    """
+    try:
+        head = stream.read(4096)
+        if head[:4] != b"OggS" or len(head) < 28:
+            return None
+        payload = 27 + head[26]
+        if head[payload:payload + 8] != b"OpusHead":
+            return None
+        channels = head[payload + 9]
+        pre_skip = struct.unpack_from("<H", head, payload + 10)[0]
+
+        # The granule position of the final page is the total sample count
+        stream.seek(0, io.SEEK_END)
+        size = stream.tell()
+        stream.seek(max(0, size - tail_size))
+        tail = stream.read()
+        last_page = tail.rfind(b"OggS")
+        if last_page < 0 or last_page + 14 > len(tail):
+            return None
+        granule = struct.unpack_from("<q", tail, last_page + 6)[0]
+        return {
+            "channels": channels,
+            "duration": max(0, granule - pre_skip) / float(OPUS_SAMPLE_RATE),
+        }
+    except (OSError, struct.error, IndexError):
+        return None
+    finally:
+        stream.seek(0)
+
+
+def probe_audio(stream, format=None):
+    """Read only an upload's header; returns {"format", "subtype", "sample_rate", "channels", "duration"} or None.
+
+    Ogg Opus goes through probe_ogg_opus, everything else through
+    soundfile.info. None means the header could not be parsed, which for
+    formats outside STRICT_HEADER_FORMATS only means ffmpeg has to look.
+    The stream is left rewound to the start.
+    """
+    if format in ("ogg", "opus"):
+        info = probe_ogg_opus(stream)
+        if info:
+            return dict(info, format="OGG", subtype="OPUS", sample_rate=OPUS_SAMPLE_RATE)
+    try:
+        info = sf.info(stream)
+        return {
+            "format": info.format,
+            "subtype": info.subtype,
+            "sample_rate": info.samplerate,
+            "channels": info.channels,
+            "duration": info.duration,
+        }
+    except (RuntimeError, TypeError, ValueError):
+        # LibsndfileError is a RuntimeError
+        return None
+    finally:
+        stream.seek(0)
+
+
+def read_pcm16(stream, output=None):
+    """Samples of a 16-bit WAV or FLAC upload as raw LINEAR16 bytes, without resampling.
+
+    With output, the samples are copied into that file object block by block.
+    """
+    try:
+        if output is None:
+            samples, _ = sf.read(stream, dtype="int16", always_2d=True)
+            return samples.tobytes()
+        for block in sf.blocks(stream, blocksize=PIPE_CHUNK_SIZE, dtype="int16", always_2d=True):
+            output.write(block.tobytes())
+        return output
+    except RuntimeError as e:
+        raise AudioDecodeError(str(e)) from e
+
+
+def decode_with_soundfile(stream, sample_rate=16000, channels=1, output=None):
+    """Decode a file soundfile can read to raw LINEAR16 PCM at sample_rate, without ffmpeg.
+
+    Blocks of BLOCK_FRAMES go through the numpy resampler and downmix, so
+    memory stays flat for long files; with output, the PCM is written to
+    that file object, as in decode_with_ffmpeg.
+    """
+    try:
+        info = sf.info(stream)
+        stream.seek(0)
+        resampler = Resampler(info.samplerate, sample_rate, info.channels, channels)
+        parts = []
+        write = output.write if output is not None else parts.append
+        for block in sf.blocks(stream, blocksize=BLOCK_FRAMES, dtype="float32", always_2d=True):
+            write(resampler.process(block))
+        write(resampler.flush())
+    except RuntimeError as e:
+        raise AudioDecodeError(str(e)) from e
+    return output if output is not None else b"".join(parts)
+
+
+def warmup_codecs(sample_rate=16000, channels=1, ffmpeg="ffmpeg"):
+    """Run a tenth of a second of silence through every decode and encode path once.
+
+    The first call into libsndfile's FLAC encoder and the first ffmpeg exec
+    are much slower than the rest; a worker does them here, before it
+    accepts traffic, instead of on its first request.
+    """
+    pcm = bytes(2 * channels * (sample_rate // 10))
+    flac = encode_flac(pcm, sample_rate, channels)
+    probe_audio(io.BytesIO(flac), "flac")
+    read_pcm16(io.BytesIO(flac))
+    decode_with_soundfile(io.BytesIO(flac), sample_rate, channels)
+    if ffmpeg_available(ffmpeg):
+        decode_with_ffmpeg(io.BytesIO(flac), sample_rate, channels, ffmpeg)
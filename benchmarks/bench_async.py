@@ -0,0 +1,171 @@
+"""In-flight transcriptions per worker: threaded server.py versus async_server.py.
+
+Starts one gunicorn worker for each mode against the fake recognizer (with
+a deliberately slow backend, so the number of requests held open is what
+limits throughput), then drives it with increasing client concurrency.
+Every request carries unique audio so the result cache never answers.
+"open" is requests held open by the worker (throughput times mean latency,
+by Little's law); "upstream" is recognize calls in flight (throughput
+times the backend latency).
+
+    python benchmarks/bench_async.py --concurrency 4 32 128 256
+"""
+import argparse
+import io
+import itertools
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import requests
+import soundfile as sf
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from corpus import synth_speech  # noqa: E402
+
+MODES = {
+    "threaded": ("server:app", "gevent"),
+    "async": ("async_server:app", "uvicorn.workers.UvicornWorker"),
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+# Numbers every request in the run, across modes and concurrency levels
+_request_ids = itertools.count()
+
+
+def unique_wav(samples):
+    """WAV bytes that differ per request, so every request misses the cache"""
+    request_id = next(_request_ids)
+    samples = samples.copy()
+    samples[:4] = [(request_id >> shift & 0xFF) / 256.0 for shift in (0, 8, 16, 24)]
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, 16000, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def drive(url, concurrency, total, samples):
+    latencies, errors = [], []
+    counter = iter(range(total))
+    lock = threading.Lock()
+
+    def loop():
+        session = requests.Session()
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            payload = unique_wav(samples)
+            start = time.perf_counter()
+            try:
+                response = session.post(url, files={"file": ("bench.wav", payload)},
+                                        data={"language": "en-US"}, timeout=300)
+                if response.status_code == 200:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors.append(response.status_code)
+            except requests.RequestException as e:
+                errors.append(type(e).__name__)
+
+    threads = [threading.Thread(target=loop) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - start
+
+
+def run_mode(mode, args, endpoint, samples):
+    app_path, worker_class = MODES[mode]
+    port = free_port()
+    env = dict(
+        os.environ,
+        PYTHONPATH=str(ROOT),
+        SPEECH_ENDPOINT=endpoint,
+        GUNICORN_WORKER_CLASS=worker_class,
+        PROMETHEUS_MULTIPROC_DIR=tempfile.mkdtemp(prefix="stt_bench_metrics_"),
+        # Keep Redis, the cache, quotas and the queue deadline out of the measurement
+        REDIS_URL="redis://127.0.0.1:1/0",
+        CACHE_MAX_ENTRIES="0",
+        SINGLEFLIGHT_ENABLED="false",
+        TENANT_AUDIO_RATE="0",
+        ADMISSION_MAX_WAIT="600",
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config", "gunicorn_config.py", "--workers", "1",
+         "--bind", f"127.0.0.1:{port}", "--log-level", "warning", "--access-logfile", "/dev/null", app_path],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for(f"http://127.0.0.1:{port}/health")
+        url = f"http://127.0.0.1:{port}/transcribe"
+        for concurrency in args.concurrency:
+            total = max(args.requests, concurrency * 2)
+            latencies, errors, elapsed = drive(url, concurrency, total, samples)
+            rps = len(latencies) / elapsed if elapsed else 0.0
+            mean = statistics.mean(latencies) if latencies else 0.0
+            p95 = sorted(latencies)[int(len(latencies) * 0.95) - 1] if latencies else 0.0
+            print(f"{mode:<9} {concurrency:>5} {rps:>8.1f} {rps * mean:>7.1f} {rps * args.latency:>9.1f} "
+                  f"{mean * 1000:>9.0f} {p95 * 1000:>9.0f}  {len(errors)}")
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[4, 32, 128, 256])
+    parser.add_argument("--requests", type=int, default=256, help="minimum requests per concurrency level")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake recognizer latency (s)")
+    parser.add_argument("--seconds", type=float, default=2.0, help="audio length per request")
+    args = parser.parse_args()
+
+    # The backend runs in its own process so it does not compete with the client threads
+    backend_port = free_port()
+    backend = subprocess.Popen(
+        [sys.executable, "fake_speech.py", "--port", str(backend_port), "--latency", str(args.latency),
+         "--max-workers", "1024"],
+        cwd=ROOT, env=dict(os.environ, PYTHONPATH=str(ROOT)), stdout=subprocess.DEVNULL,
+    )
+    samples = synth_speech(args.seconds, 16000)
+    try:
+        time.sleep(1.0)
+        print(f"{'mode':<9} {'conc':>5} {'req/s':>8} {'open':>7} {'upstream':>9} "
+              f"{'mean ms':>9} {'p95 ms':>9}  errors")
+        for mode in args.modes:
+            run_mode(mode, args, f"127.0.0.1:{backend_port}", samples)
+    finally:
+        backend.terminate()
+        backend.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
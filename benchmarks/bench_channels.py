@@ -0,0 +1,89 @@
+"""Wall time of a stereo call recognized per channel versus mixed down and diarized.
+
+Builds a two-party call with one speaker per channel, writes it as a
+44.1 kHz stereo WAV and runs it through server.transcribe_upload against
+the fake recognizer (whose latency grows with the audio it is sent) as:
+
+    mixed      downmixed to mono, one speaker-diarized recognition
+    separate   separate_channels: both channels recognized concurrently
+    longest    the longer channel alone, as a mono upload
+
+"separate" should take about as long as "longest". The fake recognizer
+does no diarization, so the saving from not diarizing is not in these
+numbers.
+
+    python benchmarks/bench_channels.py --minutes 3 4
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+# Keep Redis, the cache and quotas out of the measurement, and give the executor a thread for every
+# chunk of both channels, so recognize calls do not queue behind each other
+os.environ.update(REDIS_URL="redis://127.0.0.1:1/0", CACHE_MAX_ENTRIES="0", SINGLEFLIGHT_ENABLED="false",
+                  ADMISSION_ENABLED="false", WORKER_WARMUP="false", THREAD_POOL_SIZE="16")
+
+import fake_speech  # noqa: E402
+from corpus import synth_speech  # noqa: E402
+
+SAMPLE_RATE = 44100
+
+
+def to_wav(samples):
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, SAMPLE_RATE, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def timed(server, wav, options, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        server.transcribe_upload(io.BytesIO(wav), "call.wav", "en-US", options)
+        runs.append(time.perf_counter() - start)
+    return statistics.median(runs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", nargs=2, type=float, default=[3.0, 4.0], help="length of each channel")
+    parser.add_argument("--per-audio-second", type=float, default=0.01, help="fake recognizer latency per second")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    backend, port, _ = fake_speech.serve(fake_speech.FakeSpeechServicer(latency=0.1,
+                                                                        per_audio_second=args.per_audio_second))
+    os.environ["SPEECH_ENDPOINT"] = f"127.0.0.1:{port}"
+    import server
+
+    sides = [synth_speech(minutes * 60, SAMPLE_RATE, seed=seed) for seed, minutes in enumerate(args.minutes)]
+    call = np.zeros((max(len(side) for side in sides), 2), dtype=np.float32)
+    for channel, side in enumerate(sides):
+        call[:len(side), channel] = side
+    longest = max(sides, key=len)
+
+    options = server.parse_transcription_options({"speaker_diarization": "true"})[1]
+    cases = {
+        "mixed": (to_wav(call), options),
+        "separate": (to_wav(call), dict(options, separate_channels=True)),
+        "longest": (to_wav(longest), options),
+    }
+    print(f"channels of {args.minutes[0]:g} and {args.minutes[1]:g} min, "
+          f"recognizer {args.per_audio_second * 1000:.0f} ms per audio second")
+    for name, (wav, case_options) in cases.items():
+        print(f"{name:<9} {timed(server, wav, case_options, args.repeat):6.2f} s")
+    backend.stop(None)
+
+
+if __name__ == "__main__":
+    main()
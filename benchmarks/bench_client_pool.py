@@ -0,0 +1,77 @@
+"""Per-request latency of a fresh SpeechClient versus the pooled client.
+
+Runs against the local fake backend, so the numbers exclude TLS and OAuth
+token fetches; against the real endpoint the gap is larger.
+
+    python benchmarks/bench_client_pool.py --requests 200
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from google.cloud import speech_v1p1beta1 as speech  # noqa: E402
+
+import fake_speech  # noqa: E402
+from speech_pool import SpeechClientPool, _close, create_client  # noqa: E402
+
+
+def make_request():
+    config = speech.RecognitionConfig(
+        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+        sample_rate_hertz=16000,
+        language_code="ru-RU",
+    )
+    audio = speech.RecognitionAudio(content=b"\x00" * 32000)
+    return config, audio
+
+
+def run(label, requests, call):
+    config, audio = make_request()
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        call(config, audio)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label:<14} mean {statistics.mean(timings):7.2f} ms   "
+          f"p50 {statistics.median(timings):7.2f} ms   p95 {p95:7.2f} ms")
+    return statistics.mean(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="simulated backend latency in seconds")
+    args = parser.parse_args()
+
+    server, port, _ = fake_speech.serve(fake_speech.FakeSpeechServicer(latency=args.latency))
+    endpoint = f"127.0.0.1:{port}"
+
+    def fresh_client(config, audio):
+        client = create_client(endpoint=endpoint)
+        try:
+            client.recognize(config=config, audio=audio)
+        finally:
+            _close(client)
+
+    pool = SpeechClientPool(size=2, endpoint=endpoint)
+    pool.warmup()
+
+    print(f"{args.requests} sequential requests against {endpoint}")
+    fresh = run("new client", args.requests, fresh_client)
+    pooled = run("pooled client", args.requests,
+                 lambda config, audio: pool.recognize(config=config, audio=audio))
+    print(f"Saved {fresh - pooled:.2f} ms per request ({(1 - pooled / fresh) * 100:.0f}%)")
+
+    pool.close()
+    server.stop(None)
+
+
+if __name__ == "__main__":
+    main()
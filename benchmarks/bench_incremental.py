@@ -0,0 +1,93 @@
+"""How much of an edited recording incremental mode sends to the recognizer again.
+
+Cuts a recording into chunks, then cuts edited versions of it and counts
+the seconds of audio in chunks whose bytes were not seen before; those are
+the chunks that miss the chunk cache and cost a recognize call. Compares
+content-defined cuts (INCREMENTAL_ENABLED) with the default quiet-point
+cuts, and times the cutting itself.
+
+    python benchmarks/bench_incremental.py --minutes 20
+    python benchmarks/bench_incremental.py --input meeting.mp3
+"""
+import argparse
+import hashlib
+import io
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from audio import decode_to_pcm  # noqa: E402
+from chunking import iter_content_chunks, iter_pcm_chunks  # noqa: E402
+from corpus import synth_speech  # noqa: E402
+
+SAMPLE_RATE = 16000
+BYTES_PER_SECOND = 2 * SAMPLE_RATE
+
+CUTTERS = {
+    "content": lambda source: iter_content_chunks(source, SAMPLE_RATE, 1, 10.0, 55.0),
+    "quiet": lambda source: iter_pcm_chunks(source, SAMPLE_RATE, 1, 55.0, 10.0),
+}
+
+
+def to_pcm(samples):
+    return (np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes()
+
+
+def seconds(n):
+    return int(n * SAMPLE_RATE) * 2
+
+
+def edits(pcm, other):
+    """Edited versions of pcm; other supplies new audio"""
+    middle = len(pcm) // 2 - len(pcm) // 2 % 2
+    return {
+        "unchanged": pcm,
+        "append 60 s": pcm + other[:seconds(60)],
+        "trim start 7.3 s": pcm[seconds(7.3):],
+        "trim end 30 s": pcm[:-seconds(30)],
+        "replace 30 s mid": pcm[:middle] + other[:seconds(30)] + pcm[middle + seconds(30):],
+        "insert 20 s mid": pcm[:middle] + other[:seconds(20)] + pcm[middle:],
+    }
+
+
+def chunk_digests(cut, pcm):
+    return [(hashlib.blake2b(chunk, digest_size=20).digest(), len(chunk) / BYTES_PER_SECOND)
+            for _, chunk in cut(io.BytesIO(pcm))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=20.0, help="length of the synthetic recording")
+    parser.add_argument("--input", help="audio file to use instead of synthetic speech")
+    args = parser.parse_args()
+
+    if args.input:
+        with open(args.input, "rb") as f:
+            pcm = decode_to_pcm(f, SAMPLE_RATE, 1, format=Path(args.input).suffix[1:].lower())
+    else:
+        pcm = to_pcm(synth_speech(args.minutes * 60, SAMPLE_RATE, seed=0))
+    other = to_pcm(synth_speech(60, SAMPLE_RATE, seed=1))
+    print(f"{len(pcm) / BYTES_PER_SECOND / 60:.1f} min recording")
+
+    print(f"{'cuts':<8} {'edit':<17} {'chunks':>6} {'resent s':>9} {'of s':>7} {'resent':>7}")
+    for name, cut in CUTTERS.items():
+        start = time.perf_counter()
+        original = chunk_digests(cut, pcm)
+        elapsed = time.perf_counter() - start
+        seen = {digest for digest, _ in original}
+        for edit, edited in edits(pcm, other).items():
+            chunks = chunk_digests(cut, edited)
+            resent = sum(length for digest, length in chunks if digest not in seen)
+            total = sum(length for _, length in chunks)
+            print(f"{name:<8} {edit:<17} {len(chunks):>6} {resent:>9.1f} {total:>7.0f} {resent / total:>7.1%}")
+        hours = len(pcm) / BYTES_PER_SECOND / 3600
+        print(f"{name:<8} cutting took {elapsed * 1000:.0f} ms ({elapsed / hours:.2f} s per audio hour)")
+
+
+if __name__ == "__main__":
+    main()
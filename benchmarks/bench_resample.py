@@ -0,0 +1,102 @@
+"""Resampling to 16 kHz mono: numpy polyphase (resample.py) against pydub and ffmpeg.
+
+For each source rate and channel count, converts a minute of synthetic
+speech and reports milliseconds per minute of audio for:
+
+    numpy   resample.Resampler over BLOCK_FRAMES blocks, as audio.decode_with_soundfile runs it
+    pydub   AudioSegment.set_channels().set_frame_rate(), the audioop path
+    ffmpeg  the WAV piped through decode_with_ffmpeg (includes the process start)
+
+and how much of a tone just above the target Nyquist frequency survives
+("alias dB", relative to the input; lower is better).
+
+    python benchmarks/bench_resample.py --pairs 44100:2 48000:2 48000:1 22050:1 8000:1
+"""
+import argparse
+import io
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from audio import BLOCK_FRAMES, decode_with_ffmpeg, ffmpeg_available  # noqa: E402
+from corpus import synth_speech  # noqa: E402
+from resample import Resampler  # noqa: E402
+
+TARGET_RATE = 16000
+
+
+def with_numpy(samples, rate):
+    resampler = Resampler(rate, TARGET_RATE, samples.shape[1], 1)
+    parts = [resampler.process(samples[i:i + BLOCK_FRAMES]) for i in range(0, len(samples), BLOCK_FRAMES)]
+    parts.append(resampler.flush())
+    return b"".join(parts)
+
+
+def with_pydub(samples, rate):
+    from pydub import AudioSegment
+
+    pcm = np.clip(np.rint(samples * 32768.0), -32768, 32767).astype("<i2").tobytes()
+    audio = AudioSegment(data=pcm, sample_width=2, frame_rate=rate, channels=samples.shape[1])
+    return audio.set_channels(1).set_frame_rate(TARGET_RATE).raw_data
+
+
+def with_ffmpeg(samples, rate):
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, rate, format="WAV", subtype="PCM_16")
+    buffer.seek(0)
+    return decode_with_ffmpeg(buffer, TARGET_RATE, 1)
+
+
+def timed(convert, samples, rate, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        convert(samples, rate)
+        runs.append(time.perf_counter() - start)
+    return statistics.median(runs) * 1000
+
+
+def alias_db(convert, rate, channels):
+    """Level of a tone at 1.3x the target Nyquist frequency after conversion"""
+    t = np.arange(rate * 2) / rate
+    tone = np.repeat((0.5 * np.sin(2 * np.pi * 0.65 * TARGET_RATE * t))[:, None], channels, axis=1)
+    out = np.frombuffer(convert(tone.astype(np.float32), rate), dtype="<i2") / 32768.0
+    level = np.sqrt(np.mean(np.square(out[len(out) // 4:-len(out) // 4])))
+    return 20 * np.log10(max(level, 1e-6) / (0.5 / np.sqrt(2)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", nargs="+", default=["44100:2", "48000:2", "48000:1", "22050:1", "8000:1"],
+                        help="source rate:channels")
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    converters = {"numpy": with_numpy, "pydub": with_pydub}
+    if ffmpeg_available():
+        converters["ffmpeg"] = with_ffmpeg
+    per_minute = 60.0 / args.seconds
+    print(f"{'source':<12}" + "".join(f"{name + ' ms/min':>16}" for name in converters)
+          + "".join(f"{name + ' alias dB':>16}" for name in converters))
+    for pair in args.pairs:
+        rate, channels = (int(value) for value in pair.split(":"))
+        samples = synth_speech(args.seconds, rate, channels)
+        samples = samples.reshape(len(samples), -1).astype(np.float32)
+        times = [timed(convert, samples, rate, args.repeat) * per_minute for convert in converters.values()]
+        if rate > 1.3 * TARGET_RATE:
+            aliases = [f"{alias_db(convert, rate, channels):>16.1f}" for convert in converters.values()]
+        else:
+            aliases = [f"{'-':>16}" for _ in converters]
+        print(f"{rate:>6}/{channels:<5}" + "".join(f"{value:>16.1f}" for value in times) + "".join(aliases))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Memory and serialization cost of the /transcribe result shapes.
+
+Builds a RecognizeResponse for an hour of speech with the fake
+recognizer's word layout. For each shape it reports the conversion time,
+json.dumps time with Flask's default settings, memory held by the result
+and peak memory while building it, and the body size:
+
+    proto-plus  dict per word, reading fields through the proto-plus wrappers
+    json        dict per word, reading the underlying protobuf (response_to_dicts)
+    compact     parallel word / millisecond arrays (format=compact)
+    binary      compact with base64 uint32 timings (binary_timings=true)
+    srt, vtt    subtitles rendered from the compact arrays
+
+    python benchmarks/bench_results.py --hours 1 --repeat 5
+"""
+import argparse
+import gc
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from google.cloud import speech_v1p1beta1 as speech  # noqa: E402
+
+from fake_speech import fake_results  # noqa: E402
+from results import render_results, response_to_dicts  # noqa: E402
+
+CHUNK_SECONDS = 55.0
+
+
+def make_response(hours):
+    """One result per long-audio chunk, as the server's stitched results look"""
+    results = []
+    offset = 0.0
+    total = hours * 3600.0
+    while offset < total:
+        duration = min(CHUNK_SECONDS, total - offset)
+        results.extend(fake_results(duration, offset))
+        offset += duration
+    return speech.RecognizeResponse(results=results)
+
+
+def proto_plus_dicts(response):
+    """Dict per word through proto-plus attribute access, as results.py used to"""
+    return [
+        {
+            "alternatives": [
+                {
+                    "transcript": alternative.transcript,
+                    "confidence": alternative.confidence,
+                    "words": [
+                        {
+                            "word": word.word,
+                            "start_time": float(word.start_time.total_seconds()),
+                            "end_time": float(word.end_time.total_seconds())
+                        }
+                        for word in alternative.words
+                    ]
+                }
+                for alternative in result.alternatives
+            ],
+            "channel_tag": result.channel_tag,
+            "result_end_time": float(result.result_end_time.total_seconds())
+        }
+        for result in response.results
+    ]
+
+
+def dumps(value):
+    # Flask's DefaultJSONProvider outside debug mode
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return json.dumps(value, ensure_ascii=True, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def measure(label, build, repeat):
+    build_ms, dump_ms = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = build()
+        build_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        body = dumps(value)
+        dump_ms.append((time.perf_counter() - start) * 1000)
+        del value
+
+    gc.collect()
+    tracemalloc.start()
+    value = build()
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del value
+    print(f"{label:<11} {statistics.median(build_ms):9.1f} {statistics.median(dump_ms):9.1f} "
+          f"{held / 1e6:8.2f} {peak / 1e6:8.2f} {len(body) / 1e6:8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hours", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    response = make_response(args.hours)
+    dicts = response_to_dicts(response)
+    if dicts != proto_plus_dicts(response):
+        raise SystemExit("response_to_dicts disagrees with the proto-plus conversion")
+    words = sum(len(alternative["words"]) for result in dicts for alternative in result["alternatives"])
+    print(f"{args.hours:g} h of audio, {len(dicts)} results, {words} words")
+    print(f"{'shape':<11} {'build ms':>9} {'dump ms':>9} {'held MB':>8} {'peak MB':>8} {'body MB':>8}")
+
+    # Every shape but proto-plus is built from response_to_dicts, as in the
+    # server; srt and vtt are strings already, so their dump is only encoding
+    measure("proto-plus", lambda: proto_plus_dicts(response), args.repeat)
+    measure("json", lambda: response_to_dicts(response), args.repeat)
+    measure("compact", lambda: render_results(response_to_dicts(response), "compact"), args.repeat)
+    measure("binary", lambda: render_results(response_to_dicts(response), "compact", binary=True), args.repeat)
+    measure("srt", lambda: render_results(response_to_dicts(response), "srt"), args.repeat)
+    measure("vtt", lambda: render_results(response_to_dicts(response), "vtt"), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Cold start and time to first request of a gunicorn worker, with and without warmup.
+
+Starts gunicorn against the fake recognizer several times for each
+WORKER_WARMUP setting and reports medians of:
+
+    import ms   importing server.py in a fresh interpreter (paid once, in the master)
+    boot ms     from launching gunicorn until /health answers
+    first ms    the first /transcribe after boot
+    steady ms   median of the requests that follow
+
+Requests carry unique 44.1 kHz stereo WAV audio, so every one misses the
+cache and goes through ffmpeg, the FLAC encoder and a recognize call.
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import io
+import itertools
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+import soundfile as sf
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from corpus import synth_speech  # noqa: E402
+
+SAMPLE_RATE = 44100
+
+_request_ids = itertools.count()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def unique_wav(samples):
+    """WAV bytes that differ per request, so every request misses the cache"""
+    request_id = next(_request_ids)
+    samples = samples.copy()
+    samples[:4, 0] = [(request_id >> shift & 0xFF) / 256.0 for shift in (0, 8, 16, 24)]
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, SAMPLE_RATE, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def import_ms():
+    code = "import time; start = time.perf_counter(); import server; print((time.perf_counter() - start) * 1000)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True,
+                            env=dict(os.environ, PYTHONPATH=str(ROOT), REDIS_URL="redis://127.0.0.1:1/0"))
+    return float(output.stdout.split()[-1])
+
+
+def transcribe(session, url, samples):
+    start = time.perf_counter()
+    response = session.post(url, files={"file": ("bench.wav", unique_wav(samples))},
+                            data={"language": "en-US"}, timeout=60)
+    response.raise_for_status()
+    return (time.perf_counter() - start) * 1000
+
+
+def run_once(warmup, args, endpoint, samples):
+    port = free_port()
+    env = dict(
+        os.environ,
+        PYTHONPATH=str(ROOT),
+        SPEECH_ENDPOINT=endpoint,
+        WORKER_WARMUP="true" if warmup else "false",
+        PROMETHEUS_MULTIPROC_DIR=tempfile.mkdtemp(prefix="stt_bench_metrics_"),
+        # Keep Redis, the cache and quotas out of the measurement
+        REDIS_URL="redis://127.0.0.1:1/0",
+        CACHE_MAX_ENTRIES="0",
+        SINGLEFLIGHT_ENABLED="false",
+        TENANT_AUDIO_RATE="0",
+    )
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--config", "gunicorn_config.py", "--workers", "1",
+         "--bind", f"127.0.0.1:{port}", "--log-level", "warning", "--access-logfile", "/dev/null", "server:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for(f"http://127.0.0.1:{port}/health")
+        boot = (time.perf_counter() - start) * 1000
+        url = f"http://127.0.0.1:{port}/transcribe"
+        session = requests.Session()
+        first = transcribe(session, url, samples)
+        steady = statistics.median(transcribe(session, url, samples) for _ in range(args.requests))
+        return boot, first, steady
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="gunicorn starts per setting")
+    parser.add_argument("--requests", type=int, default=10, help="requests after the first one")
+    parser.add_argument("--seconds", type=float, default=3.0, help="audio length per request")
+    args = parser.parse_args()
+
+    backend_port = free_port()
+    backend = subprocess.Popen(
+        [sys.executable, "fake_speech.py", "--port", str(backend_port), "--latency", "0"],
+        cwd=ROOT, env=dict(os.environ, PYTHONPATH=str(ROOT)), stdout=subprocess.DEVNULL,
+    )
+    samples = synth_speech(args.seconds, SAMPLE_RATE, channels=2)
+    try:
+        time.sleep(1.0)
+        imports = [import_ms() for _ in range(args.runs)]
+        print(f"import server: {statistics.median(imports):.0f} ms (median of {args.runs})")
+        print(f"{'warmup':<7} {'boot ms':>8} {'first ms':>9} {'steady ms':>10} {'first - steady':>15}")
+        for warmup in (False, True):
+            runs = [run_once(warmup, args, f"127.0.0.1:{backend_port}", samples) for _ in range(args.runs)]
+            boot, first, steady = (statistics.median(column) for column in zip(*runs))
+            print(f"{'on' if warmup else 'off':<7} {boot:>8.0f} {first:>9.1f} {steady:>10.1f} {first - steady:>15.1f}")
+    finally:
+        backend.terminate()
+        backend.wait(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Time-to-first-word for the /transcribe/stream WebSocket endpoint.
+
+Streams synthetic audio in real time to an in-process server that talks to
+the local fake backend, and reports when the first interim and final
+results arrive relative to the first audio frame.
+
+    python benchmarks/bench_streaming.py --seconds 5 --frame-ms 100
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import simple_websocket  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+import fake_speech  # noqa: E402
+import server  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5.0, help="audio length to stream")
+    parser.add_argument("--frame-ms", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="fake backend delay per streamed frame")
+    args = parser.parse_args()
+
+    backend, port, _ = fake_speech.serve(fake_speech.FakeSpeechServicer(stream_latency=args.latency))
+    server.speech_clients.endpoint = f"127.0.0.1:{port}"
+    http = make_server("127.0.0.1", 0, server.app, threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+
+    ws = simple_websocket.Client.connect(f"ws://127.0.0.1:{http.server_port}/transcribe/stream")
+    ws.send(json.dumps({"language": "en-US", "sample_rate": 16000, "interim_results": True}))
+
+    arrivals = {}
+
+    def read():
+        while True:
+            event = json.loads(ws.receive())
+            arrivals.setdefault(event["type"], time.perf_counter())
+            if event["type"] in ("done", "error"):
+                return
+
+    reader = threading.Thread(target=read)
+    reader.start()
+
+    frame = b"\x00" * (32 * args.frame_ms)
+    start = time.perf_counter()
+    for _ in range(int(args.seconds * 1000 / args.frame_ms)):
+        ws.send(frame)
+        time.sleep(args.frame_ms / 1000.0)
+    ws.send("end")
+    reader.join()
+
+    for kind in ("interim", "final", "done"):
+        if kind in arrivals:
+            print(f"first {kind:<8} {(arrivals[kind] - start) * 1000:8.1f} ms")
+    if "error" in arrivals:
+        print("stream reported an error")
+
+    http.shutdown()
+    backend.stop(None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Tail latency of recognize calls with retries and hedging (upstream.py).
+
+Runs against the fake backend with a share of straggling and failing
+calls, and sends the same stream of requests through UpstreamPolicy with:
+
+    single   one attempt, as before deadlines and retries
+    retry    jittered retries of transient errors within the deadline
+    hedged   retries plus a second attempt after the observed p95
+
+and reports latency percentiles, failed requests and backend calls per
+request (the extra load hedging costs). The hedged run warms up its
+latency history first, as a worker would in its first minute.
+
+    python benchmarks/bench_upstream.py --requests 2000 --straggler-rate 0.03 --failure-rate 0.01
+"""
+import argparse
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from google.cloud import speech_v1p1beta1 as speech  # noqa: E402
+
+import fake_speech  # noqa: E402
+from speech_pool import SpeechClientPool  # noqa: E402
+from upstream import LatencyTracker, UpstreamPolicy, deadline  # noqa: E402
+
+CONTENT = b"\x00" * 32000  # one second of 16 kHz LINEAR16
+
+
+def make_request():
+    config = speech.RecognitionConfig(
+        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+        sample_rate_hertz=16000,
+        language_code="ru-RU",
+    )
+    return speech.RecognizeRequest(config=config, audio=speech.RecognitionAudio(content=CONTENT))
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def run(policy, pool, request, args):
+    key = LatencyTracker.key("LINEAR16", len(CONTENT))
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            with deadline(args.timeout):
+                policy.call(lambda timeout: pool.start("recognize", request, timeout), key)
+            ok = True
+        except Exception:
+            ok = False
+        return ok, (time.perf_counter() - start) * 1000
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        return list(executor.map(one, range(args.requests)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05, help="backend base latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="mean extra exponential delay")
+    parser.add_argument("--straggler-rate", type=float, default=0.03)
+    parser.add_argument("--straggler-latency", type=float, default=1.0)
+    parser.add_argument("--failure-rate", type=float, default=0.01)
+    parser.add_argument("--timeout", type=float, default=5.0, help="per-request deadline in seconds")
+    args = parser.parse_args()
+
+    servicer = fake_speech.FakeSpeechServicer(
+        latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate, seed=0,
+        straggler_rate=args.straggler_rate, straggler_latency=args.straggler_latency)
+    server, port, _ = fake_speech.serve(servicer, max_workers=4 * args.concurrency)
+    pool = SpeechClientPool(size=2, endpoint=f"127.0.0.1:{port}")
+    pool.warmup()
+    request = make_request()
+
+    policies = {
+        "single": UpstreamPolicy(retries=0),
+        "retry": UpstreamPolicy(),
+        "hedged": UpstreamPolicy(hedge=True),
+    }
+    print(f"{args.requests} requests, {args.concurrency} concurrent; backend {args.latency * 1000:.0f} ms "
+          f"+ {args.straggler_rate:.0%} stragglers of {args.straggler_latency * 1000:.0f} ms, "
+          f"{args.failure_rate:.0%} failures")
+    print(f"{'policy':<8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'failed':>7} {'calls/req':>10}")
+    try:
+        for name, policy in policies.items():
+            if policy.hedge:
+                # Fill the latency history so hedging is active from the first measured request
+                for _ in range(policy.latencies.min_samples):
+                    policy.call(lambda timeout: pool.start("recognize", request, timeout),
+                                LatencyTracker.key("LINEAR16", len(CONTENT)))
+            calls = servicer.calls
+            outcomes = run(policy, pool, request, args)
+            calls = servicer.calls - calls
+            timings = sorted(ms for _, ms in outcomes)
+            failed = sum(1 for ok, _ in outcomes if not ok)
+            print(f"{name:<8} {statistics.median(timings):>8.1f} {percentile(timings, 95):>8.1f} "
+                  f"{percentile(timings, 99):>8.1f} {timings[-1]:>8.1f} {failed:>7} {calls / len(outcomes):>10.3f}")
+    finally:
+        pool.close()
+        server.stop(None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Speech-activity pruning (vad.py) on a synthetic call recording.
+
+Builds a call out of speech, silent gaps and hold music, prunes it with
+the VAD_* defaults and reports how much audio was removed, how much of
+the speech and of the dead air survived, and how long pruning took per
+hour of audio.
+
+    python benchmarks/bench_vad.py --minutes 30
+"""
+import argparse
+import io
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from corpus import synth_speech  # noqa: E402
+from vad import prune_silence  # noqa: E402
+
+SAMPLE_RATE = 16000
+
+
+def hold_music(seconds, rng):
+    """A few sustained chords, the kind of steady sound the dip filter drops"""
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    root = rng.choice([220.0, 247.0, 262.0, 294.0])
+    chord = sum(np.sin(2 * np.pi * root * ratio * t) for ratio in (1.0, 1.26, 1.5))
+    return 0.1 * chord / 3 + rng.normal(0, 0.002, len(t))
+
+
+def build_call(minutes, seed=0):
+    """(samples, is_speech) for a call alternating speech with silence and hold music"""
+    rng = np.random.default_rng(seed)
+    parts, labels = [], []
+    total = 0
+    while total < minutes * 60 * SAMPLE_RATE:
+        speech = synth_speech(rng.uniform(10, 40), SAMPLE_RATE, seed=int(rng.integers(1 << 30)))
+        if rng.random() < 0.3:
+            gap = hold_music(rng.uniform(10, 60), rng)
+        else:
+            gap = rng.normal(0, 0.001, int(rng.uniform(2, 20) * SAMPLE_RATE))
+        for part, label in ((speech, True), (gap, False)):
+            parts.append(part)
+            labels.append(np.full(len(part), label))
+            total += len(part)
+    return np.concatenate(parts), np.concatenate(labels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=30.0)
+    args = parser.parse_args()
+
+    samples, is_speech = build_call(args.minutes)
+    pcm = io.BytesIO((np.clip(samples, -1, 1) * 32767).astype("<i2").tobytes())
+    start = time.perf_counter()
+    offset_map = prune_silence(pcm, SAMPLE_RATE)
+    elapsed = time.perf_counter() - start
+
+    kept = np.zeros(len(samples), dtype=bool)
+    for original, length in zip(offset_map.original_starts, offset_map.lengths):
+        first = int(round(original * SAMPLE_RATE))
+        kept[first:first + int(round(length * SAMPLE_RATE))] = True
+    hours = offset_map.original_seconds / 3600
+    print(f"{offset_map.original_seconds / 60:.1f} min call, {(~is_speech).mean():.0%} silence and hold music")
+    print(f"removed {offset_map.removed_seconds:.0f} s ({offset_map.removed_seconds / offset_map.original_seconds:.0%}) "
+          f"in {len(offset_map.lengths)} kept segments")
+    print(f"speech kept {kept[is_speech].mean():.1%}, dead air kept {kept[~is_speech].mean():.1%}")
+    print(f"pruning took {elapsed * 1000:.0f} ms ({elapsed / hours:.2f} s per audio hour)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Synthetic audio corpus for the benchmarks.
+
+Generates speech-like signals (voiced bursts with pauses and background
+noise) at several lengths, sample rates, channel counts and formats.
+
+    python benchmarks/corpus.py --out /tmp/stt_corpus
+"""
+import argparse
+import shutil
+import subprocess
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+DEFAULT_LENGTHS = (5, 30, 90)
+DEFAULT_RATES = (8000, 16000, 44100)
+DEFAULT_FORMATS = ("wav", "flac", "ogg", "mp3", "opus")
+
+# Formats soundfile writes directly; the rest go through ffmpeg
+SOUNDFILE_FORMATS = {"wav": ("WAV", "PCM_16"), "flac": ("FLAC", "PCM_16"), "ogg": ("OGG", "VORBIS")}
+FFMPEG_CODECS = {"mp3": "libmp3lame", "opus": "libopus", "m4a": "aac"}
+
+
+def synth_speech(seconds, sample_rate, channels=1, seed=0):
+    """Voiced bursts at syllable rate with a pause every few seconds, plus noise"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / float(sample_rate)
+    f0 = 120 + 30 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t), 0, None)
+    pauses = (t % 4.0) < 3.2
+    signal = 0.3 * voiced * syllables * pauses + 0.01 * rng.standard_normal(len(t))
+    if channels == 2:
+        # Second channel is a delayed, quieter copy, like the far end of a call
+        delayed = np.roll(signal, int(0.25 * sample_rate)) * 0.6
+        signal = np.stack([signal, delayed], axis=1)
+    return np.clip(signal, -1, 1).astype(np.float32)
+
+
+def write_audio(path, samples, sample_rate, fmt):
+    """Write samples in the requested format; returns False if no encoder is available"""
+    if fmt in SOUNDFILE_FORMATS:
+        container, subtype = SOUNDFILE_FORMATS[fmt]
+        if fmt == "ogg" and sample_rate < 16000:
+            return False  # libvorbis rejects very low rates in some builds
+        sf.write(path, samples, sample_rate, format=container, subtype=subtype)
+        return True
+
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg or fmt not in FFMPEG_CODECS:
+        return False
+    channels = 1 if samples.ndim == 1 else samples.shape[1]
+    pcm = (samples * 32767).astype("<i2").tobytes()
+    rate_args = ["-ar", "48000"] if fmt == "opus" else []
+    result = subprocess.run(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+         "-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0",
+         "-c:a", FFMPEG_CODECS[fmt], *rate_args, str(path)],
+        input=pcm,
+    )
+    return result.returncode == 0
+
+
+def build_corpus(out_dir, lengths=DEFAULT_LENGTHS, rates=DEFAULT_RATES, formats=DEFAULT_FORMATS, channels=(1,)):
+    """Generate the corpus (reusing files that already exist); returns the list of paths"""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for seconds in lengths:
+        for rate in rates:
+            for n_channels in channels:
+                samples = None
+                for fmt in formats:
+                    path = out_dir / f"speech_{seconds}s_{rate}hz_{n_channels}ch.{fmt}"
+                    if not path.exists():
+                        if samples is None:
+                            samples = synth_speech(seconds, rate, n_channels, seed=seconds + rate)
+                        if not write_audio(path, samples, rate, fmt):
+                            continue
+                    paths.append(path)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the synthetic benchmark corpus")
+    parser.add_argument("--out", default="/tmp/stt_corpus")
+    parser.add_argument("--lengths", type=int, nargs="+", default=list(DEFAULT_LENGTHS))
+    parser.add_argument("--rates", type=int, nargs="+", default=list(DEFAULT_RATES))
+    parser.add_argument("--formats", nargs="+", default=list(DEFAULT_FORMATS))
+    parser.add_argument("--channels", type=int, nargs="+", default=[1], choices=[1, 2])
+    args = parser.parse_args()
+
+    files = build_corpus(args.out, args.lengths, args.rates, args.formats, args.channels)
+    total = sum(f.stat().st_size for f in files)
+    print(f"{len(files)} files, {total / 1e6:.1f} MB in {args.out}")
@@ -0,0 +1,246 @@
+"""Throughput and latency benchmark for /transcribe and the transcriber.py path.
+
+Every (target, concurrency) stage runs in its own subprocess against the
+local fake recognizer, so peak RSS is measured per stage. The in-process
+server's /metrics histograms give the mean time spent in each pipeline
+stage. Results are compared with benchmarks/baselines.json.
+
+    python benchmarks/run_benchmarks.py                     # run and check
+    python benchmarks/run_benchmarks.py --update-baseline   # record new baseline
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from corpus import build_corpus  # noqa: E402
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines.json"
+TARGETS = ("http", "cli")
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def drive(concurrency, total, call, files):
+    """Run total calls over the corpus with concurrency threads; returns (latencies, errors, elapsed)"""
+    latencies = []
+    errors = []
+    counter = iter(range(total))
+    lock = threading.Lock()
+
+    def loop():
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            path = files[index % len(files)]
+            start = time.perf_counter()
+            try:
+                call(path)
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(f"{path.name}: {e}")
+
+    threads = [threading.Thread(target=loop) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), errors, time.perf_counter() - start
+
+
+def stage_means():
+    """Mean seconds per pipeline stage from the in-process Prometheus registry"""
+    from prometheus_client import REGISTRY
+
+    sums, counts = {}, {}
+    for family in REGISTRY.collect():
+        if family.name != "stt_stage_seconds":
+            continue
+        for sample in family.samples:
+            stage = sample.labels.get("stage")
+            if sample.name.endswith("_sum"):
+                sums[stage] = sums.get(stage, 0.0) + sample.value
+            elif sample.name.endswith("_count"):
+                counts[stage] = counts.get(stage, 0.0) + sample.value
+    return {stage: round(sums[stage] / counts[stage] * 1000, 2) for stage in sums if counts.get(stage)}
+
+
+def run_stage(args):
+    """Body of one stage subprocess; prints a JSON summary"""
+    import fake_speech
+
+    backend, port, _ = fake_speech.serve(fake_speech.FakeSpeechServicer(
+        latency=args.latency, jitter=args.jitter, per_audio_second=args.per_audio_second, seed=1))
+    endpoint = f"127.0.0.1:{port}"
+    os.environ["SPEECH_ENDPOINT"] = endpoint
+    files = [Path(p) for p in args.files]
+    concurrency = args.concurrency[0]
+
+    if args.stage == "http":
+        import requests
+        from werkzeug.serving import make_server
+
+        import server
+        from cache import TranscriptionCache
+
+        server.speech_clients.endpoint = endpoint
+        # Measure the full pipeline, not the result cache
+        server.transcription_cache = TranscriptionCache(None, max_entries=0)
+        http = make_server("127.0.0.1", 0, server.app, threaded=True)
+        threading.Thread(target=http.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{http.server_port}/transcribe"
+        session = requests.Session()
+
+        def call(path):
+            with open(path, "rb") as f:
+                response = session.post(url, files={"file": (path.name, f)}, data={"language": "en-US"})
+            if response.status_code != 200:
+                raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+    else:
+        import transcriber
+
+        # transcriber.py writes its JSON next to the input, so work on copies
+        workdir = Path(tempfile.mkdtemp(prefix="stt_bench_cli_"))
+        files = [Path(shutil.copy(path, workdir)) for path in files]
+
+        def call(path):
+            transcriber.transcribe_audio(str(path))
+
+    latencies, errors, elapsed = drive(concurrency, args.requests, call, files)
+    summary = {
+        "target": args.stage,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+        "stages_ms": stage_means() if args.stage == "http" else {},
+        "first_errors": errors[:3],
+    }
+    print(json.dumps(summary))
+    backend.stop(None)
+
+
+def select_files(corpus, target):
+    """The CLI sends LINEAR16 at 16 kHz, so it only gets compliant WAV files"""
+    if target == "cli":
+        return [p for p in corpus if p.suffix == ".wav" and "_16000hz_1ch" in p.name]
+    if not shutil.which("ffmpeg"):
+        # The pydub fallback can only read WAV without ffmpeg
+        return [p for p in corpus if p.suffix == ".wav"]
+    return corpus
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions against the baseline"""
+    regressions = []
+    for result in results:
+        key = f"{result['target']}@{result['concurrency']}"
+        expected = baseline.get(key)
+        if not expected:
+            continue
+        if result["errors"]:
+            regressions.append(f"{key}: {result['errors']} failed requests")
+        if result["rps"] < expected["rps"] * (1 - tolerance):
+            regressions.append(f"{key}: {result['rps']} req/s vs baseline {expected['rps']}")
+        if result["p95_ms"] and result["p95_ms"] > expected["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{key}: p95 {result['p95_ms']} ms vs baseline {expected['p95_ms']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", nargs="+", choices=TARGETS, default=list(TARGETS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=48, help="requests per stage")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake recognizer base latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.05, help="fake recognizer mean jitter (s)")
+    parser.add_argument("--per-audio-second", type=float, default=0.002)
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "stt_corpus"))
+    parser.add_argument("--lengths", type=int, nargs="+", default=[5, 30])
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed fractional regression against the baseline")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", help="also write the results as JSON to this file")
+    # Internal: run a single stage in this process
+    parser.add_argument("--stage", choices=TARGETS, help=argparse.SUPPRESS)
+    parser.add_argument("--files", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        run_stage(args)
+        return
+
+    corpus = build_corpus(args.corpus, lengths=args.lengths)
+    results = []
+    print(f"{'target':<6} {'conc':>4} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'RSS MB':>7}  errors")
+    for target in args.targets:
+        files = select_files(corpus, target)
+        for concurrency in args.concurrency:
+            command = [
+                sys.executable, __file__, "--stage", target,
+                "--concurrency", str(concurrency), "--requests", str(args.requests),
+                "--latency", str(args.latency), "--jitter", str(args.jitter),
+                "--per-audio-second", str(args.per_audio_second),
+                "--files", *[str(p) for p in files],
+            ]
+            env = dict(os.environ, PYTHONPATH=str(ROOT))
+            env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+            output = subprocess.run(command, capture_output=True, text=True, env=env, cwd=ROOT)
+            lines = [line for line in output.stdout.splitlines() if line.startswith("{")]
+            if output.returncode != 0 or not lines:
+                print(f"{target:<6} {concurrency:>4}  stage failed:\n{output.stderr[-2000:]}")
+                continue
+            result = json.loads(lines[-1])
+            results.append(result)
+            print(f"{target:<6} {concurrency:>4} {result['rps']:>8} {result['p50_ms']:>8} "
+                  f"{result['p95_ms']:>8} {result['p99_ms']:>8} {result['peak_rss_mb']:>7}  {result['errors']}")
+            if result["stages_ms"]:
+                stages = ", ".join(f"{k}={v}" for k, v in sorted(result["stages_ms"].items()))
+                print(f"{'':<12}stage means (ms): {stages}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+    if args.update_baseline:
+        baseline = {f"{r['target']}@{r['concurrency']}": {"rps": r["rps"], "p95_ms": r["p95_ms"]}
+                    for r in results if not r["errors"]}
+        BASELINE_PATH.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline written to {BASELINE_PATH}")
+        return
+
+    if not BASELINE_PATH.exists():
+        print("No baseline recorded; run with --update-baseline")
+        return
+    regressions = compare(results, json.loads(BASELINE_PATH.read_text()), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+    print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import logging
+import threading
+import zlib
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Bump when the shape of cached results changes so stale entries are ignored
+CACHE_VERSION = 1
+KEY_PREFIX = f"transcription:v{CACHE_VERSION}"
+# Results of single long-audio chunks, relative to the chunk start (incremental mode)
+CHUNK_KEY_PREFIX = f"transcription-chunk:v{CACHE_VERSION}"
+
+
+def file_digest(source, chunk_size=1024 * 1024):
+    """Return a hex digest of a file path, file object or bytes buffer"""
+    hasher = hashlib.blake2b(digest_size=20)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        hasher.update(source)
+        return hasher.hexdigest()
+
+    if hasattr(source, "read"):
+        for chunk in iter(lambda: source.read(chunk_size), b""):
+            hasher.update(chunk)
+        return hasher.hexdigest()
+
+    with open(source, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def normalize_options(language_code, config_options=None):
+    """Return a canonical string for the options that affect a transcription"""
+    options = dict(config_options or {})
+    options["language_code"] = language_code
+    return json.dumps(options, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def make_cache_key(audio_digest, language_code, config_options=None, prefix=KEY_PREFIX):
+    """Build a content-addressed cache key from the audio digest and options"""
+    options = normalize_options(language_code, config_options)
+    options_digest = hashlib.blake2b(options.encode("utf-8"), digest_size=12).hexdigest()
+    return f"{prefix}:{audio_digest}:{options_digest}"
+
+
+def dumps(value):
+    """Serialize a result to compact, compressed JSON bytes"""
+    payload = json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+    return zlib.compress(payload.encode("utf-8"), 6)
+
+
+def loads(data):
+    """Deserialize bytes produced by dumps()"""
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+class LRUCache:
+    """Thread-safe LRU of serialized values bounded by entry count and total bytes"""
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._data[key] = value
+            self._size += len(value)
+            while len(self._data) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class TranscriptionCache:
+    """Two-tier result cache: a per-worker LRU in front of a shared Redis"""
+
+    def __init__(self, redis_client=None, ttl=3600, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.local = LRUCache(max_entries=max_entries, max_bytes=max_bytes)
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self.errors = 0
+
+    def get(self, key):
+        """Return the cached result for key, or None"""
+        data = self.local.get(key)
+        if data is None and self.redis_client:
+            try:
+                data = self.redis_client.get(key)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Cache get error: {e}")
+                data = None
+            if data is None:
+                self.redis_misses += 1
+            else:
+                self.redis_hits += 1
+                self.local.set(key, data)
+
+        if data is None:
+            return None
+        try:
+            return loads(data)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Discarding unreadable cache entry {key}: {e}")
+            return None
+
+    def set(self, key, value, ttl=None):
+        """Store a result in both tiers"""
+        data = dumps(value)
+        self.local.set(key, data)
+        if self.redis_client:
+            try:
+                self.redis_client.setex(key, ttl or self.ttl, data)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Cache set error: {e}")
+
+    def stats(self):
+        return {
+            "local": self.local.stats(),
+            "redis_hits": self.redis_hits,
+            "redis_misses": self.redis_misses,
+            "errors": self.errors,
+        }
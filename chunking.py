@@ -0,0 +1,196 @@
+import heapq
+import io
+
+import numpy as np
+
+# Analysis frame used by the energy scan
+FRAME_SECONDS = 0.02
+
+# Content-defined cuts: a candidate about every quarter second, found by a gear
+# hash of the samples before it. The table comes from the PCG64 raw stream,
+# which numpy keeps stable, so the cuts do not move between installs
+CANDIDATE_SECONDS = 0.25
+_GEAR = (np.random.PCG64(0x5EED).random_raw(1 << 16) & 0xFFFF).astype(np.uint16)
+
+
+def pcm_to_array(pcm, channels=1):
+    """View 16-bit little-endian PCM bytes as an (n_frames, channels) int16 array"""
+    samples = np.frombuffer(pcm, dtype="<i2")
+    usable = len(samples) - len(samples) % channels
+    return samples[:usable].reshape(-1, channels)
+
+
+def split_channels(source, channels, outputs, block_frames=64 * 1024):
+    """Copy each channel of interleaved PCM from a file object into its own file object in outputs"""
+    frame_bytes = 2 * channels
+    for block in iter(lambda: source.read(block_frames * frame_bytes), b""):
+        # One transposed copy per block makes every channel a contiguous row
+        planar = np.ascontiguousarray(pcm_to_array(block, channels).T)
+        for output, samples in zip(outputs, planar):
+            output.write(memoryview(samples))
+    return outputs
+
+
+def frame_energy(samples, frame_size):
+    """Mean-square energy of consecutive frames, computed in one vectorized pass"""
+    if samples.ndim == 2:
+        samples = samples.mean(axis=1, dtype=np.float32)
+    n_frames = len(samples) // frame_size
+    frames = samples[:n_frames * frame_size].astype(np.float32).reshape(n_frames, frame_size)
+    return np.einsum("ij,ij->i", frames, frames) / frame_size
+
+
+def _read_exactly(source, size):
+    """Read size bytes, or fewer only at end of stream"""
+    parts = []
+    while size > 0:
+        block = source.read(size)
+        if not block:
+            break
+        parts.append(block)
+        size -= len(block)
+    return b"".join(parts)
+
+
+def iter_pcm_chunks(source, sample_rate, channels=1, max_chunk_seconds=55.0, search_seconds=10.0):
+    """Yield (offset_seconds, chunk_bytes) from a PCM file object, cut at low-energy points.
+
+    Each chunk is at most max_chunk_seconds long and is cut at the quietest
+    frame in its last search_seconds, so words are unlikely to be split in
+    half. Only one chunk plus the search window is held at a time.
+    """
+    frame_size = max(1, int(sample_rate * FRAME_SECONDS))
+    max_len = int(max_chunk_seconds * sample_rate)
+    search = min(int(search_seconds * sample_rate), max_len // 2)
+    frame_bytes = 2 * channels
+    start = 0
+    pending = b""
+    while True:
+        # One sample past a full chunk tells whether another cut is needed
+        window = pending + _read_exactly(source, (max_len + 1) * frame_bytes - len(pending))
+        length = len(window) // frame_bytes
+        if length <= max_len:
+            if length:
+                yield start / float(sample_rate), window[:length * frame_bytes]
+            return
+
+        # Energy frames sit on a grid counted from the start of the audio, not of this window
+        lo = (start + max_len - search) // frame_size
+        hi = (start + max_len) // frame_size
+        samples = pcm_to_array(window, channels)
+        energy = frame_energy(samples[max(0, lo * frame_size - start):hi * frame_size - start], frame_size)
+        cut = (lo + int(np.argmin(energy))) * frame_size if len(energy) else start + max_len
+        if cut <= start:
+            cut = start + max_len
+        split = (cut - start) * frame_bytes
+        yield start / float(sample_rate), window[:split]
+        pending = window[split:]
+        start = cut
+
+
+def content_cut(samples, min_len, max_len, sample_rate):
+    """Frame index of the quietest content-defined cut between min_len and max_len.
+
+    A candidate is a position where the gear hash of the samples just
+    before it has its low bits clear. It depends only on those samples, so
+    it moves with the audio when earlier audio is trimmed or inserted.
+    Among candidates the one with the least energy around it wins, ties to
+    the earliest; max_len when there are none.
+    """
+    bits = min(16, max(1, int(round(np.log2(sample_rate * CANDIDATE_SECONDS)))))
+    half = max(1, int(sample_rate * FRAME_SECONDS) // 2)
+    min_len = max(min_len, bits + half)
+    if samples.shape[1] == 1:
+        symbols = samples[min_len - bits:max_len, 0].view(np.uint16)
+    else:
+        symbols = samples[min_len - bits:max_len].astype(np.int32).sum(axis=1).astype(np.uint16)
+
+    # Low 16 bits of the gear hash ending at each sample; older samples shift out
+    gear = _GEAR[symbols]
+    hashes = np.zeros(len(gear), dtype=np.uint16)
+    for k in range(bits):
+        hashes[k:] += gear[:len(gear) - k] << np.uint16(k)
+    hits = np.flatnonzero((hashes[bits - 1:] & np.uint16((1 << bits) - 1)) == 0)
+    if not len(hits):
+        return max_len
+    candidates = min_len + hits
+
+    # Energy of the samples within half a frame on either side of each candidate
+    around = np.clip(candidates[:, None] + np.arange(-half, half), 0, len(samples) - 1)
+    energy = np.square(samples[around].astype(np.float32)).sum(axis=(1, 2))
+    return int(candidates[np.argmin(energy)])
+
+
+def iter_content_chunks(source, sample_rate, channels=1, min_chunk_seconds=10.0, max_chunk_seconds=55.0):
+    """Yield (offset_seconds, chunk_bytes) from a PCM file object, cut at content-defined points.
+
+    Unlike iter_pcm_chunks the cuts are not tied to positions in the file:
+    each is picked by content_cut relative to the previous one. Trimming or
+    appending audio, or editing a stretch of it, only changes the chunks
+    around the edit; the rest keep the same bytes, and the same digests.
+    """
+    min_len = int(min_chunk_seconds * sample_rate)
+    max_len = int(max_chunk_seconds * sample_rate)
+    half = max(1, int(sample_rate * FRAME_SECONDS) // 2)
+    frame_bytes = 2 * channels
+    start = 0
+    pending = b""
+    while True:
+        # Half a frame past a full chunk, for the energy around the last candidates
+        window = pending + _read_exactly(source, (max_len + half) * frame_bytes - len(pending))
+        length = len(window) // frame_bytes
+        if length <= max_len:
+            if length:
+                yield start / float(sample_rate), window[:length * frame_bytes]
+            return
+
+        cut = content_cut(pcm_to_array(window, channels), min_len, max_len, sample_rate)
+        split = cut * frame_bytes
+        yield start / float(sample_rate), window[:split]
+        pending = window[split:]
+        start += cut
+
+
+def split_pcm(pcm, sample_rate, channels=1, max_chunk_seconds=55.0, search_seconds=10.0):
+    """Split PCM bytes at low-energy points; returns a list of (offset_seconds, chunk_bytes)"""
+    return list(iter_pcm_chunks(io.BytesIO(pcm), sample_rate, channels, max_chunk_seconds, search_seconds))
+
+
+def shift_results(results, offset):
+    """Move result and word timestamps forward by offset seconds, in place"""
+    if not offset:
+        return results
+    for result in results:
+        if result.get("result_end_time") is not None:
+            result["result_end_time"] += offset
+        for alternative in result.get("alternatives", []):
+            for word in alternative.get("words", []):
+                word["start_time"] += offset
+                word["end_time"] += offset
+    return results
+
+
+def merge_results(chunk_results):
+    """Concatenate per-chunk results that are already on the original timeline"""
+    merged = []
+    for results in chunk_results:
+        merged.extend(results)
+    return merged
+
+
+def result_start(result):
+    """Start of a result: its first word, or its end when it has no word timings"""
+    for alternative in result.get("alternatives", [])[:1]:
+        if alternative.get("words"):
+            return alternative["words"][0]["start_time"]
+    return result.get("result_end_time") or 0.0
+
+
+def results_end(results):
+    """Seconds of audio a transcript covers, up to the end of its last result"""
+    return max((result.get("result_end_time") or 0.0 for result in results), default=0.0)
+
+
+def merge_channels(channel_results):
+    """Interleave per-channel results, each list already in time order, into one time-ordered list"""
+    return list(heapq.merge(*channel_results, key=result_start))
@@ -0,0 +1,193 @@
+"""Local stand-in for the Google Speech-to-Text gRPC service.
+
+Used by the benchmarks and for development without Google credentials.
+Point the server or CLI at it with SPEECH_ENDPOINT=localhost:<port>.
+"""
+import argparse
+import io
+import random
+import time
+from concurrent import futures
+from datetime import timedelta
+
+import grpc
+import soundfile as sf
+from google.cloud import speech_v1p1beta1 as speech
+
+from audio import probe_ogg_opus
+
+SERVICE_NAME = "google.cloud.speech.v1p1beta1.Speech"
+
+# Seconds of audio represented by one fake word
+WORD_SECONDS = 0.5
+
+
+def audio_duration(content, sample_rate=16000, channels=1):
+    """Estimate the duration of LINEAR16, FLAC or Ogg Opus content"""
+    if content[:4] == b"fLaC":
+        return sf.info(io.BytesIO(content)).duration
+    if content[:4] == b"OggS":
+        info = probe_ogg_opus(io.BytesIO(content))
+        return info["duration"] if info else 0.0
+    size = len(content)
+    if content[:4] == b"RIFF":
+        size -= 44
+    return max(size, 0) / float(2 * channels * (sample_rate or 16000))
+
+
+def fake_words(duration, offset=0.0):
+    """A word every WORD_SECONDS of audio, named after its position on the timeline"""
+    words = []
+    t = 0.0
+    while t + WORD_SECONDS <= duration + 1e-9:
+        words.append(speech.WordInfo(
+            word=f"word{int(round((offset + t) / WORD_SECONDS))}",
+            start_time=timedelta(seconds=offset + t),
+            end_time=timedelta(seconds=offset + t + WORD_SECONDS),
+        ))
+        t += WORD_SECONDS
+    return words
+
+
+def fake_results(duration, offset=0.0, channel_tag=0):
+    """Build one result with a word every WORD_SECONDS of audio"""
+    words = fake_words(duration, offset)
+    if not words:
+        return []
+    return [speech.SpeechRecognitionResult(
+        alternatives=[speech.SpeechRecognitionAlternative(
+            transcript=" ".join(w.word for w in words),
+            confidence=0.9,
+            words=words,
+        )],
+        channel_tag=channel_tag,
+        result_end_time=timedelta(seconds=offset + duration),
+    )]
+
+
+class FakeSpeechServicer:
+    """Serves Recognize and StreamingRecognize with configurable latency, jitter, stragglers and failure rate"""
+
+    # Streaming audio is finalized in segments of this many seconds
+    FINAL_SECONDS = 1.0
+
+    def __init__(self, latency=0.05, jitter=0.0, per_audio_second=0.0, failure_rate=0.0, seed=None,
+                 stream_latency=0.01, straggler_rate=0.0, straggler_latency=1.0):
+        self.latency = latency
+        self.stream_latency = stream_latency
+        self.jitter = jitter
+        # A share of calls that are slow for reasons unrelated to the request, like a busy backend
+        self.straggler_rate = straggler_rate
+        self.straggler_latency = straggler_latency
+        self.per_audio_second = per_audio_second
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    def _delay(self, duration):
+        delay = self.latency + self.per_audio_second * duration
+        if self.jitter:
+            delay += self.random.expovariate(1.0 / self.jitter)
+        if self.straggler_rate and self.random.random() < self.straggler_rate:
+            delay += self.straggler_latency
+        return delay
+
+    def recognize(self, request, context):
+        self.calls += 1
+        config = request.config
+        duration = audio_duration(request.audio.content, config.sample_rate_hertz,
+                                  config.audio_channel_count or 1)
+        time.sleep(self._delay(duration))
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "injected failure")
+        return speech.RecognizeResponse(
+            results=fake_results(duration),
+            total_billed_time=timedelta(seconds=duration),
+        )
+
+    def _streaming_result(self, duration, offset, is_final):
+        words = fake_words(duration, offset)
+        return speech.StreamingRecognitionResult(
+            alternatives=[speech.SpeechRecognitionAlternative(
+                transcript=" ".join(w.word for w in words),
+                confidence=0.9 if is_final else 0.0,
+                words=words if is_final else [],
+            )],
+            is_final=is_final,
+            stability=1.0 if is_final else 0.5,
+            result_end_time=timedelta(seconds=offset + duration),
+        )
+
+    def streaming_recognize(self, request_iterator, context):
+        self.calls += 1
+        sample_rate = 16000
+        interim = False
+        received = 0
+        finalized = 0.0
+        for request in request_iterator:
+            if "streaming_config" in request:
+                sample_rate = request.streaming_config.config.sample_rate_hertz or sample_rate
+                interim = request.streaming_config.interim_results
+                continue
+            received += len(request.audio_content)
+            duration = received / float(2 * sample_rate)
+            time.sleep(self.stream_latency)
+            while duration - finalized >= self.FINAL_SECONDS:
+                yield speech.StreamingRecognizeResponse(
+                    results=[self._streaming_result(self.FINAL_SECONDS, finalized, True)])
+                finalized += self.FINAL_SECONDS
+            if interim and duration > finalized:
+                yield speech.StreamingRecognizeResponse(
+                    results=[self._streaming_result(duration - finalized, finalized, False)])
+        if received / float(2 * sample_rate) > finalized:
+            yield speech.StreamingRecognizeResponse(results=[self._streaming_result(
+                received / float(2 * sample_rate) - finalized, finalized, True)])
+
+    def handlers(self):
+        return grpc.method_handlers_generic_handler(SERVICE_NAME, {
+            "Recognize": grpc.unary_unary_rpc_method_handler(
+                self.recognize,
+                request_deserializer=speech.RecognizeRequest.deserialize,
+                response_serializer=speech.RecognizeResponse.serialize,
+            ),
+            "StreamingRecognize": grpc.stream_stream_rpc_method_handler(
+                self.streaming_recognize,
+                request_deserializer=speech.StreamingRecognizeRequest.deserialize,
+                response_serializer=speech.StreamingRecognizeResponse.serialize,
+            ),
+        })
+
+
+def serve(servicer=None, port=0, max_workers=32):
+    """Start the fake service; returns (server, port, servicer)"""
+    servicer = servicer or FakeSpeechServicer()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    server.add_generic_rpc_handlers((servicer.handlers(),))
+    port = server.add_insecure_port(f"127.0.0.1:{port}")
+    server.start()
+    return server, port, servicer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake Speech-to-Text backend")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--latency", type=float, default=0.05, help="base latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="mean extra exponential delay")
+    parser.add_argument("--per-audio-second", type=float, default=0.0,
+                        help="extra latency per second of audio")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--straggler-rate", type=float, default=0.0, help="share of calls that are slow")
+    parser.add_argument("--straggler-latency", type=float, default=1.0, help="extra delay of a slow call")
+    parser.add_argument("--max-workers", type=int, default=32, help="concurrent calls the backend serves")
+    args = parser.parse_args()
+
+    server, port, _ = serve(FakeSpeechServicer(
+        latency=args.latency,
+        jitter=args.jitter,
+        per_audio_second=args.per_audio_second,
+        failure_rate=args.failure_rate,
+        straggler_rate=args.straggler_rate,
+        straggler_latency=args.straggler_latency,
+    ), port=args.port, max_workers=args.max_workers)
+    print(f"Fake Speech backend listening on 127.0.0.1:{port}")
+    server.wait_for_termination()
@@ -1,5 +1,34 @@
 # Gunicorn configuration file
+import os
+
+# Channels are only created after fork, so gRPC's fork handlers are not needed;
+# left on, they intermittently kill the ffmpeg children forked per request
+os.environ.setdefault("GRPC_ENABLE_FORK_SUPPORT", "false")
+
+# "uvicorn.workers.UvicornWorker" serves async_server:app instead
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+
+if worker_class == "gevent":
+    # Patch before preload_app imports grpc and the app in the master; patching
+    # later in the worker leaves executor futures waiting on real locks that
+    # greenlets never release, and requests hang after the recognize call
+    from gevent import monkey
+    monkey.patch_all()
+
+    # Let gRPC's blocking calls cooperate with the gevent hub
+    from grpc.experimental import gevent as grpc_gevent
+    grpc_gevent.init_gevent()
+
 import multiprocessing
+import shutil
+
+# Workers share metrics through this directory; it must be set before the app is imported.
+# preload_app imports the app in the master before any server hook runs, and its live
+# gauges create their files there straight away, so start each run with an empty
+# directory here rather than in on_starting
+metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/stt_metrics")
+shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir, exist_ok=True)
 
 # Server socket
 bind = "0.0.0.0:5000"
@@ -7,7 +36,6 @@ backlog = 2048
 
 # Worker processes
 workers = int(multiprocessing.cpu_count() * 2 + 1)
-worker_class = "gevent"
 worker_connections = 1000
 max_requests = 1000
 max_requests_jitter = 100
@@ -29,4 +57,20 @@ loglevel = 'info'
 preload_app = True
 
 # Threading
-threads = 4
\ No newline at end of file
+threads = 4
+
+
+def child_exit(server, worker):
+    """Drop a dead worker's live gauges from the aggregated metrics"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    """Give each worker its own connections, threads and Speech channels, warmed before it accepts"""
+    if worker_class.startswith("uvicorn"):
+        # async_server.py runs init_worker when its event loop starts serving
+        return
+
+    from server import init_worker
+    init_worker()
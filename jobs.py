@@ -0,0 +1,198 @@
+import json
+import logging
+import time
+import uuid
+
+from cache import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# Priorities run from 0 (lowest) to 9 (highest); FIFO within a priority
+MIN_PRIORITY = 0
+MAX_PRIORITY = 9
+DEFAULT_PRIORITY = 5
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Atomically move the next job from the pending set to the processing set.
+# KEYS: pending, processing; ARGV: visibility deadline, now, job key prefix
+CLAIM_SCRIPT = """
+local popped = redis.call('ZPOPMIN', KEYS[1])
+if #popped == 0 then
+    return nil
+end
+local job_id = popped[1]
+redis.call('ZADD', KEYS[2], ARGV[1], job_id)
+local job_key = ARGV[3] .. job_id
+redis.call('HSET', job_key, 'status', 'running', 'updated_at', ARGV[2])
+redis.call('HINCRBY', job_key, 'attempts', 1)
+return job_id
+"""
+
+
+def _score(priority, now):
+    """Higher priority sorts first; older jobs first within a priority"""
+    return (MAX_PRIORITY - priority) * 1e13 + now * 1000
+
+
+def _text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class Job:
+    """A claimed job as seen by a worker"""
+
+    def __init__(self, job_id, fields, payload):
+        self.id = job_id
+        self.filename = _text(fields.get(b"filename", b""))
+        self.language = _text(fields.get(b"language", b""))
+        self.options = json.loads(_text(fields.get(b"options", b"{}")))
+        self.attempts = int(fields.get(b"attempts", 0))
+        self.payload = payload
+
+
+class JobQueue:
+    """Redis-backed priority queue with a visibility timeout and bounded retries"""
+
+    def __init__(self, redis_client, prefix="stt:jobs", visibility_timeout=600, max_attempts=3, result_ttl=86400):
+        self.redis = redis_client
+        self.prefix = prefix
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+        self.pending_key = f"{prefix}:pending"
+        self.processing_key = f"{prefix}:processing"
+        self._claim = redis_client.register_script(CLAIM_SCRIPT)
+
+    def job_key(self, job_id):
+        return f"{self.prefix}:job:{job_id}"
+
+    def payload_key(self, job_id):
+        return f"{self.prefix}:payload:{job_id}"
+
+    def enqueue(self, payload, filename, language, options=None, priority=DEFAULT_PRIORITY):
+        """Store the upload and queue it; returns the new job id"""
+        priority = min(max(int(priority), MIN_PRIORITY), MAX_PRIORITY)
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(self.job_key(job_id), mapping={
+            "status": QUEUED,
+            "filename": filename,
+            "language": language,
+            "options": json.dumps(options or {}),
+            "priority": priority,
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+        })
+        pipe.set(self.payload_key(job_id), payload)
+        pipe.zadd(self.pending_key, {job_id: _score(priority, now)})
+        pipe.execute()
+        return job_id
+
+    def status(self, job_id):
+        """Return the public view of a job, or None if it does not exist"""
+        fields = self.redis.hgetall(self.job_key(job_id))
+        if not fields:
+            return None
+        status = {
+            "job_id": job_id,
+            "status": _text(fields[b"status"]),
+            "language": _text(fields.get(b"language", b"")),
+            "priority": int(fields.get(b"priority", DEFAULT_PRIORITY)),
+            "attempts": int(fields.get(b"attempts", 0)),
+            "created_at": float(fields.get(b"created_at", 0)),
+            "updated_at": float(fields.get(b"updated_at", 0)),
+        }
+        if b"result" in fields:
+            status["results"] = loads(fields[b"result"])
+        if b"error" in fields:
+            status["error"] = _text(fields[b"error"])
+        return status
+
+    def depth(self):
+        return {
+            "pending": self.redis.zcard(self.pending_key),
+            "processing": self.redis.zcard(self.processing_key),
+        }
+
+    def claim(self):
+        """Take the highest-priority job, or return None if the queue is empty"""
+        now = time.time()
+        job_id = self._claim(
+            keys=[self.pending_key, self.processing_key],
+            args=[now + self.visibility_timeout, now, f"{self.prefix}:job:"],
+        )
+        if job_id is None:
+            return None
+        job_id = _text(job_id)
+        fields = self.redis.hgetall(self.job_key(job_id))
+        payload = self.redis.get(self.payload_key(job_id))
+        if not fields or payload is None:
+            # Expired or deleted underneath us; nothing left to run
+            self.redis.zrem(self.processing_key, job_id)
+            return None
+        return Job(job_id, fields, payload)
+
+    def heartbeat(self, job_id):
+        """Push the visibility deadline out while a job is still being worked on"""
+        deadline = time.time() + self.visibility_timeout
+        return bool(self.redis.zadd(self.processing_key, {job_id: deadline}, xx=True, ch=True))
+
+    def complete(self, job_id, results):
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.zrem(self.processing_key, job_id)
+        # Drop a duplicate left behind if the job was reclaimed mid-flight
+        pipe.zrem(self.pending_key, job_id)
+        pipe.hset(self.job_key(job_id), mapping={
+            "status": DONE,
+            "result": dumps(results),
+            "updated_at": time.time(),
+        })
+        pipe.hdel(self.job_key(job_id), "error")
+        pipe.delete(self.payload_key(job_id))
+        pipe.expire(self.job_key(job_id), self.result_ttl)
+        pipe.execute()
+
+    def fail(self, job_id, error, retry=True):
+        """Record a failed attempt; requeue it unless attempts are exhausted"""
+        if not self.redis.zrem(self.processing_key, job_id):
+            # Already reclaimed by requeue_expired()
+            return
+        self._retry_or_fail(job_id, error, retry)
+
+    def _retry_or_fail(self, job_id, error, retry=True):
+        job_key = self.job_key(job_id)
+        attempts = int(self.redis.hget(job_key, "attempts") or 0)
+        now = time.time()
+        if retry and attempts < self.max_attempts:
+            priority = int(self.redis.hget(job_key, "priority") or DEFAULT_PRIORITY)
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.hset(job_key, mapping={"status": QUEUED, "error": error, "updated_at": now})
+            pipe.zadd(self.pending_key, {job_id: _score(priority, now)})
+            pipe.execute()
+            logger.warning(f"Job {job_id} attempt {attempts} failed, requeued: {error}")
+            return
+
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(job_key, mapping={"status": FAILED, "error": error, "updated_at": now})
+        pipe.delete(self.payload_key(job_id))
+        pipe.expire(job_key, self.result_ttl)
+        pipe.execute()
+        logger.error(f"Job {job_id} failed after {attempts} attempts: {error}")
+
+    def requeue_expired(self):
+        """Return jobs whose worker stopped heartbeating to the pending set"""
+        expired = self.redis.zrangebyscore(self.processing_key, "-inf", time.time())
+        count = 0
+        for job_id in expired:
+            job_id = _text(job_id)
+            # Whoever removes the entry owns the recovery
+            if self.redis.zrem(self.processing_key, job_id):
+                self._retry_or_fail(job_id, "worker stopped responding")
+                count += 1
+        return count
@@ -0,0 +1,202 @@
+"""Prometheus metrics for the transcription pipeline.
+
+When PROMETHEUS_MULTIPROC_DIR is set (gunicorn_config.py does this), every
+worker writes its samples to that directory and /metrics aggregates them,
+so a scrape of any worker reports the whole server.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess, REGISTRY)
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "stt_stage_seconds",
+    "Time spent in each stage of a transcription request",
+    ["stage", "language", "model", "cache"],
+    buckets=STAGE_BUCKETS,
+)
+REQUESTS = Counter(
+    "stt_requests_total",
+    "Transcription requests by endpoint, outcome and cache status",
+    ["endpoint", "status", "cache"],
+)
+AUDIO_SECONDS = Counter(
+    "stt_audio_seconds_total",
+    "Seconds of decoded audio sent for recognition",
+    ["language", "model"],
+)
+CHUNK_CACHE_SECONDS = Counter(
+    "stt_chunk_cache_audio_seconds_total",
+    "Seconds of long audio found in, or missing from, the incremental chunk cache",
+    ["result"],
+)
+UPSTREAM_BYTES = Counter(
+    "stt_upstream_bytes_total",
+    "Payload bytes sent to the recognizer",
+    ["encoding"],
+)
+EXECUTOR_QUEUED = Gauge(
+    "stt_executor_queued_tasks",
+    "Tasks waiting for a thread in the shared executor",
+    multiprocess_mode="livesum",
+)
+EXECUTOR_ACTIVE = Gauge(
+    "stt_executor_active_threads",
+    "Executor threads currently running a task",
+    multiprocess_mode="livesum",
+)
+ADMISSION_QUEUED_AUDIO = Gauge(
+    "stt_admission_queued_audio_seconds",
+    "Seconds of audio waiting for a recognition slot",
+    multiprocess_mode="livesum",
+)
+ADMISSION_ACTIVE = Gauge(
+    "stt_admission_active",
+    "Admitted recognitions currently running",
+    multiprocess_mode="livesum",
+)
+MEMORY_IN_FLIGHT = Gauge(
+    "stt_memory_in_flight_bytes",
+    "Upload and decoded audio bytes reserved by requests in progress",
+    multiprocess_mode="livesum",
+)
+UPSTREAM_RETRIES = Counter(
+    "stt_upstream_retries_total",
+    "Recognize attempts retried after a transient error",
+    ["error"],
+)
+UPSTREAM_HEDGES = Counter(
+    "stt_upstream_hedges_total",
+    "Hedged second recognize attempts, by which attempt answered first",
+    ["winner"],
+)
+VAD_INPUT_SECONDS = Counter(
+    "stt_vad_input_audio_seconds_total",
+    "Seconds of decoded audio checked for speech activity",
+)
+VAD_REMOVED_SECONDS = Counter(
+    "stt_vad_removed_audio_seconds_total",
+    "Seconds of non-speech cut out before recognition",
+)
+VAD_REMOVED_RATIO = Histogram(
+    "stt_vad_removed_ratio",
+    "Share of each request's audio cut out as non-speech",
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+)
+ADMISSION_REJECTED = Counter(
+    "stt_admission_rejected_total",
+    "Requests refused by admission control",
+    ["reason"],
+)
+
+_current = contextvars.ContextVar("request_timer", default=None)
+
+
+class RequestTimer:
+    """Collects stage durations for one request and records them under its final labels.
+
+    Stages are buffered until finish() so that every stage carries the
+    cache status, which is only known part way through the request.
+    """
+
+    def __init__(self, endpoint, language="", model=""):
+        self.endpoint = endpoint
+        self.language = language
+        self.model = model
+        self.cache = "miss"
+        self.started = time.perf_counter()
+        self._stages = []
+        self._lock = threading.Lock()
+        self._token = None
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self._stages.append((stage, seconds))
+
+    def finish(self, status):
+        labels = {"language": self.language, "model": self.model, "cache": self.cache}
+        with self._lock:
+            stages, self._stages = self._stages, []
+        for stage, seconds in stages:
+            STAGE_SECONDS.labels(stage=stage, **labels).observe(seconds)
+        STAGE_SECONDS.labels(stage="total", **labels).observe(time.perf_counter() - self.started)
+        REQUESTS.labels(endpoint=self.endpoint, status=status, cache=self.cache).inc()
+        if self._token is not None:
+            try:
+                _current.reset(self._token)
+            except ValueError:
+                # Finished from a different context than it was started in
+                pass
+            self._token = None
+
+
+def start_request(endpoint, language="", model=""):
+    """Start timing a request in the current context"""
+    timer = RequestTimer(endpoint, language, model)
+    timer._token = _current.set(timer)
+    return timer
+
+
+def current_request():
+    return _current.get()
+
+
+@contextmanager
+def stage(name):
+    """Time a block as a stage of the current request; a no-op outside one"""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - start)
+
+
+def submit(executor, fn, *args, **kwargs):
+    """executor.submit() that keeps the request context and tracks queue depth and active threads"""
+    context = contextvars.copy_context()
+    EXECUTOR_QUEUED.inc()
+
+    def run():
+        EXECUTOR_QUEUED.dec()
+        EXECUTOR_ACTIVE.inc()
+        try:
+            return context.run(fn, *args, **kwargs)
+        finally:
+            EXECUTOR_ACTIVE.dec()
+
+    try:
+        future = executor.submit(run)
+    except Exception:
+        EXECUTOR_QUEUED.dec()
+        raise
+    # A task cancelled before it started never runs run()
+    future.add_done_callback(lambda f: f.cancelled() and EXECUTOR_QUEUED.dec())
+    return future
+
+
+def record_vad(original_seconds, removed_seconds):
+    """Count one request's audio before and after speech-activity pruning"""
+    VAD_INPUT_SECONDS.inc(original_seconds)
+    VAD_REMOVED_SECONDS.inc(removed_seconds)
+    if original_seconds:
+        VAD_REMOVED_RATIO.observe(removed_seconds / original_seconds)
+
+
+def render():
+    """Return (body, content type) for a /metrics scrape"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
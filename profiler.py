@@ -0,0 +1,251 @@
+"""On-demand profiling of a live worker.
+
+SamplingProfiler walks every thread's stack at a fixed interval from a
+native thread and counts the stacks in collapsed form ("a;b;c 12" per
+line), which flamegraph.pl, inferno and speedscope read as they are.
+Under gevent every request runs on the main thread, so that one thread's
+stacks show where the requests spend their time.
+
+MemoryProfiler keeps tracemalloc snapshots for the requests that grew
+traced memory the most since tracing was started.
+
+Neither does anything until asked: no sampler thread exists outside a
+profile() call, and with tracemalloc off a request costs one
+is_tracing() check.
+"""
+import _thread
+import asyncio
+import collections
+import contextvars
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+# Leaf functions of a thread that is waiting rather than working
+IDLE_FUNCTIONS = {"wait", "select", "poll", "epoll", "sleep", "_wait_for_tstate_lock", "accept", "get",
+                  "acquire_with_timeout"}
+
+
+def _native(module, name, default):
+    """The unpatched function when gevent has monkey-patched the module"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return default
+    return monkey.get_original(module, name) if monkey.is_module_patched(module) else default
+
+
+# Native ids: under gevent the patched get_ident numbers greenlets, not threads
+_get_ident = _native("_thread", "get_ident", _thread.get_ident)
+# Imported in the master's main thread, which is the thread a forked worker runs on
+MAIN_THREAD = _get_ident()
+
+
+def _label(code):
+    path = code.co_filename.replace(os.sep, "/").rsplit("/", 2)
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Collapsed stack counts of every thread, sampled every interval seconds"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.samples = 0
+        self.stacks = collections.Counter()
+        self._labels = {}
+        self._done = False
+
+    def _collapse(self, frame):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = _label(code)
+            frames.append(label)
+            frame = frame.f_back
+        frames.reverse()
+        return frames
+
+    def _sample(self, seconds, sleep):
+        try:
+            me = _get_ident()
+            names = {}
+            end = time.monotonic() + seconds
+            while time.monotonic() < end:
+                for ident, frame in sys._current_frames().items():
+                    if ident != me:
+                        if ident not in names:
+                            # Threads can start mid-profile, executor threads especially
+                            names = {thread.ident: thread.name for thread in threading.enumerate()}
+                            names[MAIN_THREAD] = "MainThread"
+                        stack = self._collapse(frame)
+                        stack.insert(0, names.get(ident, f"thread-{ident}"))
+                        self.stacks[tuple(stack)] += 1
+                self.samples += 1
+                sleep(self.interval)
+        finally:
+            self._done = True
+
+    def profile(self, seconds):
+        """Sample for seconds; blocks only the calling greenlet or thread"""
+        # A native thread and sleep, so the sampler keeps running while greenlets are busy
+        start_thread = _native("_thread", "start_new_thread", _thread.start_new_thread)
+        start_thread(self._sample, (seconds, _native("time", "sleep", time.sleep)))
+        while not self._done:
+            time.sleep(min(self.interval * 10, 0.1))
+        return self
+
+    async def profile_async(self, seconds):
+        """profile() for an event loop"""
+        _thread.start_new_thread(self._sample, (seconds, time.sleep))
+        while not self._done:
+            await asyncio.sleep(min(self.interval * 10, 0.1))
+        return self
+
+    def collapsed(self, idle=False):
+        """One "frame;frame;frame count" line per distinct stack, most frequent first"""
+        lines = []
+        for stack, count in self.stacks.most_common():
+            if not idle and stack[-1].split(" ", 1)[0] in IDLE_FUNCTIONS:
+                continue
+            lines.append(f"{';'.join(stack)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+_profiling = threading.Lock()
+
+
+def try_start_profile():
+    """Take the one-profile-at-a-time slot; False if a profile is already running in this worker"""
+    return _profiling.acquire(blocking=False)
+
+
+def end_profile():
+    _profiling.release()
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+
+
+_tracked = contextvars.ContextVar("memory_tracked_request", default=None)
+
+
+class _TrackedRequest:
+    def __init__(self, endpoint, content_length, start_bytes):
+        self.endpoint = endpoint
+        self.content_length = content_length
+        self.started = time.time()
+        self.start_bytes = start_bytes
+        self.growth = 0
+        self.top = None
+        self._token = None
+
+
+class MemoryProfiler:
+    """tracemalloc snapshots of the requests that grow traced memory the most.
+
+    Requests are tracked between start_request() and finish_request().
+    checkpoint(), called where a request holds the most (its upload,
+    decoded audio and recognizer payload at once), measures traced memory
+    against the request's start and, when the growth would make the list
+    of the `keep` largest, snapshots the allocation sites that grew since
+    tracing began. Requests that overlap share the process's memory, so
+    their growth includes each other's.
+    """
+
+    def __init__(self, keep=5, top=20):
+        self.keep = keep
+        self.top = top
+        self._largest = []
+        self._order = itertools.count()
+        self._baseline = None
+        self._lock = threading.Lock()
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, frames=10):
+        """Start tracing in this worker; the largest-request list starts over"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        with self._lock:
+            self._largest = []
+            self._baseline = _snapshot()
+
+    def stop(self):
+        """Stop tracing; the reports collected so far are kept"""
+        tracemalloc.stop()
+        self._baseline = None
+
+    def start_request(self, endpoint, content_length=None):
+        """Track the current request; None, and nothing else done, when tracing is off"""
+        if not tracemalloc.is_tracing():
+            return None
+        tracked = _TrackedRequest(endpoint, content_length, tracemalloc.get_traced_memory()[0])
+        tracked._token = _tracked.set(tracked)
+        return tracked
+
+    def _smallest(self):
+        with self._lock:
+            return self._largest[0][0] if len(self._largest) >= self.keep else 0
+
+    def checkpoint(self):
+        """Record the current request's growth, with a snapshot if it is among the largest"""
+        tracked = _tracked.get()
+        if tracked is None or not tracemalloc.is_tracing():
+            return
+        growth = tracemalloc.get_traced_memory()[0] - tracked.start_bytes
+        if growth <= tracked.growth:
+            return
+        tracked.growth = growth
+        if growth <= self._smallest() or self._baseline is None:
+            return
+        snapshot = _snapshot()
+        tracked.top = [
+            {"traceback": [str(frame) for frame in stat.traceback], "size_diff": stat.size_diff,
+             "size": stat.size, "count_diff": stat.count_diff}
+            for stat in snapshot.compare_to(self._baseline, "traceback")[:self.top]
+        ]
+
+    def finish_request(self, tracked):
+        if tracked is None:
+            return
+        try:
+            _tracked.reset(tracked._token)
+        except ValueError:
+            # Finished from a different context than it was started in
+            pass
+        if tracked.top is None:
+            return
+        report = {
+            "endpoint": tracked.endpoint,
+            "content_length": tracked.content_length,
+            "started": tracked.started,
+            "seconds": time.time() - tracked.started,
+            "growth_bytes": tracked.growth,
+            "top": tracked.top,
+        }
+        with self._lock:
+            entry = (tracked.growth, next(self._order), report)
+            if len(self._largest) < self.keep:
+                heapq.heappush(self._largest, entry)
+            else:
+                heapq.heappushpop(self._largest, entry)
+
+    def stats(self):
+        traced, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        with self._lock:
+            largest = [report for _, _, report in sorted(self._largest, key=lambda entry: entry[:2], reverse=True)]
+        return {"tracing": tracemalloc.is_tracing(), "traced_bytes": traced, "peak_bytes": peak,
+                "requests": largest}
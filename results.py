@@ -0,0 +1,176 @@
+import base64
+
+import numpy as np
+
+# Response shapes for /transcribe: "json" is one dict per word, "compact" keeps
+# word timings as parallel arrays, the rest are rendered as text
+OUTPUT_FORMATS = {"json", "compact", "srt", "vtt", "text"}
+TEXT_CONTENT_TYPES = {
+    "srt": "application/x-subrip; charset=utf-8",
+    "vtt": "text/vtt; charset=utf-8",
+    "text": "text/plain; charset=utf-8",
+}
+
+# Subtitle cue limits: two lines of about 42 characters, a few seconds on screen
+CUE_MAX_SECONDS = 7.0
+CUE_MAX_CHARS = 84
+CUE_MAX_GAP = 1.0
+
+
+def _raw(message):
+    """The protobuf message under a proto-plus wrapper; its fields are far cheaper to read"""
+    pb = getattr(type(message), "pb", None)
+    return pb(message) if pb is not None else message
+
+
+def _seconds(duration):
+    return duration.seconds + duration.nanos / 1e9
+
+
+def alternative_to_dict(alternative, offset=0.0):
+    """Convert a SpeechRecognitionAlternative to a plain dict"""
+    alternative = _raw(alternative)
+    return {
+        "transcript": alternative.transcript,
+        "confidence": alternative.confidence,
+        "words": [
+            {
+                "word": word_info.word,
+                "start_time": offset + _seconds(word_info.start_time),
+                "end_time": offset + _seconds(word_info.end_time)
+            }
+            for word_info in alternative.words
+        ] if hasattr(alternative, 'words') else []
+    }
+
+
+def result_to_dict(result, offset=0.0):
+    """Convert a recognition result to a plain dict, shifted by offset seconds"""
+    result = _raw(result)
+    return {
+        "alternatives": [alternative_to_dict(alternative, offset) for alternative in result.alternatives],
+        "channel_tag": result.channel_tag if hasattr(result, 'channel_tag') else None,
+        "result_end_time": offset + _seconds(result.result_end_time) if hasattr(result, 'result_end_time') else None
+    }
+
+
+def response_to_dicts(response):
+    """Convert every result of a RecognizeResponse"""
+    return [result_to_dict(result) for result in _raw(response).results]
+
+
+def _milliseconds(words, key):
+    times = np.fromiter((word[key] for word in words), dtype=np.float64, count=len(words))
+    return np.rint(times * 1000.0).astype("<u4")
+
+
+def compact_alternative(alternative, binary=False):
+    """One alternative with its word timings as parallel arrays of words and milliseconds.
+
+    With binary, start_ms and end_ms are base64 of little-endian uint32 arrays.
+    """
+    words = alternative.get("words", [])
+    start_ms = _milliseconds(words, "start_time")
+    end_ms = _milliseconds(words, "end_time")
+    if binary:
+        start_ms = base64.b64encode(start_ms.tobytes()).decode("ascii")
+        end_ms = base64.b64encode(end_ms.tobytes()).decode("ascii")
+    else:
+        start_ms, end_ms = start_ms.tolist(), end_ms.tolist()
+    return {
+        "transcript": alternative.get("transcript", ""),
+        "confidence": alternative.get("confidence"),
+        "words": [word["word"] for word in words],
+        "start_ms": start_ms,
+        "end_ms": end_ms
+    }
+
+
+def compact_results(results, binary=False):
+    """Results in the compact shape; everything but the word lists is unchanged"""
+    return [
+        dict(result, alternatives=[compact_alternative(alternative, binary)
+                                   for alternative in result.get("alternatives", [])])
+        for result in results
+    ]
+
+
+def subtitle_cues(results):
+    """(start_ms, end_ms, text) cues from the top alternative's word timings.
+
+    A cue ends at a result boundary, a pause longer than CUE_MAX_GAP or the
+    length limits. Results without word timings become one cue each,
+    spanning from the previous result's end.
+    """
+    cues = []
+    previous_end = 0
+    for result in compact_results(results):
+        end = result.get("result_end_time")
+        result_end_ms = int(round(end * 1000)) if end is not None else previous_end
+        if not result["alternatives"]:
+            previous_end = result_end_ms
+            continue
+        alternative = result["alternatives"][0]
+        words, starts, ends = alternative["words"], alternative["start_ms"], alternative["end_ms"]
+        if not words:
+            if alternative["transcript"].strip():
+                cues.append((previous_end, result_end_ms, alternative["transcript"].strip()))
+            previous_end = result_end_ms
+            continue
+
+        first = 0
+        length = len(words[0])
+        for i in range(1, len(words) + 1):
+            if i < len(words):
+                fits = (ends[i] - starts[first] <= CUE_MAX_SECONDS * 1000
+                        and length + 1 + len(words[i]) <= CUE_MAX_CHARS
+                        and starts[i] - ends[i - 1] <= CUE_MAX_GAP * 1000)
+                if fits:
+                    length += 1 + len(words[i])
+                    continue
+            cues.append((starts[first], ends[i - 1], " ".join(words[first:i])))
+            if i < len(words):
+                first, length = i, len(words[i])
+        previous_end = max(result_end_ms, ends[-1])
+    return cues
+
+
+def _timestamp(ms, separator):
+    hours, ms = divmod(int(ms), 3600000)
+    minutes, ms = divmod(ms, 60000)
+    seconds, ms = divmod(ms, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{ms:03d}"
+
+
+def to_srt(results):
+    return "".join(
+        f"{index}\n{_timestamp(start, ',')} --> {_timestamp(end, ',')}\n{text}\n\n"
+        for index, (start, end, text) in enumerate(subtitle_cues(results), 1)
+    )
+
+
+def to_vtt(results):
+    return "WEBVTT\n\n" + "".join(
+        f"{_timestamp(start, '.')} --> {_timestamp(end, '.')}\n{text}\n\n"
+        for start, end, text in subtitle_cues(results)
+    )
+
+
+def to_text(results):
+    """Top transcript of each result, one per line"""
+    lines = (result["alternatives"][0].get("transcript", "").strip()
+             for result in results if result.get("alternatives"))
+    return "".join(f"{line}\n" for line in lines if line)
+
+
+def render_results(results, output_format, binary=False):
+    """Results in the requested output format: a list for json and compact, a string otherwise"""
+    if output_format == "compact":
+        return compact_results(results, binary)
+    if output_format == "srt":
+        return to_srt(results)
+    if output_format == "vtt":
+        return to_vtt(results)
+    if output_format == "text":
+        return to_text(results)
+    return results
@@ -1,26 +1,40 @@
 import os
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from flask import Flask, request, jsonify, send_from_directory
-from flask_cors import CORS
-import requests
-import base64
-from pydub import AudioSegment
+import json
+import queue
+import threading
+import zipfile
+import contextlib
+import hmac
 import tempfile
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
+import metrics
+from flask_cors import CORS
+from flask_sock import Sock, ConnectionClosed
 import logging
 from dotenv import load_dotenv
 import time
 from functools import wraps
 import redis
+from google.api_core.exceptions import DeadlineExceeded
 from google.cloud import speech_v1p1beta1 as speech
-from google.oauth2 import service_account
 import io
-import wave
-import soundfile as sf
-import numpy as np
 from werkzeug.utils import secure_filename
-import validators
+from cache import CHUNK_KEY_PREFIX, TranscriptionCache, file_digest, make_cache_key
+from singleflight import SingleFlight
+from admission import AdmissionController, AdmissionRejected, MemoryLedger, TokenBuckets
+from speech_pool import SpeechClientPool
+from chunking import (iter_content_chunks, iter_pcm_chunks, shift_results, merge_channels, merge_results, results_end,
+                      split_channels)
+from audio import (AudioDecodeError, AudioTooLong, decode_to_pcm, decode_with_soundfile, encode_for_upstream,
+                   probe_audio, read_pcm16, warmup_codecs, STRICT_HEADER_FORMATS, UPSTREAM_AUTO, UPSTREAM_FLAC, UPSTREAM_POLICIES)
+from jobs import JobQueue, DEFAULT_PRIORITY
+from results import OUTPUT_FORMATS, TEXT_CONTENT_TYPES, render_results, response_to_dicts
+from streaming import END_OF_AUDIO, bytes_per_second, stream_results
+from vad import prune_silence, remap_results
+from upstream import LatencyTracker, UpstreamPolicy, deadline
+from profiler import MemoryProfiler, SamplingProfiler, end_profile, try_start_profile
 
 # Load environment variables
 load_dotenv()
@@ -28,6 +42,7 @@ load_dotenv()
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # Enable CORS for cross-origin requests
+sock = Sock(app)  # WebSocket routes for live streaming
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s %(levelname)s %(name)s %(message)s'
@@ -42,16 +57,163 @@ class Config:
     ALLOWED_EXTENSIONS = {'mp3', 'wav', 'flac', 'm4a', 'aac', 'ogg', 'wma', 'opus'}
     REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
     
+    # Cache settings
+    CACHE_TTL = int(os.getenv('CACHE_TTL', '3600'))  # 1 hour
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '256'))  # per-worker LRU tier
+    CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+    
+    # Job queue settings (see worker.py)
+    JOB_VISIBILITY_TIMEOUT = int(os.getenv('JOB_VISIBILITY_TIMEOUT', '600'))
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+    JOB_RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', '86400'))  # 1 day
+    # Deadline for one attempt at a job, instead of REQUEST_TIMEOUT; the heartbeat keeps its lease
+    # meanwhile. 0 for none. A job that runs out is failed for good rather than retried
+    JOB_TIMEOUT = int(os.getenv('JOB_TIMEOUT', '3600'))  # 1 hour
+    
+    # Coalescing of identical in-flight requests
+    SINGLEFLIGHT_ENABLED = os.getenv('SINGLEFLIGHT_ENABLED', 'true').lower() == 'true'
+    SINGLEFLIGHT_LOCK_TTL = int(os.getenv('SINGLEFLIGHT_LOCK_TTL', '30'))  # refreshed while the leader runs
+    
+    # Admission control; quotas are in seconds of audio, keyed by X-API-Key or client address
+    ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+    ADMISSION_MAX_WAIT = float(os.getenv('ADMISSION_MAX_WAIT', '60'))  # refuse with 429 beyond this
+    TENANT_AUDIO_RATE = float(os.getenv('TENANT_AUDIO_RATE', '60'))  # audio-seconds per second; 0 = unlimited
+    TENANT_AUDIO_BURST = float(os.getenv('TENANT_AUDIO_BURST', '7200'))
+    TENANT_QUOTAS = json.loads(os.getenv('TENANT_QUOTAS', '{}'))  # {"<api key>": [rate, burst]}
+    
     # Performance settings
     THREAD_POOL_SIZE = int(os.getenv('THREAD_POOL_SIZE', '4'))
+    ADMISSION_MAX_ACTIVE = int(os.getenv('ADMISSION_MAX_ACTIVE', str(THREAD_POOL_SIZE)))
+    SPEECH_CLIENT_POOL_SIZE = int(os.getenv('SPEECH_CLIENT_POOL_SIZE', '2'))
+    SPEECH_ENDPOINT = os.getenv('SPEECH_ENDPOINT')  # e.g. localhost:50051 for fake_speech.py
+    CREDENTIALS_PATH = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
     REQUEST_TIMEOUT = int(os.getenv('REQUEST_TIMEOUT', '300'))  # 5 minutes
     
+    # Recognize calls share their request's REQUEST_TIMEOUT deadline; transient errors are retried
+    # with jittered backoff, and with hedging on a call slower than the recent p95 gets a second attempt
+    UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', '3'))
+    UPSTREAM_BACKOFF = float(os.getenv('UPSTREAM_BACKOFF', '0.2'))  # doubles per attempt, jittered
+    UPSTREAM_MAX_BACKOFF = float(os.getenv('UPSTREAM_MAX_BACKOFF', '5'))
+    UPSTREAM_HEDGE_ENABLED = os.getenv('UPSTREAM_HEDGE_ENABLED', 'false').lower() == 'true'
+    UPSTREAM_HEDGE_PERCENTILE = float(os.getenv('UPSTREAM_HEDGE_PERCENTILE', '95'))
+    UPSTREAM_HEDGE_MIN_DELAY = float(os.getenv('UPSTREAM_HEDGE_MIN_DELAY', '0.05'))
+    
+    # Connect the Speech channels and run the codecs once in each worker before it takes traffic
+    WORKER_WARMUP = os.getenv('WORKER_WARMUP', 'true').lower() == 'true'
+    
     # Audio processing settings
+    FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
     SAMPLE_RATE = int(os.getenv('SAMPLE_RATE', '16000'))
     CHANNELS = int(os.getenv('CHANNELS', '1'))
+    MAX_AUDIO_SECONDS = float(os.getenv('MAX_AUDIO_SECONDS', '14400'))  # 4 hours; 0 = no limit
+    
+    # Memory bounds: decoded audio beyond half the per-request budget spills to a temp file,
+    # and a worker defers, then refuses, work that would take it past its limit
+    REQUEST_MEMORY_BUDGET = int(os.getenv('REQUEST_MEMORY_BUDGET', str(32 * 1024 * 1024)))
+    WORKER_MEMORY_LIMIT = int(os.getenv('WORKER_MEMORY_LIMIT', str(512 * 1024 * 1024)))  # 0 = no limit
+    MEMORY_MAX_WAIT = float(os.getenv('MEMORY_MAX_WAIT', '10'))
+    
+    # Uploads and archive members larger than this are kept in temp files
+    UPLOAD_SPOOL_BYTES = 500 * 1024
+    
+    # Encoding sent to the recognizer: linear16, flac, or auto (OGG_OPUS passthrough, FLAC otherwise)
+    UPSTREAM_ENCODING = os.getenv('UPSTREAM_ENCODING', UPSTREAM_AUTO).lower()
+    if UPSTREAM_ENCODING not in UPSTREAM_POLICIES:
+        UPSTREAM_ENCODING = UPSTREAM_AUTO
+    
+    # Long audio is split at quiet points; synchronous recognize caps out at ~60s
+    LONG_AUDIO_ENABLED = os.getenv('LONG_AUDIO_ENABLED', 'true').lower() == 'true'
+    LONG_AUDIO_CHUNK_SECONDS = float(os.getenv('LONG_AUDIO_CHUNK_SECONDS', '55'))
+    LONG_AUDIO_SEARCH_SECONDS = float(os.getenv('LONG_AUDIO_SEARCH_SECONDS', '10'))
+    LONG_AUDIO_MAX_PARALLEL = int(os.getenv('LONG_AUDIO_MAX_PARALLEL', '8'))
+    
+    # Incremental mode: long audio is cut at content-defined points and each chunk's results
+    # are cached by its digest, so a trimmed or extended re-upload only recognizes what changed
+    INCREMENTAL_ENABLED = os.getenv('INCREMENTAL_ENABLED', 'false').lower() == 'true'
+    INCREMENTAL_MIN_SECONDS = float(os.getenv('INCREMENTAL_MIN_SECONDS', '10'))
+    
+    # Voice-activity pruning: non-speech stretches longer than VAD_MIN_SILENCE_SECONDS are cut out
+    # before recognition, less VAD_PADDING_SECONDS on each side; timestamps still refer to the upload
+    VAD_ENABLED = os.getenv('VAD_ENABLED', 'false').lower() == 'true'
+    VAD_MIN_SILENCE_SECONDS = float(os.getenv('VAD_MIN_SILENCE_SECONDS', '1.0'))
+    VAD_PADDING_SECONDS = float(os.getenv('VAD_PADDING_SECONDS', '0.3'))
+    VAD_MARGIN_DB = float(os.getenv('VAD_MARGIN_DB', '12'))  # above the recording's noise floor
+    VAD_DIP_RATIO = float(os.getenv('VAD_DIP_RATIO', '0.05'))  # steadier sound counts as music; 0 keeps it
+    
+    # Separate channels: each channel of a multi-channel upload (one party per side of a stereo call)
+    # is recognized as its own mono recording, concurrently and without diarization. The default for
+    # requests that do not set separate_channels; needs CHANNELS=1 and a header that gives the channel count
+    SEPARATE_CHANNELS = os.getenv('SEPARATE_CHANNELS', 'false').lower() == 'true'
+    MAX_SEPARATE_CHANNELS = int(os.getenv('MAX_SEPARATE_CHANNELS', '8'))  # more than this are downmixed
+    
+    # Debug endpoints (/debug/profile, /debug/memory) answer only requests with this token in
+    # X-Debug-Token; without one they are not served. Nothing is sampled or traced until asked
+    DEBUG_TOKEN = os.getenv('DEBUG_TOKEN')
+    PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+    PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', '0.01'))  # 100 samples a second
+    MEMORY_PROFILE_REQUESTS = int(os.getenv('MEMORY_PROFILE_REQUESTS', '5'))  # largest requests kept
+    
+    # Batch settings
+    BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+    BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', '16'))
+    # Files plus zip members per batch; BATCH_MAX_FILES is its older name
+    MAX_BATCH_ITEMS = int(os.getenv('MAX_BATCH_ITEMS', os.getenv('BATCH_MAX_FILES', '500')))
+    # Zip members are held to MAX_CONTENT_LENGTH each and to this much unpacked in total per batch
+    BATCH_MAX_EXPANDED_BYTES = int(os.getenv('BATCH_MAX_EXPANDED_BYTES', str(1024 * 1024 * 1024)))
+    
+    # Live streaming settings; one upstream stream is limited to ~5 minutes
+    STREAM_MAX_SECONDS = int(os.getenv('STREAM_MAX_SECONDS', '290'))
+    STREAM_IDLE_TIMEOUT = int(os.getenv('STREAM_IDLE_TIMEOUT', '30'))
+    STREAM_ENCODINGS = {'LINEAR16', 'MULAW', 'FLAC', 'OGG_OPUS', 'WEBM_OPUS'}
 
 app.config['MAX_CONTENT_LENGTH'] = Config.MAX_CONTENT_LENGTH
 
+# Request options the server acts on itself; they are not RecognitionConfig fields
+SERVER_OPTIONS = {'separate_channels'}
+
+# Languages listed by /languages
+LANGUAGES = {
+    "major_languages": [
+        {"code": "en-US", "name": "English (United States)"},
+        {"code": "ru-RU", "name": "Russian (Russia)"},
+        {"code": "es-ES", "name": "Spanish (Spain)"},
+        {"code": "fr-FR", "name": "French (France)"},
+        {"code": "de-DE", "name": "German (Germany)"},
+        {"code": "it-IT", "name": "Italian (Italy)"},
+        {"code": "pt-BR", "name": "Portuguese (Brazil)"},
+        {"code": "zh-CN", "name": "Chinese (Mandarin)"},
+        {"code": "ja-JP", "name": "Japanese"},
+        {"code": "ko-KR", "name": "Korean"}
+    ],
+    "additional_languages": [
+        {"code": "af-ZA", "name": "Afrikaans"},
+        {"code": "ar-SA", "name": "Arabic (Saudi Arabia)"},
+        {"code": "cs-CZ", "name": "Czech"},
+        {"code": "da-DK", "name": "Danish"},
+        {"code": "nl-NL", "name": "Dutch"},
+        {"code": "fi-FI", "name": "Finnish"},
+        {"code": "el-GR", "name": "Greek"},
+        {"code": "he-IL", "name": "Hebrew"},
+        {"code": "hi-IN", "name": "Hindi"},
+        {"code": "hu-HU", "name": "Hungarian"},
+        {"code": "id-ID", "name": "Indonesian"},
+        {"code": "no-NO", "name": "Norwegian"},
+        {"code": "pl-PL", "name": "Polish"},
+        {"code": "ro-RO", "name": "Romanian"},
+        {"code": "sk-SK", "name": "Slovak"},
+        {"code": "sv-SE", "name": "Swedish"},
+        {"code": "tr-TR", "name": "Turkish"},
+        {"code": "uk-UA", "name": "Ukrainian"}
+    ]
+}
+
+# Recognition models the Speech API offers
+RECOGNITION_MODELS = {'default', 'command_and_search', 'phone_call', 'video', 'latest_long', 'latest_short',
+                      'medical_conversation', 'medical_dictation'}
+
+# Metric label values; anything else a client sends is counted as "other" so it cannot add series
+LANGUAGE_LABELS = {language["code"] for group in LANGUAGES.values() for language in group}
+
 # Initialize Redis for caching
 try:
     redis_client = redis.from_url(Config.REDIS_URL)
@@ -59,9 +221,95 @@ except:
     redis_client = None
     app.logger.warning("Redis connection failed, proceeding without caching")
 
-# Initialize thread pool for CPU-intensive tasks
+# Per-worker LRU tier in front of Redis
+transcription_cache = TranscriptionCache(
+    redis_client,
+    ttl=Config.CACHE_TTL,
+    max_entries=Config.CACHE_MAX_ENTRIES,
+    max_bytes=Config.CACHE_MAX_BYTES
+)
+
+# Identical uploads in flight at the same time are transcribed once
+in_flight = SingleFlight(
+    redis_client,
+    lock_ttl=Config.SINGLEFLIGHT_LOCK_TTL,
+    wait_timeout=Config.REQUEST_TIMEOUT,
+    # Refusals are for the leader's tenant or this worker's memory; followers try for themselves
+    private_errors=(AdmissionRejected,)
+)
+
+# Per-tenant quotas and fair, bounded access to recognition
+admission = AdmissionController(
+    TokenBuckets(
+        redis_client,
+        rate=Config.TENANT_AUDIO_RATE,
+        burst=Config.TENANT_AUDIO_BURST,
+        overrides=Config.TENANT_QUOTAS
+    ),
+    max_active=Config.ADMISSION_MAX_ACTIVE,
+    max_wait=Config.ADMISSION_MAX_WAIT
+)
+
+# Upload and decoded-audio bytes held by this worker's requests
+memory = MemoryLedger(Config.WORKER_MEMORY_LIMIT, max_wait=Config.MEMORY_MAX_WAIT)
+
+# Queue for asynchronous jobs, processed by worker.py
+job_queue = JobQueue(
+    redis_client,
+    visibility_timeout=Config.JOB_VISIBILITY_TIMEOUT,
+    max_attempts=Config.JOB_MAX_ATTEMPTS,
+    result_ttl=Config.JOB_RESULT_TTL
+) if redis_client else None
+
+# Initialize thread pool for CPU-intensive tasks; init_worker replaces it after a fork
 executor = ThreadPoolExecutor(max_workers=Config.THREAD_POOL_SIZE)
 
+# Long-lived Speech clients, created lazily in each worker process
+speech_clients = SpeechClientPool(
+    size=Config.SPEECH_CLIENT_POOL_SIZE,
+    credentials_path=Config.CREDENTIALS_PATH,
+    endpoint=Config.SPEECH_ENDPOINT
+)
+
+# Deadline, retry and hedging policy for recognize calls; the async server shares its latency history
+upstream_policy = UpstreamPolicy(
+    default_timeout=Config.REQUEST_TIMEOUT,
+    retries=Config.UPSTREAM_RETRIES,
+    backoff=Config.UPSTREAM_BACKOFF,
+    max_backoff=Config.UPSTREAM_MAX_BACKOFF,
+    hedge=Config.UPSTREAM_HEDGE_ENABLED,
+    hedge_percentile=Config.UPSTREAM_HEDGE_PERCENTILE,
+    hedge_min_delay=Config.UPSTREAM_HEDGE_MIN_DELAY
+)
+
+# Per-request tracemalloc snapshots, off until started through /debug/memory
+memory_profiler = MemoryProfiler(keep=Config.MEMORY_PROFILE_REQUESTS)
+
+def init_worker(warm_speech=True):
+    """
+    Per-process setup for a worker forked from the preloaded app.
+    
+    Sockets and threads do not survive a fork intact: the worker drops the
+    Redis connections it inherited and starts its own executor threads.
+    With WORKER_WARMUP it then connects the Speech channels (unless
+    warm_speech is off, as in async_server.py, which does that on its own
+    loop) and runs the codecs once, so the first request pays for neither.
+    """
+    global executor
+    start = time.perf_counter()
+    if redis_client is not None:
+        redis_client.connection_pool.reset()
+    executor = ThreadPoolExecutor(max_workers=Config.THREAD_POOL_SIZE)
+    if not Config.WORKER_WARMUP:
+        return
+    if warm_speech:
+        speech_clients.warmup()
+    try:
+        warmup_codecs(Config.SAMPLE_RATE, Config.CHANNELS, Config.FFMPEG_BINARY)
+    except AudioDecodeError as e:
+        app.logger.warning(f"Codec warmup failed: {e}")
+    app.logger.info(f"Worker {os.getpid()} warmed up in {(time.perf_counter() - start) * 1000:.0f} ms")
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and \
@@ -74,29 +322,24 @@ def validate_language_code(lang_code):
     # Basic validation - could be expanded
     return len(lang_code) >= 2 and '-' in lang_code
 
-def cache_result(key, ttl=3600):
-    """Decorator to cache function results in Redis"""
+def metric_labels(language, model):
+    """Return (language, model) as metric label values, mapping unknown values to other"""
+    return (language if not language or language in LANGUAGE_LABELS else "other",
+            model if not model or model in RECOGNITION_MODELS else "other")
+
+def cache_result(key, ttl=None):
+    """Decorator to cache function results in the transcription cache"""
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            if redis_client:
-                try:
-                    cached_result = redis_client.get(key)
-                    if cached_result:
-                        app.logger.info(f"Cache hit for key: {key}")
-                        return eval(cached_result.decode('utf-8'))
-                except Exception as e:
-                    app.logger.warning(f"Cache get error: {e}")
+            cached_result = transcription_cache.get(key)
+            if cached_result is not None:
+                app.logger.info(f"Cache hit for key: {key}")
+                return cached_result
             
             result = func(*args, **kwargs)
-            
-            if redis_client:
-                try:
-                    redis_client.setex(key, ttl, str(result))
-                    app.logger.info(f"Result cached for key: {key}")
-                except Exception as e:
-                    app.logger.warning(f"Cache set error: {e}")
-            
+            transcription_cache.set(key, result, ttl)
+            app.logger.info(f"Result cached for key: {key}")
             return result
         return wrapper
     return decorator
@@ -112,99 +355,322 @@ def measure_time(func):
         return result
     return wrapper
 
-def convert_to_wav(audio_file, target_path, sample_rate=16000, channels=1):
-    """Convert audio to WAV format with correct parameters"""
+def convert_to_pcm(stream, sample_rate=16000, channels=1, format=None, output=None):
+    """Decode an upload stream to raw LINEAR16 PCM through an ffmpeg pipe, into output if given"""
     try:
-        # Load audio file
-        audio = AudioSegment.from_file(audio_file)
-        
-        # Apply transformations
-        audio = audio.set_channels(channels)
-        audio = audio.set_frame_rate(sample_rate)
-        
-        # Export to WAV
-        audio.export(target_path, format="wav")
-        return target_path
+        return decode_to_pcm(stream, sample_rate, channels, format=format, ffmpeg=Config.FFMPEG_BINARY,
+                             output=output)
     except Exception as e:
         app.logger.error(f"Audio conversion error: {e}")
         raise
 
-def transcribe_with_google_client(audio_path, language_code="ru-RU", config_options=None):
-    """Transcribe audio using Google Cloud Speech-to-Text client library with enhanced options"""
+def check_duration(duration):
+    """Refuse audio longer than Config.MAX_AUDIO_SECONDS"""
+    if Config.MAX_AUDIO_SECONDS and duration > Config.MAX_AUDIO_SECONDS:
+        raise AudioTooLong(duration, Config.MAX_AUDIO_SECONDS)
+
+def pcm_spool(parts=1):
+    """Temp file for decoded audio; in memory up to half the per-request budget, shared by parts files"""
+    return tempfile.SpooledTemporaryFile(max_size=Config.REQUEST_MEMORY_BUDGET // 2 // parts)
+
+def long_audio_parallelism():
+    """Chunks of one request in flight at once; their PCM is the other half of the budget"""
+    chunk_bytes = Config.LONG_AUDIO_CHUNK_SECONDS * 2 * Config.SAMPLE_RATE * Config.CHANNELS
+    return max(1, min(Config.LONG_AUDIO_MAX_PARALLEL, int(Config.REQUEST_MEMORY_BUDGET // 2 // chunk_bytes)))
+
+def cache_options(config_options):
+    """The request's options plus the server settings that change its results, for cache keys"""
+    options = dict(config_options,
+                   sample_rate_hertz=Config.SAMPLE_RATE,
+                   audio_channel_count=Config.CHANNELS,
+                   upstream_encoding=Config.UPSTREAM_ENCODING)
+    if Config.INCREMENTAL_ENABLED:
+        # Content-defined cuts give other chunks, and so other results, than quiet-point cuts
+        options["chunking"] = "content"
+    if Config.VAD_ENABLED:
+        options["vad"] = [Config.VAD_MIN_SILENCE_SECONDS, Config.VAD_PADDING_SECONDS,
+                          Config.VAD_MARGIN_DB, Config.VAD_DIP_RATIO]
+    return options
+
+def long_audio_chunks(pcm):
+    """(offset, bytes) chunks of a long PCM file object, cut as the incremental mode requires"""
+    if Config.INCREMENTAL_ENABLED:
+        return iter_content_chunks(pcm, Config.SAMPLE_RATE, Config.CHANNELS,
+                                   Config.INCREMENTAL_MIN_SECONDS, Config.LONG_AUDIO_CHUNK_SECONDS)
+    return iter_pcm_chunks(pcm, Config.SAMPLE_RATE, Config.CHANNELS,
+                           Config.LONG_AUDIO_CHUNK_SECONDS, Config.LONG_AUDIO_SEARCH_SECONDS)
+
+def chunk_cache_key(content, language_code, config_options):
+    """Key of one chunk's results in incremental mode, or None when the mode is off"""
+    if not Config.INCREMENTAL_ENABLED:
+        return None
+    return make_cache_key(file_digest(content), language_code, cache_options(config_options),
+                          prefix=CHUNK_KEY_PREFIX)
+
+def cached_chunk(key, content):
+    """A chunk's cached results, relative to its start, or None; counts its seconds as a hit or miss"""
+    results = transcription_cache.get(key)
+    seconds = len(content) / float(2 * Config.SAMPLE_RATE * Config.CHANNELS)
+    metrics.CHUNK_CACHE_SECONDS.labels(result="miss" if results is None else "hit").inc(seconds)
+    return results
+
+def prune_pcm(pcm):
+    """Cut long non-speech stretches out of decoded PCM in place; returns the OffsetMap, or None with VAD off"""
+    if not Config.VAD_ENABLED:
+        return None
+    with metrics.stage("vad"):
+        speech_map = prune_silence(pcm, Config.SAMPLE_RATE, Config.CHANNELS, Config.VAD_MIN_SILENCE_SECONDS,
+                                   Config.VAD_PADDING_SECONDS, Config.VAD_MARGIN_DB, Config.VAD_DIP_RATIO)
+    metrics.record_vad(speech_map.original_seconds, speech_map.removed_seconds)
+    app.logger.info(f"VAD removed {speech_map.removed_seconds:.1f} of {speech_map.original_seconds:.1f} s")
+    return speech_map
+
+def memory_estimate(stream, info, channels=None):
+    """Bytes a request holds while decoding and recognizing: in-memory upload plus decoded audio
+    
+    With channels, the upload is decoded to that many channels and then split, so
+    the interleaved and the split copies are both held for a moment.
+    """
+    held = stream.getbuffer().nbytes if isinstance(stream, io.BytesIO) else 0
+    if info is None:
+        return held + Config.REQUEST_MEMORY_BUDGET
+    decoded_channels = 2 * channels if channels else Config.CHANNELS
+    return held + min(info["duration"] * 2 * Config.SAMPLE_RATE * decoded_channels, Config.REQUEST_MEMORY_BUDGET)
+
+def probe_upload(stream, extension):
+    """Header-only check before any decoding; returns the probe, or None if only ffmpeg can tell"""
+    info = probe_audio(stream, extension)
+    if info is None:
+        if extension in STRICT_HEADER_FORMATS:
+            raise AudioDecodeError(f"Corrupt or unsupported {extension.upper()} header")
+        return None
+    check_duration(info["duration"])
+    return info
+
+def passthrough_encoding(info):
+    """How a probed upload can skip ffmpeg.
+
+    Returns "OGG_OPUS" or "FLAC" when the upload bytes can be sent to the
+    recognizer as they are, "LINEAR16" when its samples can be read without
+    resampling, "RESAMPLE" when soundfile can read them for the numpy
+    resampler, or None when it has to go through ffmpeg.
+    """
+    if info is None:
+        return None
+    short = info["duration"] <= Config.LONG_AUDIO_CHUNK_SECONDS
+    # Pruning silence needs the decoded samples, so with VAD on nothing goes upstream as uploaded
+    short = short and not Config.VAD_ENABLED
+    if info["subtype"] == "OPUS":
+        # Recognizer-native, but splitting long audio needs the decoded samples
+        native = info["channels"] == Config.CHANNELS and short and Config.UPSTREAM_ENCODING == UPSTREAM_AUTO
+        return "OGG_OPUS" if native else None
+    if info["format"] not in ("WAV", "FLAC"):
+        return None
+    if info["sample_rate"] != Config.SAMPLE_RATE or info["subtype"] != "PCM_16" or info["channels"] != Config.CHANNELS:
+        # Other rates, sample formats and channel counts go through resample.py
+        mixable = Config.CHANNELS == 1 or info["channels"] in (1, Config.CHANNELS)
+        return "RESAMPLE" if mixable else None
+    if info["format"] == "FLAC" and short and Config.UPSTREAM_ENCODING in (UPSTREAM_AUTO, UPSTREAM_FLAC):
+        return "FLAC"
+    return "LINEAR16"
+
+def separate_channel_count(info, config_options):
+    """Channels to recognize one by one, or None to recognize the upload mixed to Config.CHANNELS"""
+    if not config_options.get("separate_channels") or Config.CHANNELS != 1 or info is None:
+        return None
+    channels = info["channels"]
+    return channels if 1 < channels <= Config.MAX_SEPARATE_CHANNELS else None
+
+def channel_options(config_options):
+    """Recognition options for one channel of a separated upload; one speaker each, so no diarization"""
+    return dict(config_options, enable_speaker_diarization=False, diarization_speaker_count=0)
+
+def build_recognition_config(language_code, config_options=None, encoding="LINEAR16"):
+    """RecognitionConfig with the server defaults, overridden by config_options"""
+    recognition_config = {
+        "encoding": speech.RecognitionConfig.AudioEncoding[encoding],
+        "sample_rate_hertz": Config.SAMPLE_RATE,
+        "language_code": language_code,
+        "enable_automatic_punctuation": True,
+        "model": "default",
+        "use_enhanced": True,
+        "enable_word_time_offsets": True,
+        "enable_speaker_diarization": True,
+        "diarization_speaker_count": 2,
+    }
+    
+    # Override with custom options if provided
+    if config_options:
+        recognition_config.update((key, value) for key, value in config_options.items()
+                                  if key not in SERVER_OPTIONS)
+    
+    return speech.RecognitionConfig(**recognition_config)
+
+def record_upstream(content, encoding, pcm_size, language_code, model, elapsed):
+    """Count and log one recognize call; pcm_size is None for pre-encoded uploads"""
+    metrics.UPSTREAM_BYTES.labels(encoding=encoding).inc(len(content))
+    if pcm_size:
+        language_code, model = metric_labels(language_code, model)
+        metrics.AUDIO_SECONDS.labels(language=language_code, model=model).inc(
+            pcm_size / float(2 * Config.SAMPLE_RATE * Config.CHANNELS))
+    ratio = f" ({len(content) / max(pcm_size, 1):.0%} of LINEAR16)" if pcm_size else ""
+    app.logger.info(f"Recognize sent {len(content)} bytes as {encoding}{ratio} in {elapsed:.2f}s")
+
+def transcribe_with_google_client(audio, language_code="ru-RU", config_options=None, encoding=None):
+    """Transcribe audio using Google Cloud Speech-to-Text client library with enhanced options
+    
+    audio is either raw LINEAR16 PCM from the decode stage, which is compressed
+    according to Config.UPSTREAM_ENCODING, or already-encoded bytes together
+    with their encoding name.
+    """
     try:
-        # Load credentials from file if available
-        credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
-        if credentials_path and os.path.exists(credentials_path):
-            credentials = service_account.Credentials.from_service_account_file(credentials_path)
-            client = speech.SpeechClient(credentials=credentials)
-        else:
-            # Fallback to API key method
-            client = speech.SpeechClient()
-        
-        # Read audio file
-        with open(audio_path, "rb") as audio_file:
-            content = audio_file.read()
+        pcm_size = None
+        content = bytes(audio)
+        if encoding is None:
+            pcm_size = len(content)
+            with metrics.stage("encode"):
+                content, encoding = encode_for_upstream(content, Config.SAMPLE_RATE, Config.CHANNELS,
+                                                        Config.UPSTREAM_ENCODING)
         
         # Configure request
         audio = speech.RecognitionAudio(content=content)
+        config = build_recognition_config(language_code, config_options, encoding)
+        recognize_request = speech.RecognizeRequest(config=config, audio=audio)
         
-        # Default configuration
-        recognition_config = {
-            "encoding": speech.RecognitionConfig.AudioEncoding.LINEAR16,
-            "sample_rate_hertz": Config.SAMPLE_RATE,
-            "language_code": language_code,
-            "enable_automatic_punctuation": True,
-            "model": "default",
-            "use_enhanced": True,
-            "enable_word_time_offsets": True,
-            "enable_speaker_diarization": True,
-            "diarization_speaker_count": 2,
-        }
-        
-        # Override with custom options if provided
-        if config_options:
-            recognition_config.update(config_options)
-        
-        config = speech.RecognitionConfig(**recognition_config)
-        
-        # Perform transcription
-        response = client.recognize(config=config, audio=audio)
+        # Perform transcription on a pooled client, within the request's deadline
+        start = time.time()
+        with metrics.stage("recognize"):
+            response = upstream_policy.call(
+                lambda timeout: speech_clients.start("recognize", recognize_request, timeout),
+                LatencyTracker.key(encoding, len(content)))
+        record_upstream(content, encoding, pcm_size, language_code, config.model, time.time() - start)
         
         # Process results
-        results = []
-        for result in response.results:
-            alternatives = []
-            for alternative in result.alternatives:
-                alternatives.append({
-                    "transcript": alternative.transcript,
-                    "confidence": alternative.confidence,
-                    "words": [
-                        {
-                            "word": word_info.word,
-                            "start_time": float(word_info.start_time.total_seconds()),
-                            "end_time": float(word_info.end_time.total_seconds())
-                        }
-                        for word_info in alternative.words
-                    ] if hasattr(alternative, 'words') else []
-                })
-            results.append({
-                "alternatives": alternatives,
-                "channel_tag": result.channel_tag if hasattr(result, 'channel_tag') else None,
-                "result_end_time": float(result.result_end_time.total_seconds()) if hasattr(result, 'result_end_time') else None
-            })
+        with metrics.stage("build_results"):
+            results = response_to_dicts(response)
         
+        # Upload, decoded audio, payload and results are all held here
+        memory_profiler.checkpoint()
         return results
         
     except Exception as e:
         app.logger.error(f"Google Speech API error: {e}")
         raise
 
-def transcribe_audio(audio_path, language_code="ru-RU", config_options=None):
-    """Transcribe audio using Google Cloud Speech-to-Text API with fallback options"""
+def transcribe_long_audio(pcm, language_code="ru-RU", config_options=None):
+    """Split long PCM at quiet points, transcribe chunks concurrently and stitch the results
+    
+    pcm is a file object; chunks are read from it only as slots free up, so
+    a long upload never has more than a few chunks in memory. In incremental
+    mode chunks already in the chunk cache are not sent again.
+    """
+    chunks = long_audio_chunks(pcm)
+    
+    # Bound how much of the shared executor and memory a single request can occupy
+    slots = threading.BoundedSemaphore(long_audio_parallelism())
+    reused = []
+    
+    def run_chunk(offset, content):
+        try:
+            key = chunk_cache_key(content, language_code, config_options)
+            results = cached_chunk(key, content) if key else None
+            if results is not None:
+                reused.append(offset)
+            else:
+                results = transcribe_with_google_client(content, language_code, config_options)
+                if key:
+                    # Cached before the shift, so the chunk can be reused at any offset
+                    transcription_cache.set(key, results)
+            return shift_results(results, offset)
+        finally:
+            slots.release()
+    
+    futures = []
+    try:
+        while True:
+            slots.acquire()
+            chunk = next(chunks, None)
+            if chunk is None:
+                slots.release()
+                break
+            futures.append(metrics.submit(executor, run_chunk, *chunk))
+        results = merge_results([future.result() for future in futures])
+        app.logger.info(f"Long audio split into {len(futures)} chunks, {len(reused)} from the chunk cache")
+        return results
+    except Exception:
+        for future in futures:
+            future.cancel()
+        raise
+
+def transcribe_audio(pcm, language_code="ru-RU", config_options=None):
+    """Transcribe audio using Google Cloud Speech-to-Text API with fallback options
+    
+    pcm is raw PCM bytes or a file object positioned at its start.
+    """
+    if isinstance(pcm, (bytes, bytearray, memoryview)):
+        pcm = io.BytesIO(pcm)
+    size = pcm.seek(0, io.SEEK_END)
+    pcm.seek(0)
+    duration = size / float(2 * Config.SAMPLE_RATE * Config.CHANNELS)
+    if Config.LONG_AUDIO_ENABLED and duration > Config.LONG_AUDIO_CHUNK_SECONDS:
+        return transcribe_long_audio(pcm, language_code, config_options)
+    
     # Submit transcription task to thread pool for better performance
-    future = executor.submit(transcribe_with_google_client, audio_path, language_code, config_options)
+    future = metrics.submit(executor, transcribe_with_google_client, pcm.read(), language_code, config_options)
     return future.result()
 
+def decode_channels(stream, info, extension, channels, output):
+    """Decode an upload to Config.SAMPLE_RATE keeping all of its channels, interleaved"""
+    if info["format"] in ("WAV", "FLAC"):
+        return decode_with_soundfile(stream, Config.SAMPLE_RATE, channels, output=output)
+    return convert_to_pcm(stream, Config.SAMPLE_RATE, channels, format=extension, output=output)
+
+def transcribe_channel(pcm, speech_map, language_code, config_options, channel_tag):
+    """Transcribe one channel's PCM; results are tagged with channel_tag and on the upload's timeline"""
+    pcm.seek(0)
+    if speech_map is not None and not speech_map.kept_seconds:
+        results = []
+    else:
+        results = transcribe_audio(pcm, language_code, config_options)
+    if speech_map is not None:
+        remap_results(results, speech_map)
+    for result in results:
+        result["channel_tag"] = channel_tag
+    return results
+
+def transcribe_channels(stream, info, extension, channels, language_code, config_options, tenant=None):
+    """Transcribe every channel of a multi-channel upload concurrently and merge the results by time
+    
+    The channels are split in one pass over the decoded audio and each is
+    recognized as a mono recording with its own VAD pruning and long-audio
+    chunking, so wall time is about that of the longest channel. channel_tag
+    counts from 1, as the recognizer's own multi-channel results do.
+    """
+    with contextlib.ExitStack() as stack:
+        # The interleaved audio and the split channels are held together for a while
+        pcms = [stack.enter_context(pcm_spool(2 * channels)) for _ in range(channels)]
+        with pcm_spool(2) as interleaved:
+            with metrics.stage("decode"):
+                decode_channels(stream, info, extension, channels, interleaved)
+            check_duration(interleaved.tell() / float(2 * Config.SAMPLE_RATE * channels))
+            interleaved.seek(0)
+            with metrics.stage("split_channels"):
+                split_channels(interleaved, channels, pcms)
+        
+        speech_maps = [prune_pcm(pcm) for pcm in pcms]
+        # The recognizer bills every channel, so quotas are charged for all of them
+        duration = sum(speech_map.kept_seconds if speech_map is not None
+                       else pcm.tell() / float(2 * Config.SAMPLE_RATE) for pcm, speech_map in zip(pcms, speech_maps))
+        options = channel_options(config_options)
+        with admitted(tenant, duration):
+            # A thread per channel; their recognize calls go through the shared executor as usual
+            with ThreadPoolExecutor(max_workers=channels) as pool:
+                futures = [metrics.submit(pool, transcribe_channel, pcm, speech_map, language_code, options, tag)
+                           for tag, (pcm, speech_map) in enumerate(zip(pcms, speech_maps), start=1)]
+                results = merge_channels([future.result() for future in futures])
+    app.logger.info(f"Recognized {channels} channels separately")
+    return results
+
 @app.route("/", methods=["GET"])
 def index():
     """Serve main page"""
@@ -221,105 +687,271 @@ def health_check():
     return jsonify({
         "status": "healthy",
         "timestamp": int(time.time()),
-        "redis_connected": bool(redis_client) if redis_client else False
+        "redis_connected": bool(redis_client) if redis_client else False,
+        "cache": transcription_cache.stats(),
+        "in_flight": in_flight.stats(),
+        "admission": admission.stats(),
+        "memory": memory.stats(),
+        "speech_clients": speech_clients.stats()
     })
 
+def get_upload():
+    """Return (file, None) for a valid upload, or (None, error response)"""
+    if "file" not in request.files:
+        return None, (jsonify({"error": "No file provided"}), 400)
+    
+    file = request.files["file"]
+    if file.filename == "":
+        return None, (jsonify({"error": "No file selected"}), 400)
+    
+    # Validate file type
+    if not allowed_file(file.filename):
+        return None, (jsonify({"error": f"File type not allowed. Allowed types: {list(Config.ALLOWED_EXTENSIONS)}"}), 400)
+    
+    return file, None
+
+def parse_transcription_options(form):
+    """Return (language, config_options) from request form fields"""
+    language = form.get("language", "ru-RU")
+    if not validate_language_code(language):
+        language = "ru-RU"  # fallback to default
+    
+    # Additional options
+    enable_punctuation = form.get("punctuation", "true").lower() == "true"
+    enable_profanity_filter = form.get("profanity_filter", "false").lower() == "true"
+    enable_word_time_offsets = form.get("word_time_offsets", "true").lower() == "true"
+    model = form.get("model", "default")
+    
+    # Create configuration based on options
+    config_options = {
+        "enable_automatic_punctuation": enable_punctuation,
+        "profanity_filter": enable_profanity_filter,
+        "enable_word_time_offsets": enable_word_time_offsets,
+        "model": model,
+        "use_enhanced": True
+    }
+    
+    # Add speaker diarization if needed
+    if form.get("speaker_diarization", "false").lower() == "true":
+        config_options.update({
+            "enable_speaker_diarization": True,
+            "diarization_speaker_count": int(form.get("speaker_count", "2"))
+        })
+    
+    # Recognize each channel on its own; only present when on, so other cache keys stay as they were
+    separate_channels = form.get("separate_channels", str(Config.SEPARATE_CHANNELS)).lower() == "true"
+    if separate_channels:
+        config_options["separate_channels"] = True
+    
+    return language, config_options
+
+def parse_output_format(form):
+    """Return (output_format, binary_timings) from request form fields"""
+    output_format = form.get("format", "json").lower()
+    if output_format not in OUTPUT_FORMATS:
+        output_format = "json"  # fallback to default
+    return output_format, form.get("binary_timings", "false").lower() == "true"
+
+def get_tenant():
+    """Identity that quotas and fair scheduling are keyed on"""
+    return request.headers.get("X-API-Key") or request.remote_addr or "anonymous"
+
+@contextlib.contextmanager
+def admitted(tenant, audio_seconds):
+    """Hold an admission slot for audio_seconds of recognition; a no-op for internal callers"""
+    if tenant is None or not Config.ADMISSION_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    with admission.admit(tenant, audio_seconds):
+        timer = metrics.current_request()
+        if timer:
+            timer.add("admission", time.perf_counter() - start)
+        yield
+
+def transcribe_upload(stream, filename, language, config_options, tenant=None, timeout=None):
+    """Decode and transcribe an upload stream; returns (results, cached).
+    
+    Every recognize call made for the upload shares one deadline, timeout seconds
+    from now (None for no deadline); past it they raise DeadlineExceeded.
+    Requests with a tenant go through admission control and may raise
+    AdmissionRejected; the job worker passes none, its queue is the backpressure.
+    A request coalesced onto another's is charged its own tenant's quota for
+    the audio the shared transcript covers.
+    """
+    # Content-addressed cache key: the upload bytes plus every option
+    # that affects the result, so repeats skip decoding entirely
+    with metrics.stage("hash"):
+        audio_digest = file_digest(stream)
+    stream.seek(0)
+    cache_key = make_cache_key(audio_digest, language, cache_options(config_options))
+    
+    # Try to get cached result
+    with metrics.stage("cache_lookup"):
+        cached_result = transcription_cache.get(cache_key)
+    if cached_result is not None:
+        app.logger.info(f"Cache hit for file: {filename}")
+        timer = metrics.current_request()
+        if timer:
+            timer.cache = "hit"
+        return cached_result, True
+    
+    # Refuse before decoding, or joining another request, if the tenant is out
+    # of quota or the queue is already too long
+    if tenant is not None and Config.ADMISSION_ENABLED:
+        admission.check(tenant)
+    
+    def transcribe():
+        extension = filename.rsplit('.', 1)[-1].lower()
+        with metrics.stage("probe"):
+            info = probe_upload(stream, extension)
+        passthrough = passthrough_encoding(info)
+        channels = separate_channel_count(info, config_options)
+        
+        # Wait for, or be refused, room in this worker's memory before decoding
+        with memory.reserve(memory_estimate(stream, info, channels)):
+            if channels:
+                # One party per channel: recognized side by side instead of diarized from a mix
+                results = transcribe_channels(stream, info, extension, channels, language, config_options, tenant)
+            elif passthrough in ("OGG_OPUS", "FLAC"):
+                # Already in a recognizer-native encoding at the right rate; send it as is
+                options = dict(config_options, sample_rate_hertz=info["sample_rate"])
+                with admitted(tenant, info["duration"]):
+                    future = metrics.submit(executor, transcribe_with_google_client, stream.read(), language,
+                                            options, passthrough)
+                    results = future.result()
+            else:
+                with pcm_spool() as pcm:
+                    with metrics.stage("decode"):
+                        if passthrough == "LINEAR16":
+                            # Right rate and channel count already: take the samples, skip ffmpeg
+                            read_pcm16(stream, output=pcm)
+                        elif passthrough == "RESAMPLE":
+                            # WAV or FLAC at another rate: soundfile and numpy, no ffmpeg process
+                            decode_with_soundfile(stream, Config.SAMPLE_RATE, Config.CHANNELS, output=pcm)
+                        else:
+                            # Decode the upload stream block by block; long audio spills to disk
+                            convert_to_pcm(stream, Config.SAMPLE_RATE, Config.CHANNELS, format=extension,
+                                           output=pcm)
+                    
+                    # Transcribe audio
+                    duration = pcm.tell() / float(2 * Config.SAMPLE_RATE * Config.CHANNELS)
+                    check_duration(duration)
+                    speech_map = prune_pcm(pcm)
+                    if speech_map is not None:
+                        duration = speech_map.kept_seconds
+                    pcm.seek(0)
+                    with admitted(tenant, duration):
+                        if speech_map is not None and not duration:
+                            # Nothing but silence or music; no need to ask the recognizer
+                            results = []
+                        else:
+                            results = transcribe_audio(pcm, language, config_options)
+                    if speech_map is not None:
+                        remap_results(results, speech_map)
+        
+        # Cache result in the local and Redis tiers; coalesced followers read it from there
+        transcription_cache.set(cache_key, results)
+        return results
+    
+    # Every recognize call made for this upload, chunks included, shares one deadline
+    with deadline(timeout):
+        if not Config.SINGLEFLIGHT_ENABLED:
+            return transcribe(), False
+        
+        # Requests for the same key already in flight here or in another worker
+        # wait for that one instead of decoding and recognizing again
+        results, shared = in_flight.do(cache_key, transcribe, lambda: transcription_cache.get(cache_key))
+    if shared:
+        app.logger.info(f"Coalesced with in-flight request for file: {filename}")
+        if tenant is not None and Config.ADMISSION_ENABLED:
+            admission.charge(tenant, results_end(results))
+        timer = metrics.current_request()
+        if timer:
+            timer.cache = "coalesced"
+    return results, shared
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus scrape endpoint, aggregated across gunicorn workers"""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
 @app.route("/transcribe", methods=["POST"])
 @measure_time
 def handle_transcribe():
     """Handle transcription requests with enhanced features"""
+    timer = metrics.start_request("transcribe")
+    tracked = memory_profiler.start_request("transcribe", request.content_length)
+    status = "error"
     try:
-        # Validate request
-        if "file" not in request.files:
-            return jsonify({"error": "No file provided"}), 400
-        
-        file = request.files["file"]
-        if file.filename == "":
-            return jsonify({"error": "No file selected"}), 400
-        
-        # Validate file type
-        if not allowed_file(file.filename):
-            return jsonify({"error": f"File type not allowed. Allowed types: {list(Config.ALLOWED_EXTENSIONS)}"}), 400
+        # Validate request; reading request.files parses the multipart upload
+        with metrics.stage("upload"):
+            file, error = get_upload()
+        if error:
+            status = "rejected"
+            return error
         
         # Secure filename
         filename = secure_filename(file.filename)
         
         # Get parameters
-        language = request.form.get("language", "ru-RU")
-        if not validate_language_code(language):
-            language = "ru-RU"  # fallback to default
-        
-        # Additional options
-        enable_punctuation = request.form.get("punctuation", "true").lower() == "true"
-        enable_profanity_filter = request.form.get("profanity_filter", "false").lower() == "true"
-        enable_word_time_offsets = request.form.get("word_time_offsets", "true").lower() == "true"
-        model = request.form.get("model", "default")
-        
-        # Create configuration based on options
-        config_options = {
-            "enable_automatic_punctuation": enable_punctuation,
-            "profanity_filter": enable_profanity_filter,
-            "enable_word_time_offsets": enable_word_time_offsets,
-            "model": model,
-            "use_enhanced": True
-        }
+        language, config_options = parse_transcription_options(request.form)
+        timer.language, timer.model = metric_labels(language, config_options["model"])
         
-        # Add speaker diarization if needed
-        if request.form.get("speaker_diarization", "false").lower() == "true":
-            config_options.update({
-                "enable_speaker_diarization": True,
-                "diarization_speaker_count": int(request.form.get("speaker_count", "2"))
-            })
-        
-        # Create temporary directory for processing
-        with tempfile.TemporaryDirectory() as temp_dir:
-            temp_path = Path(temp_dir)
-            
-            # Save original file
-            orig_path = temp_path / "original"
-            file.save(orig_path)
-            
-            # Convert to proper WAV format
-            wav_path = temp_path / "processed.wav"
-            convert_to_wav(orig_path, wav_path, Config.SAMPLE_RATE, Config.CHANNELS)
-            
-            # Generate cache key
-            file_hash = hash(str(orig_path) + language + str(time.time()))
-            cache_key = f"transcription:{file_hash}:{language}"
-            
-            # Try to get cached result
-            if redis_client:
-                try:
-                    cached_result = redis_client.get(cache_key)
-                    if cached_result:
-                        app.logger.info(f"Cache hit for file: {filename}")
-                        return jsonify({
-                            "success": True,
-                            "results": eval(cached_result.decode('utf-8')),
-                            "cached": True,
-                            "language": language
-                        })
-                except Exception as e:
-                    app.logger.warning(f"Cache error: {e}")
-            
-            # Transcribe audio
-            results = transcribe_audio(wav_path, language, config_options)
+        results, cached = transcribe_upload(file.stream, filename, language, config_options,
+                                            tenant=get_tenant(), timeout=Config.REQUEST_TIMEOUT)
+        status = "ok"
+        with metrics.stage("serialize"):
+            output_format, binary_timings = parse_output_format(request.form)
+            output = render_results(results, output_format, binary_timings)
+            if output_format in TEXT_CONTENT_TYPES:
+                return Response(output, content_type=TEXT_CONTENT_TYPES[output_format])
             
-            # Cache result if Redis is available
-            if redis_client:
-                try:
-                    redis_client.setex(cache_key, 3600, str(results))  # Cache for 1 hour
-                except Exception as e:
-                    app.logger.warning(f"Cache set error: {e}")
-            
-            return jsonify({
+            body = {
                 "success": True,
-                "results": results,
+                "results": output,
                 "language": language,
-                "cached": False,
-                "processing_time": time.time()
-            })
+                "cached": cached
+            }
+            if output_format == "compact":
+                body["format"] = "compact"
+            if not cached:
+                body["processing_time"] = time.time()
+            return jsonify(body)
     
+    except AudioTooLong as e:
+        status = "rejected"
+        return jsonify({
+            "success": False,
+            "error": str(e),
+            "timestamp": int(time.time())
+        }), 413
+    except AudioDecodeError as e:
+        status = "rejected"
+        return jsonify({
+            "success": False,
+            "error": f"Could not decode audio: {e}",
+            "timestamp": int(time.time())
+        }), 400
+    except AdmissionRejected as e:
+        status = "throttled"
+        response = jsonify({
+            "success": False,
+            "error": str(e),
+            "retry_after": e.retry_after,
+            "timestamp": int(time.time())
+        })
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+    except DeadlineExceeded as e:
+        status = "timeout"
+        app.logger.error(f"Request deadline exceeded: {e}")
+        return jsonify({
+            "success": False,
+            "error": "Recognition did not finish within the request timeout",
+            "timestamp": int(time.time())
+        }), 504
     except Exception as e:
         app.logger.error(f"Error processing request: {str(e)}")
         return jsonify({
@@ -327,45 +959,334 @@ def handle_transcribe():
             "error": str(e),
             "timestamp": int(time.time())
         }), 500
+    finally:
+        timer.finish(status)
+        memory_profiler.finish_request(tracked)
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+    """Queue a transcription job and return its id immediately"""
+    if job_queue is None:
+        return jsonify({"error": "Job queue unavailable: Redis is not configured"}), 503
+    
+    file, error = get_upload()
+    if error:
+        return error
+    
+    filename = secure_filename(file.filename)
+    language, config_options = parse_transcription_options(request.form)
+    try:
+        priority = int(request.form.get("priority", DEFAULT_PRIORITY))
+    except ValueError:
+        return jsonify({"error": "priority must be an integer"}), 400
+    
+    try:
+        job_id = job_queue.enqueue(file.stream.read(), filename, language, config_options, priority)
+    except Exception as e:
+        app.logger.error(f"Could not enqueue job: {e}")
+        return jsonify({"error": "Could not enqueue job"}), 503
+    
+    response = jsonify({"job_id": job_id, "status": "queued"})
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return response, 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Return the status of a job, and its results once done"""
+    if job_queue is None:
+        return jsonify({"error": "Job queue unavailable: Redis is not configured"}), 503
+    
+    status = job_queue.status(job_id)
+    if status is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(status)
+
+def spool_member(archive, member):
+    """Copy an archive member into a temp file that only stays in memory while small.
+    
+    collect_batch_items checked the size the member's header declares against the
+    limits; the copy stops there in case the header lies.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=Config.UPLOAD_SPOOL_BYTES)
+    copied = 0
+    try:
+        with archive.open(member) as source:
+            while True:
+                block = source.read(64 * 1024)
+                if not block:
+                    break
+                copied += len(block)
+                if copied > member.file_size:
+                    raise ValueError(f"Archive member unpacks to more than the {member.file_size} bytes it declares")
+                spool.write(block)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+def collect_batch_items(files):
+    """Expand uploaded files and zip archives into (filename, opener) pairs.
+    
+    An archive or member refused here gets the exception in place of its opener.
+    Expansion stops one item past MAX_BATCH_ITEMS, enough for the caller to refuse
+    the batch without listing every member of an archive of thousands.
+    """
+    items = []
+    expanded = 0
+    for file in files:
+        name = secure_filename(file.filename or "")
+        if name.lower().endswith(".zip"):
+            try:
+                archive = zipfile.ZipFile(file.stream)
+            except zipfile.BadZipFile as e:
+                items.append((name, ValueError(f"Invalid archive: {e}")))
+                continue
+            for member in archive.infolist():
+                if len(items) > Config.MAX_BATCH_ITEMS:
+                    return items
+                if member.is_dir():
+                    continue
+                member_name = secure_filename(member.filename)
+                # The upload limit covers what a member unpacks to, not just the compressed archive
+                if member.file_size > Config.MAX_CONTENT_LENGTH:
+                    items.append((member_name, ValueError(
+                        f"Archive member unpacks to more than {Config.MAX_CONTENT_LENGTH // (1024*1024)} MB")))
+                    continue
+                expanded += member.file_size
+                if expanded > Config.BATCH_MAX_EXPANDED_BYTES:
+                    items.append((member_name, ValueError(
+                        f"Archive members unpack to more than {Config.BATCH_MAX_EXPANDED_BYTES // (1024*1024)} MB "
+                        f"in total")))
+                    continue
+                # Bind the member now; it is only read once a slot is free
+                items.append((member_name, lambda archive=archive, member=member: spool_member(archive, member)))
+        else:
+            items.append((name, lambda file=file: file.stream))
+    return items
+
+def process_batch_item(index, filename, opener, language, config_options, tenant=None):
+    """Transcribe one batch entry; errors are reported in the entry instead of raised"""
+    line = {"index": index, "filename": filename, "language": language}
+    timer = metrics.start_request("batch", *metric_labels(language, config_options["model"]))
+    try:
+        if isinstance(opener, Exception):
+            # Refused while expanding archives; reported on the entry's own line
+            raise opener
+        if not allowed_file(filename):
+            raise ValueError(f"File type not allowed. Allowed types: {list(Config.ALLOWED_EXTENSIONS)}")
+        results, cached = transcribe_upload(opener(), filename, language, config_options, tenant,
+                                            timeout=Config.REQUEST_TIMEOUT)
+        line.update({"success": True, "results": results, "cached": cached})
+    except AudioTooLong as e:
+        line.update({"success": False, "error": str(e)})
+    except AudioDecodeError as e:
+        line.update({"success": False, "error": f"Could not decode audio: {e}"})
+    except AdmissionRejected as e:
+        line.update({"success": False, "error": str(e), "retry_after": e.retry_after})
+    except Exception as e:
+        app.logger.warning(f"Batch item {filename} failed: {e}")
+        line.update({"success": False, "error": str(e)})
+    timer.finish("ok" if line["success"] else "error")
+    return line
+
+@app.route("/transcribe/batch", methods=["POST"])
+def handle_batch_transcribe():
+    """Transcribe many files or a zip archive, streaming one NDJSON line per file as it finishes"""
+    files = request.files.getlist("files") + request.files.getlist("file")
+    items = collect_batch_items([file for file in files if file.filename])
+    if not items:
+        return jsonify({"error": "No files provided"}), 400
+    if len(items) > Config.MAX_BATCH_ITEMS:
+        # Zip members count one each
+        return jsonify({"error": f"Too many files; the limit is {Config.MAX_BATCH_ITEMS}"}), 400
+    
+    language, config_options = parse_transcription_options(request.form)
+    try:
+        concurrency = int(request.form.get("concurrency", Config.BATCH_CONCURRENCY))
+    except ValueError:
+        return jsonify({"error": "concurrency must be an integer"}), 400
+    concurrency = max(1, min(concurrency, Config.BATCH_MAX_CONCURRENCY, len(items)))
+    tenant = get_tenant()
+    
+    def generate():
+        start = time.time()
+        succeeded = 0
+        # Decoding runs on this per-batch pool; recognize calls still go through the shared executor
+        pool = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            futures = [
+                pool.submit(process_batch_item, index, filename, opener, language, config_options, tenant)
+                for index, (filename, opener) in enumerate(items)
+            ]
+            for future in as_completed(futures):
+                line = future.result()
+                succeeded += line["success"]
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+            yield json.dumps({"summary": {
+                "total": len(items),
+                "succeeded": succeeded,
+                "failed": len(items) - succeeded,
+                "elapsed": round(time.time() - start, 3)
+            }}) + "\n"
+        finally:
+            # Stop queued work if the client goes away mid-batch
+            pool.shutdown(wait=True, cancel_futures=True)
+    
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+def _receive_frames(ws, frames):
+    """Move audio frames from the socket into the frame queue until the client ends the stream"""
+    try:
+        while True:
+            message = ws.receive(timeout=Config.STREAM_IDLE_TIMEOUT)
+            if message is None:
+                break  # idle timeout
+            if isinstance(message, str):
+                # Any text message after the settings ends the audio
+                break
+            frames.put(message)
+    except ConnectionClosed:
+        pass
+    finally:
+        frames.put(END_OF_AUDIO)
+
+@sock.route("/transcribe/stream")
+def stream_transcribe(ws):
+    """Live transcription over a WebSocket.
+    
+    The client sends a JSON settings message, then binary audio frames, then
+    any text message (e.g. "end") to finish. Interim and final results are
+    pushed back as JSON messages as soon as the recognizer produces them.
+    """
+    try:
+        settings = json.loads(ws.receive(timeout=Config.STREAM_IDLE_TIMEOUT) or "{}")
+        if not isinstance(settings, dict):
+            raise ValueError("settings must be a JSON object")
+    except (ValueError, TypeError):
+        ws.send(json.dumps({"type": "error", "error": "First message must be JSON settings"}))
+        return
+    
+    encoding = str(settings.get("encoding", "LINEAR16")).upper()
+    if encoding not in Config.STREAM_ENCODINGS:
+        ws.send(json.dumps({"type": "error", "error": f"Unsupported encoding. Allowed: {sorted(Config.STREAM_ENCODINGS)}"}))
+        return
+    
+    # Bad values (a non-numeric sample_rate or speaker_count, say) are reported instead of dropping the socket
+    try:
+        language, config_options = parse_transcription_options(
+            {key: str(value).lower() if isinstance(value, bool) else str(value) for key, value in settings.items()})
+        sample_rate = int(settings.get("sample_rate", Config.SAMPLE_RATE))
+        config = speech.RecognitionConfig(
+            encoding=speech.RecognitionConfig.AudioEncoding[encoding],
+            sample_rate_hertz=sample_rate,
+            language_code=language,
+            **{key: value for key, value in config_options.items() if key not in SERVER_OPTIONS}
+        )
+        streaming_config = speech.StreamingRecognitionConfig(
+            config=config,
+            interim_results=bool(settings.get("interim_results", True))
+        )
+    except (ValueError, TypeError) as e:
+        ws.send(json.dumps({"type": "error", "error": f"Invalid settings: {e}"}))
+        return
+    
+    frames = queue.Queue()
+    receiver = threading.Thread(target=_receive_frames, args=(ws, frames), daemon=True)
+    receiver.start()
+    
+    try:
+        for event in stream_results(
+                lambda: speech_clients.get()[1],
+                streaming_config,
+                frames,
+                byte_rate=bytes_per_second(encoding, sample_rate),
+                max_stream_seconds=Config.STREAM_MAX_SECONDS,
+                poll_timeout=Config.STREAM_IDLE_TIMEOUT):
+            ws.send(json.dumps(event))
+        ws.send(json.dumps({"type": "done"}))
+    except ConnectionClosed:
+        app.logger.info("Streaming client disconnected")
+    except Exception as e:
+        app.logger.error(f"Streaming transcription error: {e}")
+        try:
+            ws.send(json.dumps({"type": "error", "error": str(e)}))
+        except ConnectionClosed:
+            pass
+    finally:
+        receiver.join(timeout=1)
+
+def debug_denied(headers):
+    """(error, status) for a debug request without the right token, or None if it may go ahead"""
+    if not Config.DEBUG_TOKEN:
+        return "Not found", 404
+    if not hmac.compare_digest(headers.get("X-Debug-Token", "").encode(), Config.DEBUG_TOKEN.encode()):
+        return "Invalid debug token", 401
+    return None
+
+def profile_seconds(args):
+    """Sampling time from ?seconds=, within 0.1 s and Config.PROFILE_MAX_SECONDS; raises ValueError"""
+    return min(max(float(args.get("seconds", "10")), 0.1), Config.PROFILE_MAX_SECONDS)
+
+def profile_response_headers(sampler):
+    return {
+        "Content-Disposition": f'attachment; filename="profile-{os.getpid()}-{int(time.time())}.collapsed"',
+        "X-Profile-Samples": str(sampler.samples),
+    }
+
+@app.route("/debug/profile", methods=["GET"])
+def debug_profile():
+    """Sample this worker's stacks for ?seconds=N and return them as collapsed stacks
+    
+    The body feeds flamegraph.pl, inferno or speedscope directly. Waiting
+    threads are left out unless ?idle=true. Only the worker that takes the
+    request is profiled, one profile at a time.
+    """
+    denied = debug_denied(request.headers)
+    if denied:
+        return jsonify({"error": denied[0]}), denied[1]
+    try:
+        seconds = profile_seconds(request.args)
+    except ValueError:
+        return jsonify({"error": "seconds must be a number"}), 400
+    if not try_start_profile():
+        return jsonify({"error": "A profile is already running in this worker"}), 409
+    try:
+        sampler = SamplingProfiler(Config.PROFILE_INTERVAL).profile(seconds)
+    finally:
+        end_profile()
+    idle = request.args.get("idle", "false").lower() == "true"
+    return Response(sampler.collapsed(idle), content_type="text/plain; charset=utf-8",
+                    headers=profile_response_headers(sampler))
+
+@app.route("/debug/memory", methods=["GET", "POST"])
+def debug_memory():
+    """Per-request tracemalloc snapshots in this worker
+    
+    POST ?action=start[&frames=N] starts tracing and POST ?action=stop ends
+    it; GET returns the largest requests since tracing started, each with
+    the allocation sites that had grown most when it held the most memory.
+    """
+    denied = debug_denied(request.headers)
+    if denied:
+        return jsonify({"error": denied[0]}), denied[1]
+    if request.method == "POST":
+        action = request.args.get("action")
+        if action == "start":
+            frames = request.args.get("frames", "10")
+            if not frames.isdigit() or int(frames) < 1:
+                return jsonify({"error": "frames must be a positive integer"}), 400
+            memory_profiler.start(int(frames))
+        elif action == "stop":
+            memory_profiler.stop()
+        else:
+            return jsonify({"error": "action must be start or stop"}), 400
+    return jsonify(dict(memory_profiler.stats(), pid=os.getpid()))
 
 @app.route("/languages", methods=["GET"])
 def supported_languages():
     """Return supported language codes"""
-    languages = {
-        "major_languages": [
-            {"code": "en-US", "name": "English (United States)"},
-            {"code": "ru-RU", "name": "Russian (Russia)"},
-            {"code": "es-ES", "name": "Spanish (Spain)"},
-            {"code": "fr-FR", "name": "French (France)"},
-            {"code": "de-DE", "name": "German (Germany)"},
-            {"code": "it-IT", "name": "Italian (Italy)"},
-            {"code": "pt-BR", "name": "Portuguese (Brazil)"},
-            {"code": "zh-CN", "name": "Chinese (Mandarin)"},
-            {"code": "ja-JP", "name": "Japanese"},
-            {"code": "ko-KR", "name": "Korean"}
-        ],
-        "additional_languages": [
-            {"code": "af-ZA", "name": "Afrikaans"},
-            {"code": "ar-SA", "name": "Arabic (Saudi Arabia)"},
-            {"code": "cs-CZ", "name": "Czech"},
-            {"code": "da-DK", "name": "Danish"},
-            {"code": "nl-NL", "name": "Dutch"},
-            {"code": "fi-FI", "name": "Finnish"},
-            {"code": "el-GR", "name": "Greek"},
-            {"code": "he-IL", "name": "Hebrew"},
-            {"code": "hi-IN", "name": "Hindi"},
-            {"code": "hu-HU", "name": "Hungarian"},
-            {"code": "id-ID", "name": "Indonesian"},
-            {"code": "no-NO", "name": "Norwegian"},
-            {"code": "pl-PL", "name": "Polish"},
-            {"code": "ro-RO", "name": "Romanian"},
-            {"code": "sk-SK", "name": "Slovak"},
-            {"code": "sv-SE", "name": "Swedish"},
-            {"code": "tr-TR", "name": "Turkish"},
-            {"code": "uk-UA", "name": "Ukrainian"}
-        ]
-    }
-    return jsonify(languages)
+    return jsonify(LANGUAGES)
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
@@ -373,4 +1294,5 @@ if __name__ == "__main__":
     host = os.environ.get("HOST", "0.0.0.0")
     
     app.logger.info(f"Starting server on {host}:{port}, debug={debug}")
+    init_worker()
     app.run(host=host, port=port, debug=debug)
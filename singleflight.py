@@ -0,0 +1,178 @@
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Delete or extend the lock only while we still own it
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+REFRESH_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces identical in-flight work, within a process and across processes.
+
+    Inside a worker, threads asking for the same key wait on the first one.
+    Across workers, the first to take a Redis lock leads; the others
+    subscribe to a notify channel and read the leader's result through
+    lookup(), normally the shared result cache. The lock is refreshed while
+    the leader runs, so if the leader dies it expires and a follower takes
+    over.
+
+    private_errors are failures that belong to the leading caller rather
+    than to the work, such as its tenant being out of quota. Local
+    followers do not share them; they run fn() themselves instead. Remote
+    followers already do, since a failed leader publishes no result.
+    """
+
+    def __init__(self, redis_client=None, prefix="stt:inflight", lock_ttl=30, wait_timeout=300, poll_interval=1.0,
+                 private_errors=()):
+        self.redis = redis_client
+        self.prefix = prefix
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.private_errors = private_errors
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.local_followers = 0
+        self.remote_followers = 0
+        self.takeovers = 0
+        if redis_client is not None:
+            self._release = redis_client.register_script(RELEASE_SCRIPT)
+            self._refresh = redis_client.register_script(REFRESH_SCRIPT)
+
+    def do(self, key, fn, lookup=None):
+        """Run fn() once for all concurrent callers with the same key; returns (result, shared)"""
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            if leader:
+                break
+
+            self.local_followers += 1
+            call.event.wait()
+            if call.error is None:
+                return call.result, True
+            if not isinstance(call.error, self.private_errors):
+                raise call.error
+            # The leader was refused for reasons of its own; lead, or follow whoever leads next
+
+        try:
+            call.result, shared = self._do_distributed(key, fn, lookup)
+            return call.result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def _do_distributed(self, key, fn, lookup):
+        if self.redis is None or lookup is None:
+            self.leaders += 1
+            return fn(), False
+
+        lock_key = f"{self.prefix}:lock:{key}"
+        channel = f"{self.prefix}:done:{key}"
+        deadline = time.time() + self.wait_timeout
+        while True:
+            token = uuid.uuid4().hex
+            try:
+                acquired = self.redis.set(lock_key, token, nx=True, px=int(self.lock_ttl * 1000))
+            except Exception as e:
+                logger.warning(f"Single-flight lock unavailable, running uncoalesced: {e}")
+                self.leaders += 1
+                return fn(), False
+
+            if acquired:
+                self.leaders += 1
+                return self._lead(lock_key, channel, token, fn), False
+
+            result = self._follow(lock_key, channel, lookup, deadline)
+            if result is not None:
+                self.remote_followers += 1
+                return result, True
+            if time.time() >= deadline:
+                logger.warning(f"Gave up waiting for in-flight leader of {key}")
+                self.leaders += 1
+                return fn(), False
+
+            # The lock is gone but no result was published: the leader failed or died
+            self.takeovers += 1
+            logger.info(f"Leader for {key} went away; taking over")
+
+    def _keep_alive(self, lock_key, token, stop):
+        while not stop.wait(self.lock_ttl / 3.0):
+            try:
+                if not self._refresh(keys=[lock_key], args=[token, int(self.lock_ttl * 1000)]):
+                    return
+            except Exception as e:
+                logger.warning(f"Could not refresh single-flight lock: {e}")
+
+    def _lead(self, lock_key, channel, token, fn):
+        stop = threading.Event()
+        refresher = threading.Thread(target=self._keep_alive, args=(lock_key, token, stop), daemon=True)
+        refresher.start()
+        try:
+            return fn()
+        finally:
+            stop.set()
+            refresher.join()
+            try:
+                self._release(keys=[lock_key], args=[token])
+                self.redis.publish(channel, b"done")
+            except Exception as e:
+                logger.warning(f"Could not release single-flight lock: {e}")
+
+    def _follow(self, lock_key, channel, lookup, deadline):
+        """Wait for the leader; returns its result, or None if the lock went away without one"""
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            # Subscribe before checking so a notify between the checks is not missed
+            pubsub.subscribe(channel)
+            while time.time() < deadline:
+                result = lookup()
+                if result is not None:
+                    return result
+                if not self.redis.exists(lock_key):
+                    return lookup()
+                pubsub.get_message(timeout=self.poll_interval)
+            return None
+        except Exception as e:
+            logger.warning(f"Error waiting for in-flight leader: {e}")
+            return None
+        finally:
+            pubsub.close()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "local_followers": self.local_followers,
+            "remote_followers": self.remote_followers,
+            "takeovers": self.takeovers,
+        }
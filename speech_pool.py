@@ -0,0 +1,295 @@
+import asyncio
+import itertools
+import logging
+import os
+import threading
+
+import grpc
+from google.api_core import exceptions as google_exceptions
+from google.cloud import speech_v1p1beta1 as speech
+from google.cloud.speech_v1p1beta1.services.speech.transports import SpeechGrpcAsyncIOTransport, SpeechGrpcTransport
+from google.oauth2 import service_account
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the channel itself is unusable and should be rebuilt. UNAVAILABLE is not
+# one: the channel reconnects by itself, the caller retries, and closing the channel would
+# cancel every other call in flight on it
+CHANNEL_ERRORS = (
+    google_exceptions.Unauthenticated,
+)
+
+
+def create_client(credentials_path=None, endpoint=None):
+    """Build a SpeechClient with its own gRPC channel"""
+    if endpoint:
+        # Plaintext channel for a local stand-in backend (see fake_speech.py)
+        transport = SpeechGrpcTransport(channel=grpc.insecure_channel(endpoint))
+        return speech.SpeechClient(transport=transport)
+
+    if credentials_path and os.path.exists(credentials_path):
+        credentials = service_account.Credentials.from_service_account_file(credentials_path)
+        return speech.SpeechClient(credentials=credentials)
+
+    # Fallback to application default credentials
+    return speech.SpeechClient()
+
+
+def create_async_client(credentials_path=None, endpoint=None):
+    """Build a SpeechAsyncClient; its channel belongs to the running event loop"""
+    if endpoint:
+        transport = SpeechGrpcAsyncIOTransport(channel=grpc.aio.insecure_channel(endpoint))
+        return speech.SpeechAsyncClient(transport=transport)
+
+    if credentials_path and os.path.exists(credentials_path):
+        credentials = service_account.Credentials.from_service_account_file(credentials_path)
+        return speech.SpeechAsyncClient(credentials=credentials)
+
+    return speech.SpeechAsyncClient()
+
+
+def _close(client):
+    try:
+        client.transport.close()
+    except Exception as e:
+        logger.debug(f"Error closing speech client: {e}")
+
+
+class PendingCall:
+    """A unary call in flight on one pooled client; a grpc future whose result() raises google_exceptions"""
+
+    def __init__(self, pool, slot, client, future):
+        self.pool = pool
+        self.slot = slot
+        self.client = client
+        self.future = future
+
+    def done(self):
+        return self.future.done()
+
+    def cancel(self):
+        return self.future.cancel()
+
+    def add_done_callback(self, fn):
+        self.future.add_done_callback(lambda _: fn(self))
+
+    def result(self):
+        try:
+            return self.future.result()
+        except grpc.RpcError as e:
+            error = google_exceptions.from_grpc_error(e)
+        if isinstance(error, CHANNEL_ERRORS):
+            logger.warning(f"Speech channel error ({error}); rebuilding client")
+            self.pool._rebuild(self.slot, self.client)
+        raise error
+
+
+class SpeechClientPool:
+    """Long-lived SpeechClients shared by all threads of one worker process.
+
+    Clients are created lazily and owned by the process that created them;
+    after a fork the pool notices the new pid and starts from scratch rather
+    than reusing the parent's gRPC channels.
+    """
+
+    def __init__(self, size=2, credentials_path=None, endpoint=None):
+        self.size = max(1, size)
+        self.credentials_path = credentials_path
+        self.endpoint = endpoint
+        self._lock = threading.Lock()
+        self._clients = []
+        self._pid = None
+        self._counter = itertools.count()
+        self.created = 0
+        self.rebuilt = 0
+
+    def _ensure(self):
+        pid = os.getpid()
+        if self._pid == pid and len(self._clients) == self.size:
+            return
+        with self._lock:
+            if self._pid != pid:
+                # Inherited from the parent: drop without closing shared channels
+                self._clients = []
+                self._pid = pid
+            while len(self._clients) < self.size:
+                self._clients.append(self._create())
+
+    def _create(self):
+        client = create_client(self.credentials_path, self.endpoint)
+        self.created += 1
+        return client
+
+    def _rebuild(self, slot, broken):
+        with self._lock:
+            if slot < len(self._clients) and self._clients[slot] is broken:
+                self._clients[slot] = self._create()
+                self.rebuilt += 1
+                _close(broken)
+                logger.warning(f"Rebuilt speech client in slot {slot}")
+
+    def get(self):
+        """Return (slot, client) using round-robin over the pool"""
+        self._ensure()
+        slot = next(self._counter) % self.size
+        return slot, self._clients[slot]
+
+    def call(self, method, *args, **kwargs):
+        """Invoke a client method, rebuilding the channel once if it is broken"""
+        slot, client = self.get()
+        try:
+            return getattr(client, method)(*args, **kwargs)
+        except CHANNEL_ERRORS as e:
+            logger.warning(f"Speech channel error ({e}); rebuilding client")
+        except ValueError as e:
+            # grpc raises ValueError when invoking a closed channel
+            if "closed channel" not in str(e):
+                raise
+            logger.warning("Speech channel was closed; rebuilding client")
+        self._rebuild(slot, client)
+        _, client = self.get()
+        return getattr(client, method)(*args, **kwargs)
+
+    def recognize(self, config, audio, **kwargs):
+        return self.call("recognize", config=config, audio=audio, **kwargs)
+
+    def start(self, method, request, timeout=None):
+        """Begin a unary call without waiting for it; returns a PendingCall, which can be cancelled.
+
+        Goes to the transport's stub directly, so unlike call() no client-side retry is applied.
+        """
+        slot, client = self.get()
+        try:
+            future = getattr(client.transport, method).future(request, timeout=timeout)
+        except ValueError as e:
+            if "closed channel" not in str(e):
+                raise
+            logger.warning("Speech channel was closed; rebuilding client")
+            self._rebuild(slot, client)
+            slot, client = self.get()
+            future = getattr(client.transport, method).future(request, timeout=timeout)
+        return PendingCall(self, slot, client, future)
+
+    def warmup(self, timeout=5.0):
+        """Create every client and wait for its channel to connect"""
+        self._ensure()
+        for client in list(self._clients):
+            try:
+                channel = client.transport.grpc_channel
+                grpc.channel_ready_future(channel).result(timeout=timeout)
+            except Exception as e:
+                logger.warning(f"Speech client warmup did not complete: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                for client in self._clients:
+                    _close(client)
+            self._clients = []
+            self._pid = None
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "active": len(self._clients) if self._pid == os.getpid() else 0,
+            "created": self.created,
+            "rebuilt": self.rebuilt,
+        }
+
+
+class AsyncSpeechClientPool:
+    """SpeechAsyncClients for one event loop; the asyncio counterpart of SpeechClientPool.
+
+    grpc.aio channels only work on the loop they were created on, so the
+    clients are created lazily inside the loop and dropped if the pool is
+    used from a different one (e.g. after a fork).
+    """
+
+    def __init__(self, size=2, credentials_path=None, endpoint=None):
+        self.size = max(1, size)
+        self.credentials_path = credentials_path
+        self.endpoint = endpoint
+        self._clients = []
+        self._loop = None
+        self._counter = itertools.count()
+        self.created = 0
+        self.rebuilt = 0
+
+    def _ensure(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._clients = []
+            self._loop = loop
+        while len(self._clients) < self.size:
+            self._clients.append(create_async_client(self.credentials_path, self.endpoint))
+            self.created += 1
+
+    def _rebuild(self, slot, broken):
+        if slot < len(self._clients) and self._clients[slot] is broken:
+            self._clients[slot] = create_async_client(self.credentials_path, self.endpoint)
+            self.created += 1
+            self.rebuilt += 1
+            asyncio.ensure_future(broken.transport.close())
+            logger.warning(f"Rebuilt async speech client in slot {slot}")
+
+    def get(self):
+        """Return (slot, client) using round-robin over the pool"""
+        self._ensure()
+        slot = next(self._counter) % self.size
+        return slot, self._clients[slot]
+
+    async def call(self, method, *args, **kwargs):
+        """Await a client method, rebuilding the channel once if it is broken"""
+        slot, client = self.get()
+        try:
+            return await getattr(client, method)(*args, **kwargs)
+        except CHANNEL_ERRORS as e:
+            logger.warning(f"Speech channel error ({e}); rebuilding client")
+        self._rebuild(slot, client)
+        _, client = self.get()
+        return await getattr(client, method)(*args, **kwargs)
+
+    async def recognize(self, config, audio, **kwargs):
+        return await self.call("recognize", config=config, audio=audio, **kwargs)
+
+    async def warmup(self, timeout=5.0):
+        """Create every client and wait for its channel to connect"""
+        self._ensure()
+        for client in list(self._clients):
+            try:
+                await asyncio.wait_for(client.transport.grpc_channel.channel_ready(), timeout)
+            except Exception as e:
+                logger.warning(f"Async speech client warmup did not complete: {e}")
+
+    async def close(self):
+        clients, self._clients = self._clients, []
+        if self._loop is asyncio.get_running_loop():
+            for client in clients:
+                await client.transport.close()
+        self._loop = None
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "active": len(self._clients),
+            "created": self.created,
+            "rebuilt": self.rebuilt,
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool, configured from the environment"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SpeechClientPool(
+                    size=int(os.getenv('SPEECH_CLIENT_POOL_SIZE', '2')),
+                    credentials_path=os.getenv('GOOGLE_APPLICATION_CREDENTIALS'),
+                    endpoint=os.getenv('SPEECH_ENDPOINT'),
+                )
+    return _pool
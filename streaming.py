@@ -0,0 +1,79 @@
+import logging
+import queue
+
+from google.cloud import speech_v1p1beta1 as speech
+
+from results import result_to_dict
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the client's audio in a frame queue
+END_OF_AUDIO = object()
+
+# Bytes of audio per second of a single channel, for encodings where it is fixed
+BYTES_PER_SAMPLE = {
+    "LINEAR16": 2,
+    "MULAW": 1,
+}
+
+
+def bytes_per_second(encoding, sample_rate, channels=1):
+    """Return the byte rate of an encoding, or None for variable-rate codecs"""
+    width = BYTES_PER_SAMPLE.get(encoding)
+    return width * sample_rate * channels if width else None
+
+
+class StreamState:
+    """Progress shared between the request generator and the response loop"""
+
+    def __init__(self):
+        self.sent_bytes = 0
+        self.finished = False
+
+
+def audio_requests(frames, state, max_bytes=None, poll_timeout=None):
+    """Yield audio requests from a frame queue until the audio ends or max_bytes is reached"""
+    stream_bytes = 0
+    while True:
+        try:
+            frame = frames.get(timeout=poll_timeout)
+        except queue.Empty:
+            # The client went quiet for too long; close this stream
+            state.finished = True
+            return
+        if frame is END_OF_AUDIO:
+            state.finished = True
+            return
+        yield speech.StreamingRecognizeRequest(audio_content=frame)
+        stream_bytes += len(frame)
+        state.sent_bytes += len(frame)
+        if max_bytes and stream_bytes >= max_bytes:
+            return
+
+
+def stream_results(client_factory, streaming_config, frames, byte_rate=None,
+                   max_stream_seconds=290, poll_timeout=None):
+    """Yield interim and final results for audio frames read from a queue.
+
+    The Speech API caps a single stream at about five minutes, so when the
+    byte rate is known the audio is rolled over onto a fresh stream and
+    timestamps are offset to stay on the caller's timeline.
+    """
+    state = StreamState()
+    max_bytes = int(byte_rate * max_stream_seconds) if byte_rate else None
+    offset_bytes = 0
+    while not state.finished:
+        offset = offset_bytes / float(byte_rate) if byte_rate else 0.0
+        requests = audio_requests(frames, state, max_bytes, poll_timeout)
+        responses = client_factory().streaming_recognize(streaming_config, requests)
+        for response in responses:
+            if response.error.code:
+                raise RuntimeError(f"Streaming recognition error: {response.error.message}")
+            for result in response.results:
+                event = result_to_dict(result, offset)
+                event["type"] = "final" if result.is_final else "interim"
+                event["stability"] = result.stability
+                yield event
+        offset_bytes = state.sent_bytes
+        if not state.finished:
+            logger.info(f"Rolling over to a new stream at {offset_bytes / float(byte_rate):.1f}s")
@@ -0,0 +1,289 @@
+"""TokenBuckets, AdmissionController and MemoryLedger, with quotas in fakeredis"""
+import asyncio
+import io
+import threading
+import time
+import wave
+
+import fakeredis
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, MemoryLedger, TokenBuckets
+from cache import TranscriptionCache
+
+
+@pytest.fixture(params=["redis", "local"])
+def buckets(request):
+    redis_client = fakeredis.FakeRedis() if request.param == "redis" else None
+    return TokenBuckets(redis_client, rate=1.0, burst=100.0, overrides={"unlimited": (0, 0), "small": (1.0, 10.0)})
+
+
+def test_bucket_takes_until_empty_then_reports_the_wait(buckets):
+    assert buckets.take("tenant", 60) == 0
+    assert buckets.take("tenant", 30) == 0
+    assert buckets.take("tenant", 30) == pytest.approx(20, abs=1)
+
+
+def test_bucket_admits_more_than_the_burst_once_full_and_goes_into_debt(buckets):
+    assert buckets.take("small", 25) == 0
+    # 15 audio-seconds of debt to pay off before even a zero-cost check passes
+    assert buckets.take("small", 0) == pytest.approx(15, abs=1)
+
+
+def test_bucket_refunds_and_unlimited_tenants(buckets):
+    assert buckets.take("tenant", 100) == 0
+    buckets.take("tenant", -50)
+    assert buckets.take("tenant", 50) == 0
+    assert buckets.take("unlimited", 1e9) == 0
+
+
+def test_tenants_have_separate_buckets(buckets):
+    assert buckets.take("a", 100) == 0
+    assert buckets.take("a", 50) > 0
+    assert buckets.take("b", 50) == 0
+
+
+def test_check_refuses_a_tenant_in_debt():
+    controller = AdmissionController(TokenBuckets(rate=1.0, burst=10.0))
+    controller.buckets.take("tenant", 30)
+
+    with pytest.raises(AdmissionRejected) as refused:
+        controller.check("tenant")
+
+    assert refused.value.reason == "quota"
+    assert refused.value.retry_after == 20
+    controller.check("someone-else")
+
+
+def test_admit_refuses_when_the_estimated_wait_is_too_long():
+    controller = AdmissionController(TokenBuckets(rate=0), max_active=1, max_wait=5.0, initial_ratio=1.0)
+    # Half of the 60 audio-seconds running is expected still to be ahead of the next request
+    with controller.admit("a", 60):
+        with pytest.raises(AdmissionRejected) as refused:
+            with controller.admit("b", 1):
+                pass
+    assert refused.value.reason == "overloaded"
+    assert controller.stats()["rejected"] == 1
+
+
+def test_admit_refuses_over_quota_without_taking_a_slot():
+    controller = AdmissionController(TokenBuckets(rate=1.0, burst=100.0), max_active=1)
+    controller.buckets.take("tenant", 95)
+
+    with pytest.raises(AdmissionRejected) as refused:
+        with controller.admit("tenant", 20):
+            pass
+
+    assert refused.value.reason == "quota"
+    assert controller.stats()["active"] == 0
+
+
+def test_waiters_run_in_fair_order():
+    controller = AdmissionController(TokenBuckets(rate=0), max_active=1, max_wait=1000.0)
+    order = []
+    blocker = threading.Event()
+
+    def run(tenant, seconds, name):
+        with controller.admit(tenant, seconds):
+            order.append(name)
+            if name == "blocker":
+                blocker.wait(5)
+
+    threads = []
+    for tenant, seconds, name in [("x", 1, "blocker"), ("heavy", 100, "heavy-1"), ("heavy", 100, "heavy-2"),
+                                  ("heavy", 100, "heavy-3"), ("light", 10, "light")]:
+        thread = threading.Thread(target=run, args=(tenant, seconds, name))
+        thread.start()
+        threads.append(thread)
+        expected = len(threads) - 1
+        while controller.stats()["queued"] < expected:
+            time.sleep(0.01)
+    blocker.set()
+    for thread in threads:
+        thread.join(5)
+
+    # One tenant's backlog does not hold up a short request from another
+    assert order == ["blocker", "light", "heavy-1", "heavy-2", "heavy-3"]
+    assert controller.stats() | {"seconds_per_audio_second": None} == {
+        "active": 0, "queued": 0, "queued_audio_seconds": 0.0, "seconds_per_audio_second": None,
+        "admitted": 5, "rejected": 0}
+
+
+def test_timed_out_waiter_is_refunded():
+    controller = AdmissionController(TokenBuckets(rate=1.0, burst=100.0), max_active=1, max_wait=0.1)
+    with controller.admit("a", 1):
+        with pytest.raises(AdmissionRejected) as refused:
+            with controller.admit("b", 80):
+                pass
+    assert refused.value.reason == "timeout"
+    assert controller.stats()["queued"] == 0
+    # The 80 audio-seconds taken while queueing were given back
+    assert controller.buckets.take("b", 100) == 0
+
+
+def test_charge_takes_quota_or_refuses():
+    controller = AdmissionController(TokenBuckets(rate=1.0, burst=100.0))
+    controller.charge("tenant", 90)
+
+    with pytest.raises(AdmissionRejected) as refused:
+        controller.charge("tenant", 20)
+
+    assert refused.value.reason == "quota"
+    assert controller.stats()["active"] == 0
+
+
+def test_admit_async_waits_without_blocking_the_loop():
+    controller = AdmissionController(TokenBuckets(rate=0), max_active=1, max_wait=5.0)
+    order = []
+
+    async def run(name, hold):
+        async with controller.admit_async(name, 1):
+            order.append(name)
+            await asyncio.sleep(hold)
+
+    async def main():
+        first = asyncio.ensure_future(run("first", 0.1))
+        await asyncio.sleep(0.01)
+        await asyncio.gather(first, run("second", 0))
+
+    asyncio.run(main())
+    assert order == ["first", "second"]
+    assert controller.stats()["active"] == 0
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    controller = AdmissionController(TokenBuckets(rate=0), max_active=1, max_wait=5.0)
+
+    async def main():
+        async with controller.admit_async("a", 1):
+            waiter = asyncio.ensure_future(controller.admit_async("b", 1).__aenter__())
+            while controller.stats()["queued"] == 0:
+                await asyncio.sleep(0.01)
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+            assert controller.stats()["queued"] == 0
+
+    asyncio.run(main())
+    assert controller.stats()["active"] == 0
+
+
+def test_memory_ledger_lets_one_large_request_through_and_refuses_when_full():
+    ledger = MemoryLedger(limit=100, max_wait=0.1)
+    with ledger.reserve(500):
+        with pytest.raises(AdmissionRejected) as refused:
+            with ledger.reserve(10):
+                pass
+    assert refused.value.reason == "memory"
+    with ledger.reserve(60):
+        with ledger.reserve(40):
+            assert ledger.stats()["in_flight_bytes"] == 100
+    assert ledger.stats() | {"deferred": None} == {
+        "in_flight_bytes": 0, "peak_bytes": 500, "limit_bytes": 100, "deferred": None, "rejected": 1}
+
+
+def test_memory_ledger_waits_for_room():
+    ledger = MemoryLedger(limit=100, max_wait=5.0)
+    released = []
+
+    def hold():
+        with ledger.reserve(80):
+            time.sleep(0.1)
+            released.append(True)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    while not ledger.stats()["in_flight_bytes"]:
+        time.sleep(0.01)
+    with ledger.reserve(50):
+        assert released
+    thread.join()
+    assert ledger.stats()["deferred"] == 1
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setenv("REDIS_URL", "redis://127.0.0.1:1/0")
+    import server
+    monkeypatch.setattr(server.Config, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(server.Config, "SINGLEFLIGHT_ENABLED", True)
+    monkeypatch.setattr(server.Config, "VAD_ENABLED", False)
+    monkeypatch.setattr(server, "transcription_cache", TranscriptionCache(None))
+    monkeypatch.setattr(server.in_flight, "redis", None)
+    monkeypatch.setattr(server, "admission", AdmissionController(
+        TokenBuckets(fakeredis.FakeRedis(), rate=0.01, burst=30.0, overrides={"unlimited": (0, 0)}), max_active=4))
+    return server
+
+
+def upload_of(server, seconds):
+    upload = io.BytesIO()
+    with wave.open(upload, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(server.Config.SAMPLE_RATE)
+        wav.writeframes(b"\x00\x01" * int(server.Config.SAMPLE_RATE * seconds))
+    return upload.getvalue()
+
+
+def transcribe_as(server, upload, tenant, outcomes):
+    try:
+        _, shared = server.transcribe_upload(io.BytesIO(upload), "call.wav", "en-US", {"model": "default"},
+                                             tenant=tenant)
+        outcomes[tenant] = "shared" if shared else "led"
+    except AdmissionRejected as e:
+        outcomes[tenant] = e.reason
+
+
+def test_coalesced_request_pays_from_its_own_quota(server, monkeypatch):
+    leading = threading.Event()
+
+    def transcribe_audio(pcm, language_code, config_options):
+        leading.set()
+        time.sleep(0.2)
+        return [{"alternatives": [], "result_end_time": 20.0}]
+
+    monkeypatch.setattr(server, "transcribe_audio", transcribe_audio)
+    upload = upload_of(server, 20)
+    # Enough quota to pass the check, not to pay for 20 s of audio
+    server.admission.buckets.take("broke", 28)
+    outcomes = {}
+    followers = server.in_flight.local_followers
+
+    leader = threading.Thread(target=transcribe_as, args=(server, upload, "unlimited", outcomes))
+    leader.start()
+    leading.wait(5)
+    transcribe_as(server, upload, "broke", outcomes)
+    leader.join(5)
+
+    assert outcomes == {"unlimited": "led", "broke": "quota"}
+    assert server.in_flight.local_followers == followers + 1
+
+
+def test_refused_leader_does_not_refuse_its_followers(server, monkeypatch):
+    followed = threading.Event()
+    prune_pcm = server.prune_pcm
+
+    def slow_prune_pcm(pcm):
+        # Hold the refused leader in flight until the other request has joined it
+        if threading.current_thread().name == "leader":
+            followed.wait(5)
+            time.sleep(0.1)
+        return prune_pcm(pcm)
+
+    monkeypatch.setattr(server, "prune_pcm", slow_prune_pcm)
+    monkeypatch.setattr(server, "transcribe_audio", lambda pcm, language_code, config_options: [])
+    upload = upload_of(server, 20)
+    server.admission.buckets.take("broke", 28)
+    outcomes = {}
+    followers = server.in_flight.local_followers
+
+    leader = threading.Thread(target=transcribe_as, args=(server, upload, "broke", outcomes), name="leader")
+    leader.start()
+    while not server.in_flight.stats()["in_flight"] and leader.is_alive():
+        time.sleep(0.01)
+    followed.set()
+    transcribe_as(server, upload, "unlimited", outcomes)
+    leader.join(5)
+
+    assert outcomes == {"broke": "quota", "unlimited": "led"}
+    assert server.in_flight.local_followers == followers + 1
@@ -0,0 +1,105 @@
+"""POST /transcribe/batch: zip expansion and its limits"""
+import io
+import json
+import zipfile
+
+import pytest
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setenv("REDIS_URL", "redis://127.0.0.1:1/0")
+    import server
+    transcribed = {}
+
+    def transcribe_upload(stream, filename, language, config_options, tenant=None, timeout=None):
+        transcribed[filename] = len(stream.read())
+        return [], False
+
+    monkeypatch.setattr(server, "transcribe_upload", transcribe_upload)
+    monkeypatch.setattr(server, "transcribed", transcribed, raising=False)
+    return server
+
+
+def zip_of(members, compression=zipfile.ZIP_DEFLATED):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", compression) as zf:
+        for name, size in members:
+            with zf.open(name, "w", force_zip64=True) as member:
+                for offset in range(0, size, 1 << 20):
+                    member.write(b"\x00" * min(1 << 20, size - offset))
+    archive.seek(0)
+    return archive
+
+
+def post_batch(server, archive):
+    return server.app.test_client().post("/transcribe/batch", data={"files": (archive, "calls.zip")})
+
+
+def lines_of(response):
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    return {line["filename"]: line for line in lines[:-1]}, lines[-1]["summary"]
+
+
+def test_oversized_member_is_refused_without_unpacking(server, monkeypatch):
+    monkeypatch.setattr(server.Config, "MAX_CONTENT_LENGTH", 4 * 1024 * 1024)
+
+    response = post_batch(server, zip_of([("a.wav", 1000), ("bomb.wav", 40 * 1024 * 1024), ("b.wav", 2000)]))
+
+    assert response.status_code == 200
+    lines, summary = lines_of(response)
+    assert lines["bomb.wav"]["success"] is False
+    assert lines["bomb.wav"]["error"] == "Archive member unpacks to more than 4 MB"
+    assert server.transcribed == {"a.wav": 1000, "b.wav": 2000}
+    assert (summary["total"], summary["failed"]) == (3, 1)
+
+
+def test_members_past_the_batch_expansion_limit_are_refused(server, monkeypatch):
+    monkeypatch.setattr(server.Config, "BATCH_MAX_EXPANDED_BYTES", 5 * 1024 * 1024)
+
+    response = post_batch(server, zip_of([(f"{i}.wav", 2 * 1024 * 1024) for i in range(4)]))
+
+    lines, summary = lines_of(response)
+    assert sorted(server.transcribed) == ["0.wav", "1.wav"]
+    assert lines["2.wav"]["error"] == "Archive members unpack to more than 5 MB in total"
+    assert (summary["succeeded"], summary["failed"]) == (2, 2)
+
+
+def test_member_is_not_read_past_its_declared_size(server):
+    archive = zipfile.ZipFile(zip_of([("liar.wav", 100000)], zipfile.ZIP_STORED))
+    member = archive.infolist()[0]
+    member.file_size = 10
+
+    # Either the size check or zipfile's own CRC check stops the copy
+    with pytest.raises((ValueError, zipfile.BadZipFile)):
+        server.spool_member(archive, member)
+
+
+def test_too_many_members_is_refused(server, monkeypatch):
+    monkeypatch.setattr(server.Config, "MAX_BATCH_ITEMS", 5)
+
+    response = post_batch(server, zip_of([(f"{i}.wav", 10) for i in range(1000)]))
+
+    assert response.status_code == 400
+    assert response.json["error"] == "Too many files; the limit is 5"
+    assert server.transcribed == {}
+
+
+def test_expansion_stops_just_past_the_item_limit(server, monkeypatch):
+    monkeypatch.setattr(server.Config, "MAX_BATCH_ITEMS", 5)
+    upload = zip_of([(f"{i}.wav", 10) for i in range(1000)])
+
+    class Upload:
+        filename = "calls.zip"
+        stream = upload
+
+    assert len(server.collect_batch_items([Upload()])) == 6
+
+
+def test_batch_at_the_item_limit_is_served(server, monkeypatch):
+    monkeypatch.setattr(server.Config, "MAX_BATCH_ITEMS", 5)
+
+    response = post_batch(server, zip_of([(f"{i}.wav", 10) for i in range(5)]))
+
+    assert response.status_code == 200
+    assert lines_of(response)[1]["succeeded"] == 5
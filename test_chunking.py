@@ -0,0 +1,94 @@
+"""Content-defined chunking (chunking.iter_content_chunks) of PCM audio"""
+import hashlib
+import io
+
+import numpy as np
+import pytest
+
+from chunking import content_cut, iter_content_chunks, pcm_to_array
+
+SAMPLE_RATE = 8000
+MIN_SECONDS, MAX_SECONDS = 2.0, 6.0
+
+
+def speech_like(seconds, seed, channels=1):
+    """Noise spoken in phrases of 0.5-3 s with short quiet pauses between them"""
+    rng = np.random.default_rng(seed)
+    samples = rng.normal(0, 3000, (int(SAMPLE_RATE * seconds), channels))
+    position = 0
+    while position < len(samples):
+        phrase = int(rng.uniform(0.5, 3) * SAMPLE_RATE)
+        pause = int(rng.uniform(0.05, 0.4) * SAMPLE_RATE)
+        samples[position + phrase:position + phrase + pause] *= rng.uniform(0.001, 0.05)
+        position += phrase + pause
+    return samples.astype(np.int16).tobytes()
+
+
+def chunks_of(pcm, channels=1):
+    return list(iter_content_chunks(io.BytesIO(pcm), SAMPLE_RATE, channels, MIN_SECONDS, MAX_SECONDS))
+
+
+def digests(chunks):
+    return [hashlib.sha256(chunk).hexdigest() for _, chunk in chunks]
+
+
+@pytest.fixture(scope="module")
+def recording():
+    return speech_like(120, seed=1)
+
+
+@pytest.mark.parametrize("channels", [1, 2])
+def test_chunks_join_back_into_the_input(channels):
+    pcm = speech_like(50, seed=4, channels=channels)
+
+    chunks = chunks_of(pcm, channels)
+
+    assert b"".join(chunk for _, chunk in chunks) == pcm
+    # Offsets are where each chunk starts in the input
+    frame_bytes = 2 * channels
+    starts = np.cumsum([0] + [len(chunk) // frame_bytes for _, chunk in chunks[:-1]]) / SAMPLE_RATE
+    assert [offset for offset, _ in chunks] == pytest.approx(list(starts))
+
+
+def test_chunk_lengths_stay_within_the_bounds(recording):
+    lengths = [len(chunk) / 2.0 / SAMPLE_RATE for _, chunk in chunks_of(recording)]
+
+    assert len(lengths) > 10
+    assert all(MIN_SECONDS <= length <= MAX_SECONDS for length in lengths[:-1])
+    assert 0 < lengths[-1] <= MAX_SECONDS
+
+
+def test_digital_silence_is_cut_at_the_maximum():
+    # Constant samples hash the same everywhere, to a value that is never a candidate
+    pcm = bytes(2 * SAMPLE_RATE * 20)
+    max_len = int(MAX_SECONDS * SAMPLE_RATE)
+
+    assert content_cut(pcm_to_array(pcm), int(MIN_SECONDS * SAMPLE_RATE), max_len, SAMPLE_RATE) == max_len
+    assert [len(chunk) // 2 for _, chunk in chunks_of(pcm)] == [max_len] * 3 + [2 * SAMPLE_RATE]
+
+
+def test_boundaries_survive_prepended_audio(recording):
+    original = digests(chunks_of(recording))
+
+    prepended = digests(chunks_of(speech_like(7.3, seed=2) + recording))
+
+    # Only the chunks up to the first cut both versions agree on differ
+    assert all(digest in original for digest in prepended[3:])
+    assert prepended[-(len(original) - 3):] == original[3:]
+
+
+def test_boundaries_survive_appended_audio(recording):
+    original = digests(chunks_of(recording))
+
+    appended = digests(chunks_of(recording + speech_like(9, seed=3)))
+
+    # Everything up to the old last chunk is cut exactly as before
+    assert appended[:len(original) - 1] == original[:-1]
+
+
+def test_boundaries_survive_trimmed_audio(recording):
+    original = digests(chunks_of(recording))
+
+    trimmed = digests(chunks_of(recording[2 * int(SAMPLE_RATE * 3.7):]))
+
+    assert trimmed[3:] == original[-(len(trimmed) - 3):]
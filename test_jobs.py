@@ -0,0 +1,198 @@
+"""JobQueue and worker.process_job against fakeredis"""
+import fakeredis
+import pytest
+from google.api_core.exceptions import DeadlineExceeded
+
+import jobs
+from jobs import JobQueue
+
+
+@pytest.fixture
+def queue():
+    return JobQueue(fakeredis.FakeRedis(), visibility_timeout=60, max_attempts=2)
+
+
+def expire_leases(queue):
+    """Move every processing job's visibility deadline into the past"""
+    for job_id in queue.redis.zrange(queue.processing_key, 0, -1):
+        queue.redis.zadd(queue.processing_key, {job_id: 0})
+
+
+def test_claim_follows_priority_then_age(queue):
+    low = queue.enqueue(b"a", "a.wav", "en-US", priority=1)
+    first = queue.enqueue(b"b", "b.wav", "en-US", priority=7)
+    second = queue.enqueue(b"c", "c.wav", "en-US", priority=7)
+    top = queue.enqueue(b"d", "d.wav", "en-US", priority=42)
+
+    claimed = [queue.claim().id for _ in range(4)]
+
+    assert claimed == [top, first, second, low]
+    assert queue.claim() is None
+    assert queue.status(top)["priority"] == jobs.MAX_PRIORITY
+
+
+def test_claim_marks_running_and_counts_attempts(queue):
+    job_id = queue.enqueue(b"audio", "a.wav", "de-DE", {"model": "phone_call"})
+
+    job = queue.claim()
+
+    assert (job.id, job.payload, job.filename, job.language) == (job_id, b"audio", "a.wav", "de-DE")
+    assert job.options == {"model": "phone_call"}
+    assert job.attempts == 1
+    assert queue.status(job_id)["status"] == jobs.RUNNING
+    assert queue.depth() == {"pending": 0, "processing": 1}
+
+
+def test_expired_lease_is_requeued(queue):
+    job_id = queue.enqueue(b"audio", "a.wav", "en-US")
+    queue.claim()
+
+    assert queue.requeue_expired() == 0
+    expire_leases(queue)
+    assert queue.requeue_expired() == 1
+
+    status = queue.status(job_id)
+    assert status["status"] == jobs.QUEUED
+    assert status["error"] == "worker stopped responding"
+    assert queue.claim().attempts == 2
+
+
+def test_heartbeat_keeps_the_lease(queue):
+    job_id = queue.enqueue(b"audio", "a.wav", "en-US")
+    queue.claim()
+    expire_leases(queue)
+
+    assert queue.heartbeat(job_id)
+    assert queue.requeue_expired() == 0
+
+
+def test_fail_after_requeue_expired_is_ignored(queue):
+    job_id = queue.enqueue(b"audio", "a.wav", "en-US")
+    queue.claim()
+    expire_leases(queue)
+    queue.requeue_expired()
+
+    # The slow worker reports late; the requeue already owns the job
+    queue.fail(job_id, "late failure")
+
+    assert queue.status(job_id)["error"] == "worker stopped responding"
+    assert queue.depth() == {"pending": 1, "processing": 0}
+    assert not queue.heartbeat(job_id)
+
+
+def test_requeue_expired_skips_a_job_already_failed(queue):
+    job_id = queue.enqueue(b"audio", "a.wav", "en-US")
+    queue.claim()
+    expire_leases(queue)
+    queue.fail(job_id, "boom")
+
+    assert queue.requeue_expired() == 0
+    assert queue.status(job_id)["error"] == "boom"
+    assert queue.depth() == {"pending": 1, "processing": 0}
+
+
+def test_max_attempts_ends_in_failed(queue):
+    job_id = queue.enqueue(b"audio", "a.wav", "en-US")
+    for attempt in range(queue.max_attempts):
+        assert queue.claim().attempts == attempt + 1
+        queue.fail(job_id, f"boom {attempt}")
+
+    status = queue.status(job_id)
+    assert status["status"] == jobs.FAILED
+    assert status["error"] == "boom 1"
+    assert queue.claim() is None
+    assert queue.redis.get(queue.payload_key(job_id)) is None
+
+
+def test_fail_without_retry_is_final(queue):
+    job_id = queue.enqueue(b"audio", "a.wav", "en-US")
+    queue.claim()
+
+    queue.fail(job_id, "bad audio", retry=False)
+
+    assert queue.status(job_id)["status"] == jobs.FAILED
+    assert queue.depth() == {"pending": 0, "processing": 0}
+
+
+def test_complete_stores_results_and_drops_payload(queue):
+    job_id = queue.enqueue(b"audio", "a.wav", "en-US")
+    queue.claim()
+    queue.fail(job_id, "boom")
+    queue.claim()
+
+    queue.complete(job_id, [{"transcript": "hello"}])
+
+    status = queue.status(job_id)
+    assert status["status"] == jobs.DONE
+    assert status["results"] == [{"transcript": "hello"}]
+    assert "error" not in status
+    assert queue.redis.get(queue.payload_key(job_id)) is None
+    assert queue.redis.ttl(queue.job_key(job_id)) > 0
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    monkeypatch.setenv("REDIS_URL", "redis://127.0.0.1:1/0")
+    import worker
+    return worker
+
+
+def test_process_job_completes(queue, worker, monkeypatch):
+    calls = []
+
+    def transcribe_upload(stream, filename, language, options, timeout):
+        calls.append((stream.read(), filename, language, options, timeout))
+        return [{"transcript": "hello"}], False
+
+    monkeypatch.setattr(worker, "transcribe_upload", transcribe_upload)
+    monkeypatch.setattr(worker.Config, "REQUEST_TIMEOUT", 1)
+    monkeypatch.setattr(worker.Config, "JOB_TIMEOUT", 3600)
+    job_id = queue.enqueue(b"audio", "a.wav", "en-US", {"model": "default"})
+
+    worker.process_job(queue, queue.claim())
+
+    # Held to the job's budget, not the HTTP request timeout
+    assert calls == [(b"audio", "a.wav", "en-US", {"model": "default"}, 3600)]
+    assert queue.status(job_id)["status"] == jobs.DONE
+
+
+def test_process_job_retries_errors(queue, worker, monkeypatch):
+    def transcribe_upload(stream, filename, language, options, timeout):
+        raise RuntimeError("upstream down")
+
+    monkeypatch.setattr(worker, "transcribe_upload", transcribe_upload)
+    job_id = queue.enqueue(b"audio", "a.wav", "en-US")
+
+    worker.process_job(queue, queue.claim())
+
+    status = queue.status(job_id)
+    assert (status["status"], status["error"]) == (jobs.QUEUED, "upstream down")
+
+
+def test_process_job_does_not_retry_undecodable_audio(queue, worker, monkeypatch):
+    def transcribe_upload(stream, filename, language, options, timeout):
+        raise worker.AudioDecodeError("not audio")
+
+    monkeypatch.setattr(worker, "transcribe_upload", transcribe_upload)
+    job_id = queue.enqueue(b"junk", "a.wav", "en-US")
+
+    worker.process_job(queue, queue.claim())
+
+    status = queue.status(job_id)
+    assert status["status"] == jobs.FAILED
+    assert status["error"].startswith("Could not decode audio")
+
+
+def test_process_job_does_not_retry_a_job_past_its_deadline(queue, worker, monkeypatch):
+    def transcribe_upload(stream, filename, language, options, timeout):
+        raise DeadlineExceeded("Deadline Exceeded")
+
+    monkeypatch.setattr(worker, "transcribe_upload", transcribe_upload)
+    job_id = queue.enqueue(b"audio", "a.wav", "en-US")
+
+    worker.process_job(queue, queue.claim())
+
+    status = queue.status(job_id)
+    assert status["status"] == jobs.FAILED
+    assert status["error"].startswith("Recognition did not finish within the job timeout")
+    assert queue.depth() == {"pending": 0, "processing": 0}
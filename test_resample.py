@@ -0,0 +1,65 @@
+"""Streaming polyphase resampling and downmix (resample.py)"""
+import numpy as np
+import pytest
+
+from resample import Resampler, resample
+
+
+def sine(frequency, rate, seconds=2.0, amplitude=0.5):
+    return amplitude * np.sin(2 * np.pi * frequency * np.arange(int(rate * seconds)) / rate)
+
+
+def pcm_to_float(pcm):
+    return np.frombuffer(pcm, dtype="<i2") / 32768.0
+
+
+def noise(frames, channels, seed=0):
+    return np.random.default_rng(seed).uniform(-0.5, 0.5, (frames, channels)).astype(np.float32)
+
+
+@pytest.mark.parametrize("source_rate, target_rate, source_channels", [
+    (44100, 16000, 1), (48000, 16000, 2), (22050, 16000, 1), (8000, 16000, 1), (16000, 16000, 2)])
+@pytest.mark.parametrize("block_frames", [1, 7, 1000, 20000])
+def test_blockwise_matches_one_shot(source_rate, target_rate, source_channels, block_frames):
+    samples = noise(source_rate // 4 + 123, source_channels)
+
+    resampler = Resampler(source_rate, target_rate, source_channels)
+    blockwise = b"".join(resampler.process(samples[start:start + block_frames])
+                         for start in range(0, len(samples), block_frames)) + resampler.flush()
+
+    one_shot = resample(samples, source_rate, target_rate)
+    assert len(blockwise) == len(one_shot)
+    # BLAS may sum a product of a few rows in another order than one of many; at most the last bit differs
+    difference = np.frombuffer(blockwise, dtype="<i2").astype(np.int32) - np.frombuffer(one_shot, dtype="<i2")
+    assert np.abs(difference).max() <= 1
+    # As many output frames as the input's duration holds, rounded up
+    assert len(blockwise) // 2 == -(-len(samples) * target_rate // source_rate)
+
+
+@pytest.mark.parametrize("frequency", [440, 1000, 3000])
+def test_sine_from_44k1_to_16k_within_tolerance(frequency):
+    samples = sine(frequency, 44100).astype(np.float32)[:, None]
+
+    out = pcm_to_float(resample(samples, 44100, 16000))
+
+    expected = sine(frequency, 16000)
+    assert len(out) == len(expected)
+    # Away from the filter's run-in at either end, within quantization error of 16-bit output
+    assert np.abs(out - expected)[200:-200].max() < 5e-5
+
+
+def test_tone_above_the_new_nyquist_rate_is_filtered_out():
+    samples = sine(9000, 44100).astype(np.float32)[:, None]
+
+    out = pcm_to_float(resample(samples, 44100, 16000))
+
+    # Aliased down to 7 kHz it would be as loud as it went in; here it is 50 dB down or more
+    assert np.abs(out[200:-200]).max() < 0.5 * 10 ** (-50 / 20)
+
+
+def test_stereo_is_downmixed_to_the_mean():
+    left, right = sine(440, 16000), sine(1000, 16000, amplitude=0.25)
+
+    out = pcm_to_float(resample(np.stack([left, right], axis=1).astype(np.float32), 16000, 16000))
+
+    assert np.abs(out - (left + right) / 2).max() < 1 / 32768
@@ -0,0 +1,98 @@
+"""SRT, WebVTT and text rendering of results (results.py)"""
+import pytest
+
+from results import render_results, subtitle_cues
+
+
+def words(*timed):
+    return [{"word": word, "start_time": start, "end_time": end} for word, start, end in timed]
+
+
+def result(transcript, timed=(), end=None):
+    return {"alternatives": [{"transcript": transcript, "confidence": 0.9, "words": words(*timed)}],
+            "channel_tag": None, "result_end_time": end}
+
+
+LONG = "the quick brown fox jumps over the lazy dog while the band plays on and on into the night"
+
+RESULTS = [
+    # A pause of more than a second starts a new cue
+    result("hello world again", [("hello", 0.0, 0.5), ("world", 0.6, 1.1), ("again", 2.6, 3.0)], end=3.2),
+    # No word timings: one cue from the previous result's end
+    result(" no timings here ", end=9.75),
+    # Past the hour, and more than the 84 characters of one cue
+    result(LONG, [(word, 3725.004 + 0.3 * i, 3725.254 + 0.3 * i) for i, word in enumerate(LONG.split())],
+           end=3731.5),
+    # Nothing recognized
+    {"alternatives": [], "channel_tag": None, "result_end_time": 3733.0},
+]
+
+SRT = """\
+1
+00:00:00,000 --> 00:00:01,100
+hello world
+
+2
+00:00:02,600 --> 00:00:03,000
+again
+
+3
+00:00:03,200 --> 00:00:09,750
+no timings here
+
+4
+01:02:05,004 --> 01:02:10,354
+the quick brown fox jumps over the lazy dog while the band plays on and on into the
+
+5
+01:02:10,404 --> 01:02:10,654
+night
+
+"""
+
+VTT = """\
+WEBVTT
+
+00:00:00.000 --> 00:00:01.100
+hello world
+
+00:00:02.600 --> 00:00:03.000
+again
+
+00:00:03.200 --> 00:00:09.750
+no timings here
+
+01:02:05.004 --> 01:02:10.354
+the quick brown fox jumps over the lazy dog while the band plays on and on into the
+
+01:02:10.404 --> 01:02:10.654
+night
+
+"""
+
+TEXT = f"""\
+hello world again
+no timings here
+{LONG}
+"""
+
+
+@pytest.mark.parametrize("output_format, expected", [("srt", SRT), ("vtt", VTT), ("text", TEXT)])
+def test_golden_output(output_format, expected):
+    assert render_results(RESULTS, output_format) == expected
+
+
+def test_cue_is_split_at_the_length_limit():
+    timed = [(f"w{i}", i * 0.5, i * 0.5 + 0.4) for i in range(20)]
+
+    cues = subtitle_cues([result("", timed, end=10.0)])
+
+    # At most 7 seconds on screen: 14 words from 0 s to 6.9 s, then the rest
+    assert cues == [(0, 6900, " ".join(f"w{i}" for i in range(14))),
+                    (7000, 9900, " ".join(f"w{i}" for i in range(14, 20)))]
+
+
+@pytest.mark.parametrize("output_format, expected", [("srt", ""), ("vtt", "WEBVTT\n\n"), ("text", "")])
+def test_empty_results(output_format, expected):
+    assert render_results([], output_format) == expected
+    assert render_results([result("", end=1.0), {"alternatives": []}], output_format) == expected
@@ -0,0 +1,179 @@
+"""SingleFlight coalescing within a process and across processes through fakeredis"""
+import threading
+import time
+
+import fakeredis
+import pytest
+
+from singleflight import SingleFlight
+
+
+class Refused(Exception):
+    pass
+
+
+def run_concurrently(*targets):
+    threads = [threading.Thread(target=target) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_local_followers_share_the_leaders_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+    outcomes = []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return "text"
+
+    def caller():
+        outcomes.append(flight.do("key", work))
+
+    def release_when_all_wait():
+        wait_until(lambda: flight.local_followers == 2)
+        release.set()
+
+    run_concurrently(caller, caller, caller, release_when_all_wait)
+
+    assert len(calls) == 1
+    assert sorted(outcomes) == [("text", False), ("text", True), ("text", True)]
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_local_followers_share_the_leaders_failure():
+    flight = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def work():
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    def caller():
+        try:
+            flight.do("key", work)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    def release_when_waiting():
+        wait_until(lambda: flight.local_followers == 1)
+        release.set()
+
+    run_concurrently(caller, caller, release_when_waiting)
+
+    assert errors == ["upstream down", "upstream down"]
+    # Nothing is left behind to coalesce the next request onto
+    assert flight.do("key", lambda: "retried") == ("retried", False)
+
+
+def test_private_errors_send_followers_to_run_it_themselves():
+    flight = SingleFlight(private_errors=(Refused,))
+    release = threading.Event()
+    outcomes = []
+
+    def refused():
+        release.wait(5)
+        raise Refused("leader's quota")
+
+    def leader():
+        with pytest.raises(Refused):
+            flight.do("key", refused)
+
+    def follower():
+        wait_until(lambda: flight.stats()["in_flight"] == 1)
+        outcomes.append(flight.do("key", lambda: "follower's own"))
+
+    def release_when_waiting():
+        wait_until(lambda: flight.local_followers == 1)
+        release.set()
+
+    run_concurrently(leader, follower, release_when_waiting)
+
+    assert outcomes == [("follower's own", False)]
+    assert flight.leaders == 2
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis()
+
+
+def test_remote_follower_reads_the_leaders_result(redis_client):
+    leader, follower = (SingleFlight(redis_client, lock_ttl=5, poll_interval=0.05) for _ in range(2))
+    store = {}
+    started = threading.Event()
+    outcomes = {}
+
+    def work():
+        started.set()
+        time.sleep(0.2)
+        store["key"] = "text"
+        return "text"
+
+    def lead():
+        outcomes["leader"] = leader.do("key", work, lambda: store.get("key"))
+
+    def follow():
+        started.wait(5)
+        outcomes["follower"] = follower.do("key", lambda: "duplicate", lambda: store.get("key"))
+
+    run_concurrently(lead, follow)
+
+    assert outcomes == {"leader": ("text", False), "follower": ("text", True)}
+    assert follower.remote_followers == 1
+    assert not redis_client.exists("stt:inflight:lock:key")
+
+
+def test_remote_follower_takes_over_from_a_failed_leader(redis_client):
+    leader, follower = (SingleFlight(redis_client, lock_ttl=5, poll_interval=0.05) for _ in range(2))
+    started = threading.Event()
+    outcomes = {}
+
+    def work():
+        started.set()
+        time.sleep(0.2)
+        raise RuntimeError("upstream down")
+
+    def lead():
+        with pytest.raises(RuntimeError):
+            leader.do("key", work, lambda: None)
+
+    def follow():
+        started.wait(5)
+        outcomes["follower"] = follower.do("key", lambda: "recovered", lambda: None)
+
+    run_concurrently(lead, follow)
+
+    assert outcomes == {"follower": ("recovered", False)}
+    assert follower.takeovers == 1
+
+
+def test_remote_follower_takes_over_when_the_leaders_lock_expires(redis_client):
+    follower = SingleFlight(redis_client, lock_ttl=5, poll_interval=0.05)
+    # A leader that died holding the lock: nobody refreshes or releases it
+    redis_client.set("stt:inflight:lock:key", "dead-leader", px=200)
+
+    start = time.time()
+    assert follower.do("key", lambda: "recovered", lambda: None) == ("recovered", False)
+    assert time.time() - start >= 0.15
+    assert follower.takeovers == 1
+
+
+def test_follower_gives_up_waiting_after_wait_timeout(redis_client):
+    follower = SingleFlight(redis_client, wait_timeout=0.2, poll_interval=0.05)
+    redis_client.set("stt:inflight:lock:key", "stuck-leader", px=60000)
+
+    assert follower.do("key", lambda: "uncoalesced", lambda: None) == ("uncoalesced", False)
+    assert follower.takeovers == 0
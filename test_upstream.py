@@ -0,0 +1,225 @@
+"""Deadlines, retries and hedging (upstream.py) against the fake Speech backend"""
+import asyncio
+import io
+import threading
+import time
+import wave
+
+import pytest
+from google.api_core.exceptions import DeadlineExceeded, ServiceUnavailable
+from google.cloud import speech_v1p1beta1 as speech
+
+import fake_speech
+from speech_pool import AsyncSpeechClientPool, SpeechClientPool
+from upstream import LatencyTracker, UpstreamPolicy, deadline, remaining
+
+CONTENT = b"\x00" * 32000  # one second of 16 kHz LINEAR16
+KEY = LatencyTracker.key("LINEAR16", len(CONTENT))
+
+
+class StragglingServicer(fake_speech.FakeSpeechServicer):
+    """Fake backend whose next call, once asked, stalls until the client gives up on it"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.straggle_next = False
+        self.cancelled = threading.Event()
+
+    def recognize(self, request, context):
+        if not self.straggle_next:
+            return super().recognize(request, context)
+        self.straggle_next = False
+        self.calls += 1
+        stall_until = time.time() + 5
+        while context.is_active() and time.time() < stall_until:
+            time.sleep(0.01)
+        if not context.is_active():
+            self.cancelled.set()
+        return speech.RecognizeResponse()
+
+
+@pytest.fixture
+def backend():
+    server, port, servicer = fake_speech.serve(StragglingServicer(latency=0.01, failure_rate=0.3, seed=7))
+    yield port, servicer
+    server.stop(None)
+
+
+@pytest.fixture
+def pool(backend):
+    pool = SpeechClientPool(size=1, endpoint=f"127.0.0.1:{backend[0]}")
+    pool.warmup()
+    yield pool
+    pool.close()
+
+
+def make_request():
+    config = speech.RecognitionConfig(
+        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+        sample_rate_hertz=16000,
+        language_code="en-US",
+    )
+    return speech.RecognizeRequest(config=config, audio=speech.RecognitionAudio(content=CONTENT))
+
+
+def outcomes(policy, pool, calls=30):
+    request = make_request()
+    failed = 0
+    for _ in range(calls):
+        try:
+            with deadline(5):
+                response = policy.call(lambda timeout: pool.start("recognize", request, timeout), KEY)
+            assert response.results[0].alternatives[0].transcript == "word0 word1"
+        except ServiceUnavailable:
+            failed += 1
+    return failed
+
+
+def test_retries_turn_transient_failures_into_successes(pool, backend):
+    _, servicer = backend
+
+    assert outcomes(UpstreamPolicy(retries=0), pool) > 0
+    calls = servicer.calls
+    assert outcomes(UpstreamPolicy(retries=6, backoff=0.01), pool) == 0
+    # Every failure cost one more backend call
+    assert servicer.calls - calls > 30
+
+
+def test_retries_stop_at_the_deadline(pool, backend):
+    _, servicer = backend
+    servicer.failure_rate = 1.0
+    policy = UpstreamPolicy(retries=100, backoff=0.05, max_backoff=0.05)
+
+    start = time.monotonic()
+    # The last failure, or the deadline itself if it runs out mid-attempt
+    with pytest.raises((ServiceUnavailable, DeadlineExceeded)):
+        with deadline(0.5):
+            policy.call(lambda timeout: pool.start("recognize", make_request(), timeout), KEY)
+    assert time.monotonic() - start < 1.0
+
+
+def hedging_policy():
+    policy = UpstreamPolicy(hedge=True, hedge_min_delay=0.05, tracker=LatencyTracker(min_samples=5))
+    for _ in range(5):
+        policy.latencies.observe(KEY, 0.02)
+    return policy
+
+
+def test_hedge_answers_a_straggler_and_cancels_it(pool, backend):
+    _, servicer = backend
+    servicer.failure_rate = 0.0
+    servicer.straggle_next = True
+    calls = servicer.calls
+
+    start = time.monotonic()
+    with deadline(10):
+        response = hedging_policy().call(lambda timeout: pool.start("recognize", make_request(), timeout), KEY)
+
+    assert response.results
+    assert time.monotonic() - start < 1.0
+    assert servicer.calls - calls == 2
+    assert servicer.cancelled.wait(2)
+
+
+def test_async_hedge_answers_a_straggler_and_cancels_it(backend):
+    port, servicer = backend
+    servicer.failure_rate = 0.0
+    request = make_request()
+
+    async def main():
+        pool = AsyncSpeechClientPool(size=1, endpoint=f"127.0.0.1:{port}")
+        await pool.warmup()
+        servicer.straggle_next = True
+        try:
+            with deadline(10):
+                return await hedging_policy().call_async(
+                    lambda timeout: pool.recognize(config=request.config, audio=request.audio, timeout=timeout,
+                                                   retry=None), KEY)
+        finally:
+            await pool.close()
+
+    start = time.monotonic()
+    response = asyncio.run(main())
+
+    assert response.results
+    assert time.monotonic() - start < 1.0
+    assert servicer.cancelled.wait(2)
+
+
+def test_no_hedge_without_latency_history(pool, backend):
+    _, servicer = backend
+    servicer.failure_rate = 0.0
+    policy = UpstreamPolicy(hedge=True, hedge_min_delay=0.05, tracker=LatencyTracker(min_samples=5))
+    calls = servicer.calls
+
+    with deadline(5):
+        policy.call(lambda timeout: pool.start("recognize", make_request(), timeout), KEY)
+
+    assert servicer.calls - calls == 1
+    assert policy.latencies.percentile(KEY, 95) is None
+
+
+def test_passed_deadline_raises_deadline_exceeded_without_calling():
+    started = []
+    with deadline(0.01):
+        time.sleep(0.02)
+        assert remaining() < 0
+        with pytest.raises(DeadlineExceeded):
+            UpstreamPolicy().call(lambda timeout: started.append(timeout), KEY)
+    assert started == []
+
+
+def test_inner_deadline_cannot_outlast_the_outer_one():
+    with deadline(1):
+        with deadline(60):
+            assert remaining() <= 1
+        with deadline(None):
+            assert remaining() <= 1
+    with deadline(None):
+        assert remaining() is None
+    assert remaining() is None
+
+
+def test_default_timeout_only_applies_outside_a_deadline():
+    timeouts = []
+
+    def start(timeout):
+        timeouts.append(timeout)
+        raise ServiceUnavailable("down")
+
+    policy = UpstreamPolicy(default_timeout=1, retries=0)
+    for budget in (None, 60):
+        with deadline(budget), pytest.raises(ServiceUnavailable):
+            policy.call(start, KEY)
+
+    # A job's longer budget is not cut down to the per-request default
+    assert timeouts[0] <= 1 < 59 < timeouts[1]
+
+
+def test_request_past_its_deadline_gets_504(backend, monkeypatch):
+    port, servicer = backend
+    servicer.failure_rate = 0.0
+    servicer.latency = 2.0
+    monkeypatch.setenv("REDIS_URL", "redis://127.0.0.1:1/0")
+    import server
+    from cache import TranscriptionCache
+    monkeypatch.setattr(server, "transcription_cache", TranscriptionCache(None))
+    monkeypatch.setattr(server, "speech_clients", SpeechClientPool(size=1, endpoint=f"127.0.0.1:{port}"))
+    monkeypatch.setattr(server.Config, "REQUEST_TIMEOUT", 0.3)
+    monkeypatch.setattr(server.Config, "ADMISSION_ENABLED", False)
+    monkeypatch.setattr(server.Config, "VAD_ENABLED", False)
+    upload = io.BytesIO()
+    with wave.open(upload, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(b"\x00\x01" * 16000)
+    upload.seek(0)
+
+    start = time.monotonic()
+    response = server.app.test_client().post("/transcribe", data={"file": (upload, "late.wav"), "language": "en-US"})
+
+    assert response.status_code == 504
+    assert response.json["success"] is False
+    assert time.monotonic() - start < 1.5
+    server.speech_clients.close()
@@ -0,0 +1,111 @@
+"""Silence pruning (vad.py) and mapping recognizer timestamps back to the recording"""
+import io
+import wave
+
+import numpy as np
+import pytest
+
+from cache import TranscriptionCache
+from vad import OffsetMap, prune_silence, remap_results
+
+SAMPLE_RATE = 16000
+
+
+def speech_like(seconds, seed=0):
+    """Noise in 0.2 s syllables with quieter 0.1 s gaps, the level changes speech makes"""
+    rng = np.random.default_rng(seed)
+    samples = rng.normal(0, 3000, int(SAMPLE_RATE * seconds))
+    period = int(0.3 * SAMPLE_RATE)
+    samples[(np.arange(len(samples)) % period) >= int(0.2 * SAMPLE_RATE)] *= 0.02
+    return samples.astype(np.int16)
+
+
+def silence(seconds):
+    return np.zeros(int(SAMPLE_RATE * seconds), dtype=np.int16)
+
+
+def word(start, end):
+    return {"word": "w", "start_time": start, "end_time": end}
+
+
+# Kept: 0-1 s, 3-4 s and 7-8 s of a 10 s recording, so 0-3 s of pruned audio
+THREE_SEGMENTS = OffsetMap([(0, 1000), (3000, 4000), (7000, 8000)], 1000, 10000)
+
+
+def test_remap_across_several_dropped_silences():
+    results = [
+        {"alternatives": [{"words": [word(0.5, 0.9), word(1.2, 1.5)]}], "result_end_time": 2.0},
+        {"alternatives": [{"words": [word(2.1, 2.8)]}], "result_end_time": 3.0},
+    ]
+
+    remap_results(results, THREE_SEGMENTS)
+
+    assert [(w["start_time"], w["end_time"]) for w in results[0]["alternatives"][0]["words"]] == [
+        (0.5, 0.9), pytest.approx((3.2, 3.5))]
+    assert [(w["start_time"], w["end_time"]) for w in results[1]["alternatives"][0]["words"]] == [
+        pytest.approx((7.1, 7.8))]
+    # A result ending right on a cut ends with the speech before it, not after the silence
+    assert [r["result_end_time"] for r in results] == [4.0, 8.0]
+    assert (THREE_SEGMENTS.kept_seconds, THREE_SEGMENTS.removed_seconds) == (3.0, 7.0)
+
+
+def test_word_spanning_a_cut_ends_where_its_segment_does():
+    results = [{"alternatives": [{"words": [word(0.8, 1.3), word(1.0, 1.4), word(1.9, 2.2)]}]}]
+
+    remap_results(results, THREE_SEGMENTS)
+
+    spans = [(w["start_time"], w["end_time"]) for w in results[0]["alternatives"][0]["words"]]
+    # Not stretched over the two seconds of silence that were cut between its halves
+    assert spans[0] == pytest.approx((0.8, 1.0))
+    # One starting right on the cut belongs to the segment after it
+    assert spans[1] == pytest.approx((3.0, 3.4))
+    assert spans[2] == pytest.approx((3.9, 4.0))
+
+
+def test_prune_silence_cuts_long_silences_and_maps_back():
+    pieces = [speech_like(2, seed=1), silence(3), speech_like(2, seed=2), silence(0.5), speech_like(1, seed=3),
+              silence(4)]
+    pcm = io.BytesIO(np.concatenate(pieces).tobytes())
+
+    speech_map = prune_silence(pcm, SAMPLE_RATE, padding_seconds=0.3)
+
+    # The 3 s and 4 s silences go, less 0.3 s of padding next to speech; the 0.5 s pause stays
+    assert speech_map.original_seconds == pytest.approx(12.5)
+    assert speech_map.kept_seconds == pytest.approx(2 + 0.6 + 2 + 0.5 + 1 + 0.3, abs=0.1)
+    assert pcm.getbuffer().nbytes == int(round(speech_map.kept_seconds * SAMPLE_RATE)) * 2
+    # The second stretch of speech starts 2.6 s into the pruned audio and 5 s into the recording;
+    # the third, after the pause that was kept, at 5.1 s and 7.5 s
+    assert speech_map.original_time(2.6) == pytest.approx(5.0, abs=0.05)
+    assert speech_map.original_time(5.1) == pytest.approx(7.5, abs=0.05)
+
+
+def test_all_silence_prunes_to_nothing():
+    pcm = io.BytesIO(silence(5).tobytes())
+
+    speech_map = prune_silence(pcm, SAMPLE_RATE)
+
+    assert speech_map.kept_seconds == 0
+    assert speech_map.original_seconds == 5
+    assert pcm.getbuffer().nbytes == 0
+
+
+def test_all_silence_upload_returns_no_results_without_recognizing(monkeypatch):
+    monkeypatch.setenv("REDIS_URL", "redis://127.0.0.1:1/0")
+    import server
+    monkeypatch.setattr(server.Config, "VAD_ENABLED", True)
+    monkeypatch.setattr(server.Config, "ADMISSION_ENABLED", False)
+    monkeypatch.setattr(server, "transcription_cache", TranscriptionCache(None))
+    calls = []
+    monkeypatch.setattr(server, "transcribe_audio", lambda *args: calls.append(args))
+    upload = io.BytesIO()
+    with wave.open(upload, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(server.Config.SAMPLE_RATE)
+        wav.writeframes(b"\x00\x00" * server.Config.SAMPLE_RATE * 5)
+    upload.seek(0)
+
+    results, cached = server.transcribe_upload(upload, "quiet.wav", "en-US", {"model": "default"})
+
+    assert (results, cached) == ([], False)
+    assert calls == []
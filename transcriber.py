@@ -1,69 +1,291 @@
 import os
 from pathlib import Path
+import argparse
 import json
-import soundfile as sf
-from google.cloud import speech
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from google.cloud import speech_v1p1beta1 as speech
+from speech_pool import get_pool
+from audio import (AudioDecodeError, decode_with_ffmpeg, decode_with_pydub, decode_with_soundfile,
+                   encode_for_upstream, ffmpeg_available, probe_audio, read_pcm16, UPSTREAM_FLAC)
+from chunking import split_pcm, shift_results, merge_results
+from results import response_to_dicts
 
-def transcribe_audio(audio_file_path):
+SAMPLE_RATE = 16000
+CHANNELS = 1
+BYTES_PER_SECOND = 2 * SAMPLE_RATE * CHANNELS
+
+# Synchronous recognize accepts up to a minute of audio; longer files are split
+CHUNK_SECONDS = 55
+SEARCH_SECONDS = 10
+
+AUDIO_EXTENSIONS = {'.mp3', '.wav', '.flac', '.m4a', '.aac', '.ogg', '.wma', '.opus'}
+
+def prepare_audio(audio_file_path, ffmpeg="ffmpeg"):
     """
-    Transcribe an audio file to text using Google Cloud Speech-to-Text API
+    Decode and resample a file to 16 kHz mono, split it if long and compress
+    each piece for upload. Returns (duration, [(offset, content, encoding)]).
+    Runs in the batch process pool, so it only takes and returns picklable values.
     """
-    # Check if file exists
-    if not Path(audio_file_path).exists():
-        raise FileNotFoundError(f"Audio file not found: {audio_file_path}")
-    
-    # Initialize the client
-    client = speech.SpeechClient()
-    
-    # Read the audio file
-    with open(audio_file_path, "rb") as audio_file:
-        content = audio_file.read()
-    
-    # Create the audio object
-    audio = speech.RecognitionAudio(content=content)
-    
-    # Configure the recognition settings
-    config = speech.RecognitionConfig(
-        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-        sample_rate_hertz=16000,
-        language_code="ru-RU",  # Russian language
-        enable_automatic_punctuation=True,
-    )
-    
-    # Perform the transcription
-    response = client.recognize(config=config, audio=audio)
-    
-    # Combine all transcriptions
-    transcript = ""
-    for result in response.results:
-        transcript += result.alternatives[0].transcript + " "
-    
-    # Create output JSON
+    extension = Path(audio_file_path).suffix[1:].lower()
+    with open(audio_file_path, "rb") as f:
+        info = probe_audio(f, extension)
+        readable = info and info["format"] in ("WAV", "FLAC")
+        if readable and (info["subtype"], info["sample_rate"], info["channels"]) == ("PCM_16", SAMPLE_RATE, CHANNELS):
+            # Already 16 kHz mono 16-bit: read the samples instead of running ffmpeg
+            pcm = read_pcm16(f)
+        elif readable:
+            # Other WAV and FLAC are resampled with numpy, still without ffmpeg
+            pcm = decode_with_soundfile(f, SAMPLE_RATE, CHANNELS)
+        else:
+            pcm = None
+
+    if pcm is None and ffmpeg_available(ffmpeg):
+        pcm = decode_with_ffmpeg(audio_file_path, SAMPLE_RATE, CHANNELS, ffmpeg)
+    elif pcm is None:
+        with open(audio_file_path, "rb") as f:
+            pcm = decode_with_pydub(f, SAMPLE_RATE, CHANNELS, format=extension)
+
+    duration = len(pcm) / float(BYTES_PER_SECOND)
+    if duration > CHUNK_SECONDS:
+        pieces = split_pcm(pcm, SAMPLE_RATE, CHANNELS, CHUNK_SECONDS, SEARCH_SECONDS)
+    else:
+        pieces = [(0.0, pcm)]
+    chunks = []
+    for offset, piece in pieces:
+        content, encoding = encode_for_upstream(piece, SAMPLE_RATE, CHANNELS, UPSTREAM_FLAC)
+        chunks.append((offset, content, encoding))
+    return duration, chunks
+
+def recognize_chunks(chunks, language_code="ru-RU"):
+    """Recognize prepared chunks in order and return results on the file's timeline"""
+    chunk_results = []
+    for offset, content, encoding in chunks:
+        config = speech.RecognitionConfig(
+            encoding=speech.RecognitionConfig.AudioEncoding[encoding],
+            sample_rate_hertz=SAMPLE_RATE,
+            language_code=language_code,
+            enable_automatic_punctuation=True,
+        )
+        response = get_pool().recognize(config=config, audio=speech.RecognitionAudio(content=content))
+        chunk_results.append(shift_results(response_to_dicts(response), offset))
+    return merge_results(chunk_results)
+
+def build_output(audio_file_path, results, duration=None):
+    """Summary record for one file"""
+    transcript = " ".join(r["alternatives"][0]["transcript"] for r in results if r["alternatives"])
+    first = next((r for r in results if r["alternatives"]), None)
     output = {
-        "audio_file": audio_file_path,
+        "audio_file": str(audio_file_path),
         "transcript": transcript.strip(),
         "timestamp": str(Path(audio_file_path).stat().st_mtime),
-        "confidence": response.results[0].alternatives[0].confidence if response.results else None
+        "confidence": first["alternatives"][0]["confidence"] if first else None
     }
-    
+    if duration is not None:
+        output["duration"] = round(duration, 3)
+    return output
+
+def transcribe_audio(audio_file_path, language_code="ru-RU"):
+    """
+    Transcribe an audio file to text using Google Cloud Speech-to-Text API
+    """
+    # Check if file exists
+    if not Path(audio_file_path).exists():
+        raise FileNotFoundError(f"Audio file not found: {audio_file_path}")
+
+    # Decode whatever the input is to 16 kHz mono and recognize it
+    duration, chunks = prepare_audio(audio_file_path)
+    results = recognize_chunks(chunks, language_code)
+    output = build_output(audio_file_path, results)
+
     # Save to JSON file
     output_path = Path(audio_file_path).with_suffix('.json')
     with open(output_path, 'w', encoding='utf-8') as f:
         json.dump(output, f, ensure_ascii=False, indent=2)
-    
+
     return output
 
+def iter_audio_files(inputs, file_list=None):
+    """Audio files under the given files and directories, plus those named in file_list"""
+    for entry in inputs:
+        path = Path(entry)
+        if path.is_dir():
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if Path(name).suffix.lower() in AUDIO_EXTENSIONS:
+                        yield str(Path(root) / name)
+        else:
+            yield str(path)
+    if file_list:
+        with open(file_list, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield line
+
+def load_manifest(manifest_path):
+    """Files already written to the output by an earlier run"""
+    if not os.path.exists(manifest_path):
+        return set()
+    with open(manifest_path, encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.endswith("\n")}
+
+def open_append(path):
+    """Open for appending, first terminating a line a crash may have cut short"""
+    f = open(path, "a+", encoding="utf-8")
+    if f.tell() > 0:
+        f.seek(f.tell() - 1)
+        if f.read(1) != "\n":
+            f.write("\n")
+    return f
+
+class Progress:
+    """Throughput report on stderr: files/s and hours of audio per second"""
+
+    def __init__(self, total, interval=5.0):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.audio_seconds = 0.0
+        self.started = time.time()
+        self._last = 0.0
+
+    def update(self, ok, audio_seconds=0.0):
+        self.done += 1
+        self.failed += not ok
+        self.audio_seconds += audio_seconds
+        if time.time() - self._last >= self.interval or self.done == self.total:
+            self.report()
+
+    def report(self):
+        self._last = time.time()
+        elapsed = max(self._last - self.started, 1e-9)
+        rate = self.done / elapsed
+        eta = (self.total - self.done) / rate if rate else 0.0
+        print(f"{self.done}/{self.total} files, {self.failed} failed | {rate:.1f} files/s, "
+              f"{self.audio_seconds / 3600.0 / elapsed:.3f} audio-h/s | "
+              f"{self.audio_seconds / 3600.0:.2f} h of audio | ETA {eta / 60.0:.1f} min",
+              file=sys.stderr, flush=True)
+
+def transcribe_batch(inputs, output_path, file_list=None, language_code="ru-RU", workers=None, concurrency=16,
+                     ffmpeg="ffmpeg"):
+    """
+    Transcribe many files into one append-only JSONL file.
+
+    Decoding runs in a process pool and recognize calls on a bounded thread
+    pool, with at most a few files buffered between the two. Every finished
+    file is appended to the output and then recorded in <output>.manifest,
+    so a rerun skips it; a crash between the two writes repeats one file.
+    """
+    manifest_path = f"{output_path}.manifest"
+    finished = load_manifest(manifest_path)
+    files = [path for path in dict.fromkeys(iter_audio_files(inputs, file_list)) if path not in finished]
+    if finished:
+        print(f"Resuming: {len(finished)} files already done, {len(files)} to go", file=sys.stderr)
+    if not files:
+        return {"total": 0, "succeeded": 0, "failed": 0}
+
+    workers = workers or os.cpu_count() or 1
+    progress = Progress(len(files))
+    write_lock = threading.Lock()
+    out = open_append(output_path)
+    manifest = open_append(manifest_path)
+
+    def record(line, path=None):
+        with write_lock:
+            out.write(json.dumps(line, ensure_ascii=False) + "\n")
+            out.flush()
+            if path is not None:
+                manifest.write(path + "\n")
+                manifest.flush()
+
+    def recognize_file(path, duration, chunks):
+        results = recognize_chunks(chunks, language_code)
+        line = build_output(path, results, duration)
+        line.update({"language": language_code, "results": results})
+        return line
+
+    pending = iter(files)
+    decoding = {}
+    recognizing = {}
+    # Decoded audio waiting for an upstream slot stays bounded
+    max_decoding = workers * 2
+    max_recognizing = concurrency * 2
+
+    with ProcessPoolExecutor(max_workers=workers) as decode_pool, \
+            ThreadPoolExecutor(max_workers=concurrency) as upstream_pool:
+        try:
+            while True:
+                while len(decoding) < max_decoding and len(decoding) + len(recognizing) < max_decoding + max_recognizing:
+                    path = next(pending, None)
+                    if path is None:
+                        break
+                    decoding[decode_pool.submit(prepare_audio, path, ffmpeg)] = path
+                if not decoding and not recognizing:
+                    break
+
+                done, _ = wait(list(decoding) + list(recognizing), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in decoding:
+                        path = decoding.pop(future)
+                        try:
+                            duration, chunks = future.result()
+                        except (AudioDecodeError, OSError) as e:
+                            record({"audio_file": path, "error": f"Could not decode audio: {e}"})
+                            progress.update(False)
+                            continue
+                        except Exception as e:
+                            record({"audio_file": path, "error": str(e)})
+                            progress.update(False)
+                            continue
+                        recognizing[upstream_pool.submit(recognize_file, path, duration, chunks)] = (path, duration)
+                    else:
+                        path, duration = recognizing.pop(future)
+                        try:
+                            record(future.result(), path)
+                            progress.update(True, duration)
+                        except Exception as e:
+                            record({"audio_file": path, "error": str(e)})
+                            progress.update(False)
+        finally:
+            for future in decoding:
+                future.cancel()
+            out.close()
+            manifest.close()
+
+    return {"total": len(files), "succeeded": progress.done - progress.failed, "failed": progress.failed}
+
 if __name__ == "__main__":
-    import sys
-    
-    if len(sys.argv) != 2:
-        print("Usage: python transcriber.py <path_to_audio_file>")
-        sys.exit(1)
-    
+    parser = argparse.ArgumentParser(
+        description="Transcribe one audio file to <file>.json, or many into a JSONL file",
+        usage="python transcriber.py <path_to_audio_file>\n"
+              "       python transcriber.py DIR_OR_FILE... [--file-list LIST] -o results.jsonl")
+    parser.add_argument("inputs", nargs="*", help="audio files or directories")
+    parser.add_argument("-o", "--output", help="JSONL output for batch mode (resumable)")
+    parser.add_argument("--file-list", help="text file with one audio path per line")
+    parser.add_argument("--language", default="ru-RU")
+    parser.add_argument("--workers", type=int, help="decode processes (default: CPU count)")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent recognize calls")
+    args = parser.parse_args()
+
+    batch = args.output or args.file_list or len(args.inputs) != 1 or Path(args.inputs[0]).is_dir()
+    if batch:
+        if not args.inputs and not args.file_list:
+            parser.print_usage()
+            sys.exit(1)
+        summary = transcribe_batch(args.inputs, args.output or "transcripts.jsonl", args.file_list,
+                                   args.language, args.workers, args.concurrency)
+        print(f"Done: {summary['succeeded']} succeeded, {summary['failed']} failed")
+        sys.exit(1 if summary["failed"] else 0)
+
     try:
-        result = transcribe_audio(sys.argv[1])
+        result = transcribe_audio(args.inputs[0], args.language)
         print(f"Transcription completed successfully!")
-        print(f"Transcript saved to: {Path(sys.argv[1]).with_suffix('.json')}")
+        print(f"Transcript saved to: {Path(args.inputs[0]).with_suffix('.json')}")
         print(f"Confidence: {result['confidence']}")
     except Exception as e:
         print(f"Error: {str(e)}")
@@ -0,0 +1,232 @@
+"""Deadlines, retries and hedging for recognize calls.
+
+A request's deadline lives in a context variable, which metrics.submit and
+asyncio tasks carry into the threads and coroutines that make its upstream
+calls, so every chunk of a long upload draws on the same budget. Each
+attempt gets what is left of it as its gRPC timeout. Transient errors are
+retried with full-jitter backoff while time remains. With hedging on, a
+call still unanswered after the recent p95 latency of calls its size gets a
+second attempt; the first response wins and the other call is cancelled.
+"""
+import asyncio
+import collections
+import contextvars
+import logging
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from google.api_core import exceptions as google_exceptions
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Worth another attempt; anything else (bad audio, auth, quota config) fails the same way again
+TRANSIENT_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.Aborted,
+)
+
+_deadline = contextvars.ContextVar("upstream_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds):
+    """Run a block with a deadline seconds from now, or the enclosing one if that comes first.
+
+    seconds=None adds no deadline of its own and leaves any enclosing one in place.
+    """
+    current = _deadline.get()
+    at = current if seconds is None else time.monotonic() + seconds
+    if current is not None:
+        at = min(at, current)
+    token = _deadline.set(at)
+    try:
+        yield at
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left before the current deadline; None outside one"""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+class LatencyTracker:
+    """Recent call latencies, bucketed by payload encoding and size (by powers of two)"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(encoding, size):
+        return encoding, int(size).bit_length()
+
+    def observe(self, key, seconds):
+        with self._lock:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = collections.deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, key, percentile):
+        """The percentile of recent latencies for key; None until min_samples are in"""
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100.0))]
+
+
+class UpstreamPolicy:
+    """Timeouts, retries and hedging around one kind of upstream call.
+
+    start(timeout) begins one attempt: for call() it returns a future-like
+    object (done, cancel, add_done_callback, result) such as
+    speech_pool.PendingCall; for call_async() a coroutine. Calls outside a
+    deadline() block get one of default_timeout seconds.
+    """
+
+    def __init__(self, default_timeout=300.0, retries=3, backoff=0.2, max_backoff=5.0,
+                 hedge=False, hedge_percentile=95.0, hedge_min_delay=0.05, tracker=None):
+        self.default_timeout = default_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.latencies = tracker or LatencyTracker()
+        self.random = random.Random()
+
+    def hedge_delay(self, key):
+        """Seconds to wait before hedging a call; None to never hedge it"""
+        if not self.hedge or key is None:
+            return None
+        threshold = self.latencies.percentile(key, self.hedge_percentile)
+        return None if threshold is None else max(threshold, self.hedge_min_delay)
+
+    def _retry_delay(self, attempt, error):
+        """Backoff before attempt number attempt, or raise error if retrying is pointless"""
+        if attempt > self.retries:
+            raise error
+        # Full jitter: callers failing together do not come back together
+        delay = self.random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+        left = remaining()
+        if left is not None and delay >= left:
+            raise error
+        metrics.UPSTREAM_RETRIES.labels(error=type(error).__name__).inc()
+        logger.warning(f"Recognize attempt {attempt} failed ({error}); retrying in {delay:.2f}s")
+        return delay
+
+    def _default_timeout(self):
+        # Only for calls outside any deadline; a longer enclosing one (a job's) is not cut short
+        return self.default_timeout if remaining() is None else None
+
+    def _timeout(self):
+        left = remaining()
+        if left <= 0:
+            raise google_exceptions.DeadlineExceeded("Request deadline passed before the recognize call")
+        return left
+
+    def call(self, start, key=None):
+        """Run start() until an attempt succeeds, the retries run out or the deadline passes"""
+        with deadline(self._default_timeout()):
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    return self._attempt(start, key, self._timeout())
+                except TRANSIENT_ERRORS as e:
+                    time.sleep(self._retry_delay(attempt, e))
+
+    def _attempt(self, start, key, timeout):
+        began = time.monotonic()
+        finished = queue.Queue()
+        calls = [start(timeout)]
+        calls[0].add_done_callback(lambda _, call=calls[0]: finished.put(call))
+        delay = self.hedge_delay(key)
+        failures = 0
+        try:
+            while True:
+                wait = None
+                if delay is not None and len(calls) == 1:
+                    wait = max(0.0, began + delay - time.monotonic())
+                try:
+                    call = finished.get(timeout=wait)
+                except queue.Empty:
+                    hedged = start(self._timeout())
+                    hedged.add_done_callback(lambda _, call=hedged: finished.put(call))
+                    calls.append(hedged)
+                    continue
+                try:
+                    response = call.result()
+                except Exception:
+                    failures += 1
+                    if failures < len(calls):
+                        # The other attempt may still answer
+                        continue
+                    raise
+                if key is not None:
+                    self.latencies.observe(key, time.monotonic() - began)
+                if len(calls) > 1:
+                    metrics.UPSTREAM_HEDGES.labels(winner="first" if call is calls[0] else "hedge").inc()
+                return response
+        finally:
+            for call in calls:
+                if not call.done():
+                    call.cancel()
+
+    async def call_async(self, start, key=None):
+        """Coroutine counterpart of call()"""
+        with deadline(self._default_timeout()):
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    return await self._attempt_async(start, key, self._timeout())
+                except TRANSIENT_ERRORS as e:
+                    await asyncio.sleep(self._retry_delay(attempt, e))
+
+    async def _attempt_async(self, start, key, timeout):
+        began = time.monotonic()
+        tasks = [asyncio.ensure_future(start(timeout))]
+        delay = self.hedge_delay(key)
+        try:
+            pending = set(tasks)
+            while True:
+                wait = None
+                if delay is not None and len(tasks) == 1:
+                    wait = max(0.0, began + delay - time.monotonic())
+                done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = asyncio.ensure_future(start(self._timeout()))
+                    tasks.append(hedged)
+                    pending.add(hedged)
+                    continue
+                for task in done:
+                    if not task.cancelled() and task.exception() is None:
+                        if key is not None:
+                            self.latencies.observe(key, time.monotonic() - began)
+                        if len(tasks) > 1:
+                            metrics.UPSTREAM_HEDGES.labels(winner="first" if task is tasks[0] else "hedge").inc()
+                        return task.result()
+                if not pending:
+                    # Every attempt failed; report the last one
+                    task = done.pop()
+                    if task.cancelled():
+                        raise google_exceptions.Cancelled("Recognize call was cancelled")
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
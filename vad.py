@@ -0,0 +1,183 @@
+"""Speech-activity pruning of decoded PCM.
+
+Frames are scored by level against the recording's own noise floor, and
+stretches with no level changes of the kind speech makes (steady hold
+music, tones) count as non-speech too. Non-speech stretches longer than
+a minimum are cut out of the PCM in place, minus some padding on each
+side, and an OffsetMap takes recognizer timestamps on the pruned audio
+back to the original recording.
+"""
+import bisect
+
+import numpy as np
+
+from chunking import frame_energy, pcm_to_array
+
+FRAME_SECONDS = 0.03
+
+# A frame is speech when it is this far above the noise floor (10th
+# percentile level), but never needs to be within 30 dB of the loud
+# frames (95th percentile), so recordings without pauses keep quiet speech
+FLOOR_PERCENTILE = 10
+LOUD_PERCENTILE = 95
+LOUD_RANGE_DB = 30.0
+# Anything below this is silence whatever the floor
+SILENCE_DB = -70.0
+
+# Speech dips by 10 dB or more between syllables several times a second;
+# a two-second window with fewer dips than the configured ratio is steady sound
+DIP_DB = 10.0
+DIP_WINDOW_SECONDS = 2.0
+
+
+def frame_levels(source, sample_rate, channels=1):
+    """dBFS of consecutive FRAME_SECONDS frames of a PCM file object, read block by block"""
+    frame_size = max(1, int(sample_rate * FRAME_SECONDS))
+    block_bytes = 1000 * frame_size * 2 * channels
+    levels = []
+    for block in iter(lambda: source.read(block_bytes), b""):
+        samples = pcm_to_array(block, channels)
+        if len(samples) >= frame_size:
+            levels.append(frame_energy(samples, frame_size))
+    if not levels:
+        return np.zeros(0)
+    energy = np.concatenate(levels) / (32768.0 * 32768.0)
+    return 10 * np.log10(energy + 1e-10)
+
+
+def speech_mask(levels, margin_db=12.0, dip_ratio=0.05):
+    """Boolean per frame: True where the frame looks like speech"""
+    if not len(levels):
+        return np.zeros(0, dtype=bool)
+    floor, loud = np.percentile(levels, [FLOOR_PERCENTILE, LOUD_PERCENTILE])
+    threshold = max(min(floor + margin_db, loud - LOUD_RANGE_DB), SILENCE_DB)
+    mask = levels > threshold
+
+    window = int(DIP_WINDOW_SECONDS / FRAME_SECONDS)
+    if dip_ratio and len(levels) >= window:
+        # Share of frames in the window around each frame that sit well below the window's peak
+        padded = np.pad(levels, (window // 2, window - window // 2 - 1), mode="edge")
+        windows = np.lib.stride_tricks.sliding_window_view(padded, window)
+        # A few thousand windows at a time keeps the comparison small for hours of audio
+        for start in range(0, len(windows), 8192):
+            block = windows[start:start + 8192]
+            dips = (block < block.max(axis=1, keepdims=True) - DIP_DB).mean(axis=1)
+            mask[start:start + 8192] &= dips >= dip_ratio
+    return mask
+
+
+def keep_segments(mask, frame_size, total, min_silence_frames, padding_frames):
+    """Sample ranges [(start, end)] to keep: everything but non-speech runs of min_silence_frames or more.
+
+    Each removed run gives back padding_frames of itself next to the speech on either side.
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate(([1], mask.astype(np.int8), [1]))))
+    removed = []
+    for start, end in zip(edges[::2], edges[1::2]):
+        if end - start < min_silence_frames:
+            continue
+        cut_start = start + padding_frames if start > 0 else 0
+        cut_end = end - padding_frames if end < len(mask) else None
+        cut_start = cut_start * frame_size
+        cut_end = total if cut_end is None else cut_end * frame_size
+        if cut_end > cut_start:
+            removed.append((cut_start, min(cut_end, total)))
+
+    segments = []
+    position = 0
+    for cut_start, cut_end in removed:
+        if cut_start > position:
+            segments.append((position, cut_start))
+        position = cut_end
+    if position < total:
+        segments.append((position, total))
+    return segments
+
+
+def compact(pcm, segments, frame_bytes, block_size=1024 * 1024):
+    """Move the kept sample ranges of a PCM file object to its front and truncate the rest"""
+    written = 0
+    for start, end in segments:
+        position = start * frame_bytes
+        remaining = (end - start) * frame_bytes
+        while remaining > 0:
+            pcm.seek(position)
+            block = pcm.read(min(block_size, remaining))
+            if not block:
+                break
+            # Never ahead of the read position, so nothing unread is overwritten
+            pcm.seek(written)
+            pcm.write(block)
+            written += len(block)
+            position += len(block)
+            remaining -= len(block)
+    pcm.seek(written)
+    pcm.truncate()
+    return written
+
+
+class OffsetMap:
+    """Times in pruned audio back to times in the original recording"""
+
+    def __init__(self, segments, sample_rate, total):
+        self.original_starts = []
+        self.pruned_starts = []
+        self.lengths = []
+        kept = 0
+        for start, end in segments:
+            self.original_starts.append(start / float(sample_rate))
+            self.pruned_starts.append(kept / float(sample_rate))
+            self.lengths.append((end - start) / float(sample_rate))
+            kept += end - start
+        self.kept_seconds = kept / float(sample_rate)
+        self.original_seconds = total / float(sample_rate)
+        self.removed_seconds = self.original_seconds - self.kept_seconds
+
+    def _segment(self, t, end=False):
+        # An end time right on a cut belongs to the segment before it
+        if end:
+            return max(bisect.bisect_left(self.pruned_starts, t) - 1, 0)
+        return max(bisect.bisect_right(self.pruned_starts, t) - 1, 0)
+
+    def original_time(self, t, end=False):
+        """Original time of pruned time t"""
+        if not self.pruned_starts:
+            return t
+        index = self._segment(t, end)
+        return self.original_starts[index] + (t - self.pruned_starts[index])
+
+    def original_span(self, start, end):
+        """Original (start, end) of a pruned span; one that runs over a cut ends where its first segment does"""
+        if not self.pruned_starts:
+            return start, end
+        index = self._segment(start)
+        if self._segment(end, end=True) != index:
+            end = self.pruned_starts[index] + self.lengths[index]
+        return self.original_time(start), self.original_starts[index] + (end - self.pruned_starts[index])
+
+
+def prune_silence(pcm, sample_rate, channels=1, min_silence_seconds=1.0, padding_seconds=0.3,
+                  margin_db=12.0, dip_ratio=0.05):
+    """Cut long non-speech stretches out of a PCM file object in place; returns the OffsetMap"""
+    frame_size = max(1, int(sample_rate * FRAME_SECONDS))
+    frame_bytes = 2 * channels
+    pcm.seek(0)
+    levels = frame_levels(pcm, sample_rate, channels)
+    total = pcm.tell() // frame_bytes
+    mask = speech_mask(levels, margin_db, dip_ratio)
+    segments = keep_segments(mask, frame_size, total,
+                             max(1, int(round(min_silence_seconds / FRAME_SECONDS))),
+                             int(round(padding_seconds / FRAME_SECONDS)))
+    compact(pcm, segments, frame_bytes)
+    return OffsetMap(segments, sample_rate, total)
+
+
+def remap_results(results, offset_map):
+    """Move result and word timestamps from the pruned audio to the original recording, in place"""
+    for result in results:
+        if result.get("result_end_time") is not None:
+            result["result_end_time"] = offset_map.original_time(result["result_end_time"], end=True)
+        for alternative in result.get("alternatives", []):
+            for word in alternative.get("words", []):
+                word["start_time"], word["end_time"] = offset_map.original_span(word["start_time"], word["end_time"])
+    return results
@@ -0,0 +1,113 @@
+"""Standalone worker that processes jobs queued through POST /jobs.
+
+    python worker.py [--poll-interval 1.0]
+
+Run as many worker processes as upstream quota allows; they scale
+independently of the gunicorn web workers.
+"""
+import argparse
+import io
+import logging
+import signal
+import threading
+import time
+
+from google.api_core.exceptions import DeadlineExceeded
+
+import metrics
+from audio import AudioDecodeError, AudioTooLong
+from server import Config, app, job_queue, metric_labels, speech_clients, transcribe_upload
+
+logger = logging.getLogger("worker")
+
+
+def _heartbeat(queue, job_id, stop, interval):
+    while not stop.wait(interval):
+        if not queue.heartbeat(job_id):
+            logger.warning(f"Lost ownership of job {job_id}")
+            return
+
+
+def process_job(queue, job):
+    """Run one claimed job to completion, keeping its visibility lease alive"""
+    stop = threading.Event()
+    beat = threading.Thread(
+        target=_heartbeat,
+        args=(queue, job.id, stop, max(1.0, queue.visibility_timeout / 3.0)),
+        daemon=True,
+    )
+    beat.start()
+    start = time.time()
+    timer = metrics.start_request("job", *metric_labels(job.language, job.options.get("model", "")))
+    status = "error"
+    try:
+        # Held to the job's own budget, not the HTTP request timeout
+        results, cached = transcribe_upload(io.BytesIO(job.payload), job.filename, job.language, job.options,
+                                            timeout=Config.JOB_TIMEOUT or None)
+        queue.complete(job.id, results)
+        status = "ok"
+        logger.info(f"Job {job.id} done in {time.time() - start:.2f}s (cached={cached})")
+    except AudioTooLong as e:
+        status = "rejected"
+        queue.fail(job.id, str(e), retry=False)
+    except AudioDecodeError as e:
+        # Retrying will not make a corrupt upload decodable
+        status = "rejected"
+        queue.fail(job.id, f"Could not decode audio: {e}", retry=False)
+    except DeadlineExceeded as e:
+        # The same audio would run out of time again, at the cost of another attempt's recognize quota
+        status = "timeout"
+        logger.error(f"Job {job.id} ran past its deadline: {e}")
+        queue.fail(job.id, f"Recognition did not finish within the job timeout: {e}", retry=False)
+    except Exception as e:
+        logger.exception(f"Job {job.id} failed")
+        queue.fail(job.id, str(e))
+    finally:
+        timer.finish(status)
+        stop.set()
+        beat.join()
+
+
+def run(queue, poll_interval=1.0, stop=None):
+    """Claim and process jobs until stop is set"""
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        try:
+            queue.requeue_expired()
+            job = queue.claim()
+        except Exception as e:
+            logger.warning(f"Job queue error: {e}")
+            stop.wait(poll_interval)
+            continue
+        if job is None:
+            stop.wait(poll_interval)
+            continue
+        logger.info(f"Claimed job {job.id} (attempt {job.attempts})")
+        process_job(queue, job)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process queued transcription jobs")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    if job_queue is None:
+        raise SystemExit("Redis is not configured; set REDIS_URL")
+
+    stop = threading.Event()
+
+    def shutdown(signum, frame):
+        # Finish the current job, then exit
+        logger.info("Shutting down after the current job")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    speech_clients.warmup()
+    app.logger.info("Worker started")
+    run(job_queue, args.poll_interval, stop)
+
+
+if __name__ == "__main__":
+    main()